@@ -1,53 +1,603 @@
 # coding: utf-8
+import time
+import sys
 import sublime, sublime_plugin
-import itertools
 
 ST3 = int(sublime.version()) >= 3000
-if not ST3:
+if ST3:
+    from .todo_parser import Outline, with_context, fold_ranges
+else:
     import locale
+    from todo_parser import Outline, with_context, fold_ranges
 
 
-def get_all_projects_and_separators(view):
-    # because tmLanguage need \n to make background full width of window
-    # multiline headers are possible, thus we have to split em to be sure that
-    # one header == one line
-    projects = itertools.chain(*[view.lines(r) for r in view.find_by_selector('keyword.control.header.todo')])
-    return sorted(list(projects) +
-                  view.find_by_selector('meta.punctuation.separator.todo'))
+# {module name: seconds spent on its import}
+IMPORT_TIMES = {}
 
 
-class PlainTasksBase(sublime_plugin.TextCommand):
-    def run(self, edit, **kwargs):
-        settings = self.view.settings()
+class ImportTimer(object):
+    '''finder on sys.meta_path which times imports of modules of package loaded after this one,
+    until plugin_loaded; time of module includes modules it imports for the first time,
+    so only the outermost imports are recorded'''
+    def __init__(self, package):
+        self.prefix, self.depth = package + '.', 0
+
+    def find_spec(self, fullname, path=None, target=None):
+        if not fullname.startswith(self.prefix):
+            return None
+        for finder in sys.meta_path:
+            find_spec = finder is not self and getattr(finder, 'find_spec', None)
+            spec = find_spec and find_spec(fullname, path, target)
+            if spec:
+                if hasattr(spec.loader, 'exec_module'):
+                    spec.loader = TimedLoader(self, spec.loader)
+                return spec
+        return None
+
+    def find_module(self, fullname, path=None):
+        '''python 3.3 asks finders for loader'''
+        if not fullname.startswith(self.prefix):
+            return None
+        for finder in sys.meta_path:
+            find_module = finder is not self and getattr(finder, 'find_module', None)
+            loader = find_module and find_module(fullname, path)
+            if loader:
+                return TimedLoader(self, loader)
+        return None
+
+    def timed(self, name, load, argument):
+        self.depth += 1
+        started = time.time()
+        try:
+            return load(argument)
+        finally:
+            self.depth -= 1
+            if not self.depth:
+                IMPORT_TIMES[name.rpartition('.')[2]] = time.time() - started
+
+
+class TimedLoader(object):
+    '''loader found by other finders, whose loading is timed'''
+    def __init__(self, timer, loader):
+        self.timer, self.loader = timer, loader
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def exec_module(self, module):
+        return self.timer.timed(module.__name__, self.loader.exec_module, module)
+
+    def load_module(self, fullname):
+        return self.timer.timed(fullname, self.loader.load_module, fullname)
+
+
+IMPORT_TIMER = ImportTimer(__package__) if ST3 and __package__ else None
+if IMPORT_TIMER:
+    sys.meta_path.insert(0, IMPORT_TIMER)
+
+
+def stop_import_timer():
+    if IMPORT_TIMER in sys.meta_path:
+        sys.meta_path.remove(IMPORT_TIMER)
 
-        self.taskpaper_compatible = settings.get('taskpaper_compatible', False)
+
+def plugin_loaded():
+    '''report import time per module if all together exceed startup_budget (ms);
+    on ST2 it is never called, so nothing is reported'''
+    stop_import_timer()
+    watch_global_settings()
+    budget = sublime.load_settings('PlainTasks.sublime-settings').get('startup_budget', 100)
+    total = sum(IMPORT_TIMES.values()) * 1000
+    if budget is None or total <= budget:
+        return
+    print(u'PlainTasks: startup took {0:.1f} ms, budget is {1} ms'.format(total, budget))
+    for name, seconds in sorted(IMPORT_TIMES.items(), key=lambda i: -i[1]):
+        print(u'\t{0:.1f} ms\t{1}'.format(seconds * 1000, name))
+
+
+def plugin_unloaded():
+    stop_import_timer()
+    cancel_jobs()
+    for name in GLOBAL_SETTINGS:
+        sublime.load_settings(name).clear_on_change('plain_tasks_snapshot')
+    for window in sublime.windows():
+        for view in window.views():
+            view.settings().clear_on_change('plain_tasks_snapshot')
+
+
+class PlainTasksSettings(object):
+    '''Snapshot of settings used by commands and listeners, one per view;
+    dropped when any value it read changes, see settings_snapshot'''
+    def __init__(self, settings):
+        read = self.read = {}  # {key: (default, value)}
+
+        def get(key, default=None):
+            value = settings.get(key, default)
+            read[key] = (default, value)
+            return value
+
+        self.taskpaper_compatible = get('taskpaper_compatible', False)
         if self.taskpaper_compatible:
             self.open_tasks_bullet = self.done_tasks_bullet = self.canc_tasks_bullet = '-'
             self.before_date_space = ''
         else:
-            self.open_tasks_bullet = settings.get('open_tasks_bullet', u'☐')
-            self.done_tasks_bullet = settings.get('done_tasks_bullet', u'✔')
-            self.canc_tasks_bullet = settings.get('cancelled_tasks_bullet', u'✘')
-            self.before_date_space = settings.get('before_date_space', ' ')
+            self.open_tasks_bullet = get('open_tasks_bullet', u'☐')
+            self.done_tasks_bullet = get('done_tasks_bullet', u'✔')
+            self.canc_tasks_bullet = get('cancelled_tasks_bullet', u'✘')
+            self.before_date_space = get('before_date_space', ' ')
 
-        translate_tabs_to_spaces = settings.get('translate_tabs_to_spaces', False)
-        self.before_tasks_bullet_spaces = ' ' * settings.get('before_tasks_bullet_margin', 1) if not self.taskpaper_compatible and translate_tabs_to_spaces else '\t'
-        self.tasks_bullet_space = settings.get('tasks_bullet_space', ' ' if self.taskpaper_compatible or translate_tabs_to_spaces else '\t')
+        translate_tabs_to_spaces = get('translate_tabs_to_spaces', False)
+        self.before_tasks_bullet_spaces = ' ' * get('before_tasks_bullet_margin', 1) if not self.taskpaper_compatible and translate_tabs_to_spaces else '\t'
+        self.tasks_bullet_space = get('tasks_bullet_space', ' ' if self.taskpaper_compatible or translate_tabs_to_spaces else '\t')
 
-        self.date_format = settings.get('date_format', '(%y-%m-%d %H:%M)')
-        if settings.get('done_tag', True) or self.taskpaper_compatible:
+        self.date_format = get('date_format', '(%y-%m-%d %H:%M)')
+        bare_format = self.date_format.strip('(  )')
+        self.yearfirst = bare_format.startswith(('%y', '%Y'))
+        self.dayfirst = bare_format.startswith('%d')
+        if get('done_tag', True) or self.taskpaper_compatible:
             self.done_tag = "@done"
             self.canc_tag = "@cancelled"
         else:
             self.done_tag = ""
             self.canc_tag = ""
-        self.done_date = settings.get('done_date', True)
+        self.done_date = get('done_date', True)
 
-        self.project_postfix = settings.get('project_tag', True)
-        self.archive_name = settings.get('archive_name', 'Archive:')
-        # org-mode style archive stuff
+        self.project_postfix = get('project_tag', True)
+        self.archive_name = get('archive_name', 'Archive:')
         self.archive_org_default_filemask = u'{dir}{sep}{base}_archive{ext}'
-        self.archive_org_filemask = settings.get('archive_org_filemask', self.archive_org_default_filemask)
+        self.archive_org_filemask = get('archive_org_filemask', self.archive_org_default_filemask)
+        self.header_to_task = get('header_to_task', False)
+        self.new_on_top = get('new_on_top', True)
+        self.decimal_minutes = get('decimal_minutes', False)
+
+        self.stats_format = get('stats_format', '$n/$a done ($percent%) $progress Last task @done $last')
+        self.stats_ignore_archive = get('stats_ignore_archive', False)
+        self.bar_full = get('bar_full', u'■')
+        self.bar_empty = get('bar_empty', u'□')
+        self.replace_stats_chars = get('replace_stats_chars', [])
+
+        self.icon_critical = get('icon_critical', '')
+        self.icon_high = get('icon_high', '')
+        self.icon_low = get('icon_low', '')
+        self.icon_today = get('icon_today', '')
+
+        self.highlight_past_due = get('highlight_past_due', True)
+        self.highlight_due_soon = get('highlight_due_soon', 24)
+        self.scope_past_due = get('scope_past_due', 'string.other.tag.todo.critical')
+        self.scope_due_soon = get('scope_due_soon', 'string.other.tag.todo.high')
+        self.scope_misformatted = get('scope_misformatted', 'string.other.tag.todo.low')
+        self.icon_past_due = get('icon_past_due', 'circle')
+        self.icon_due_soon = get('icon_due_soon', 'dot')
+        self.icon_misformatted = get('icon_misformatted', '')
+        self.show_remain_due = get('show_remain_due', False)
+        self.show_calendar_on_tags = get('show_calendar_on_tags', False)
+        self.due_preview_offset = get('due_preview_offset', 0)
+        self.due_remain_format = get('due_remain_format', '{time} remaining')
+        self.due_overdue_format = get('due_overdue_format', '{time} overdue')
+
+    def changed(self, settings):
+        '''whether any value read by snapshot differs in settings'''
+        return any(settings.get(key, default) != value for key, (default, value) in self.read.items())
+
+
+# [(name, {key: value}, per, derived, on_drop)] state kept by modules per 'view', 'buffer' or 'file';
+# derived state is rebuilt on demand, so it may be evicted, see enforce_budget
+STATES = []
+# {buffer_id: time.time()} of last use of derived state of buffer, least recent is evicted first
+BUFFER_USED = {}
+# {(name of state, key, key in value, version): bytes} of tracked state values, see state_sizes
+STATE_SIZES = {}
+
+
+def track_state(name, states, per, derived=False, on_drop=None):
+    '''Register dict of state kept per view, buffer or file, so its entries are dropped on close
+    and reported; on_drop(key, value) is called for each dropped entry; Return states'''
+    STATES[:] = [s for s in STATES if s[0] != name]  # registered again on reload of module
+    STATES.append((name, states, per, derived, on_drop))
+    return states
+
+
+def drop_state(per, key, derived_only=False):
+    for name, states, kind, derived, on_drop in STATES:
+        if kind == per and key in states and (derived or not derived_only):
+            value = states.pop(key)
+            if on_drop:
+                on_drop(key, value)
+
+
+def estimate_size(value):
+    '''bytes held by value and objects it refers to, as sys.getsizeof sees them;
+    classes, functions, modules and API objects are shared, they are not counted'''
+    seen, stack, total = set(), [value], 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, SHARED_TYPES) or callable(obj):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        else:
+            slots = getattr(type(obj), '__slots__', ())
+            stack.extend(getattr(obj, n) for n in ((slots,) if isinstance(slots, str) else slots) if hasattr(obj, n))
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+    return total
+
+
+SHARED_TYPES = (type(sys), sublime.View, sublime.Window, sublime.Region)
+
+
+def state_versions():
+    '''Return {(per, id): change count} of open views and their buffers'''
+    versions = {}
+    for window in sublime.windows():
+        for view in window.views():
+            version = view.change_count()
+            versions[('view', view.id())] = versions[('buffer', view.buffer_id())] = version
+    return versions
+
+
+def state_sizes():
+    '''Return [(name, per, key, derived, bytes)] of all tracked state; values of state
+    (and of dicts in it) are estimated once per version of their view or buffer,
+    values of file state are (version, value) themselves'''
+    versions, sizes, rows = state_versions(), {}, []
+    for name, states, per, derived, _ in STATES:
+        for key, value in list(states.items()):
+            if per == 'file':
+                version = value[0] if isinstance(value, tuple) else None
+            else:
+                version = versions.get((per, key))
+            parts = list(value.items()) if isinstance(value, dict) else [(None, value)]
+            size = sys.getsizeof(value) if isinstance(value, dict) else 0
+            for part_key, part in parts:
+                size_key = (name, key, part_key, version)
+                if size_key not in sizes:
+                    sizes[size_key] = STATE_SIZES[size_key] if size_key in STATE_SIZES else estimate_size(part)
+                size += sizes[size_key] + (sys.getsizeof(part_key) if part_key is not None else 0)
+            rows.append((name, per, key, derived, size))
+    STATE_SIZES.clear()
+    STATE_SIZES.update(sizes)
+    return rows
+
+
+def foreground_buffers():
+    '''ids of buffers shown in any group of any window'''
+    found = set()
+    for window in sublime.windows():
+        for group in range(window.num_groups()):
+            view = window.active_view_in_group(group)
+            if view is not None:
+                found.add(view.buffer_id())
+    return found
+
+
+def enforce_budget(budget=None):
+    '''While state exceeds budget (cache_budget setting, megabytes), evict derived state of least
+    recently used background buffers, and then of files; Return ids of evicted buffers'''
+    if budget is None:
+        budget = sublime.load_settings('PlainTasks.sublime-settings').get('cache_budget', 64)
+        if budget is None:
+            return []
+    rows = state_sizes()
+    excess = sum(row[4] for row in rows) - budget * 1024 * 1024
+    if excess <= 0:
+        return []
+    foreground, derived = foreground_buffers(), {}
+    for name, per, key, is_derived, size in rows:
+        if per == 'buffer' and is_derived and key not in foreground:
+            derived[key] = derived.get(key, 0) + size
+    evicted = []
+    for buffer_id in sorted(derived, key=lambda b: BUFFER_USED.get(b, 0)):
+        if excess <= 0:
+            break
+        drop_state('buffer', buffer_id, derived_only=True)
+        BUFFER_USED.pop(buffer_id, None)
+        excess -= derived[buffer_id]
+        evicted.append(buffer_id)
+    if excess > 0:
+        for name, states, per, is_derived, _ in STATES:
+            if per == 'file' and is_derived:
+                for path in list(states):
+                    drop_state('file', path)
+    return evicted
+
+
+# {view_id: PlainTasksSettings}
+SETTINGS_SNAPSHOTS = track_state('settings snapshots', {}, 'view')
+# views whose settings already have on_change callback
+SETTINGS_WATCHED = set()
+# changes in these files may not reach on_change of view settings
+GLOBAL_SETTINGS = ('PlainTasks.sublime-settings', 'Preferences.sublime-settings')
+
+
+def settings_snapshot(view):
+    '''Return PlainTasksSettings of view, settings are read only after they changed'''
+    view_id = view.id()
+    snapshot = SETTINGS_SNAPSHOTS.get(view_id)
+    if snapshot is None:
+        settings = view.settings()
+        if view_id not in SETTINGS_WATCHED:
+            SETTINGS_WATCHED.add(view_id)
+            settings.add_on_change('plain_tasks_snapshot', lambda: snapshot_changed(view_id, settings))
+        snapshot = SETTINGS_SNAPSHOTS[view_id] = PlainTasksSettings(settings)
+    return snapshot
+
+
+def snapshot_changed(view_id, settings):
+    '''drop snapshot only if value of its key changed, plugin writes to view settings too'''
+    snapshot = SETTINGS_SNAPSHOTS.get(view_id)
+    if snapshot is not None and snapshot.changed(settings):
+        del SETTINGS_SNAPSHOTS[view_id]
+
+
+def watch_global_settings():
+    for name in GLOBAL_SETTINGS:
+        sublime.load_settings(name).add_on_change('plain_tasks_snapshot', SETTINGS_SNAPSHOTS.clear)
+
+
+BUDGET_DELAY = 2000  # ms after the last switch of views, budget is enforced once for quick switches
+
+
+class PlainTasksViewStates(sublime_plugin.EventListener):
+    '''drop state of closed view, and of its buffer if it was the last view of it;
+    when views go to background, keep derived state of background buffers within budget'''
+    closing = {}  # {view_id: buffer_id}, closed view may not be asked for its buffer
+    deactivations = 0
+
+    def on_pre_close(self, view):
+        self.closing[view.id()] = view.buffer_id()
+        if view.id() in SETTINGS_WATCHED:
+            view.settings().clear_on_change('plain_tasks_snapshot')
+
+    def on_close(self, view):
+        view_id = view.id()
+        buffer_id = self.closing.pop(view_id, None)
+        drop_state('view', view_id)
+        SETTINGS_WATCHED.discard(view_id)
+        cancel_jobs(view)
+        if buffer_id is not None and not any(v.buffer_id() == buffer_id for w in sublime.windows() for v in w.views()):
+            drop_state('buffer', buffer_id)
+            BUFFER_USED.pop(buffer_id, None)
+
+    def on_deactivated(self, view):
+        if len(BUFFER_USED) > 1:
+            PlainTasksViewStates.deactivations += 1
+            deactivations = self.deactivations
+            sublime.set_timeout(lambda: deactivations == self.deactivations and enforce_budget(), BUDGET_DELAY)
+
+
+# {buffer_id: {name: (version, value)}}
+BUFFER_CACHE = track_state('derived data', {}, 'buffer', derived=True)
+
+
+def buffer_cached(view, name, build, extra=None):
+    '''Return build(view), it is called once per version of buffer (and extra if any)'''
+    buffer_id = view.buffer_id()
+    BUFFER_USED[buffer_id] = time.time()
+    entries = BUFFER_CACHE.setdefault(buffer_id, {})
+    version = (view.change_count(), extra)
+    cached = entries.get(name)
+    if cached and cached[0] == version:
+        return cached[1]
+    value = build(view)
+    entries[name] = (version, value)
+    return value
+
+
+def buffer_cache_put(view, name, value, extra=None):
+    '''store value computed elsewhere (e.g. in worker) for current version of buffer,
+    buffer_cached returns it then'''
+    buffer_id = view.buffer_id()
+    BUFFER_USED[buffer_id] = time.time()
+    BUFFER_CACHE.setdefault(buffer_id, {})[name] = ((view.change_count(), extra), value)
+
+
+def buffer_outline(view):
+    '''Return Outline of current version of buffer, text is taken once per version'''
+    return buffer_cached(view, 'outline', build_outline)
+
+
+# {buffer_id: (change count of cached outline, [(a, b, string)], change count after edits)}
+OUTLINE_EDITS = track_state('outline edits', {}, 'buffer', derived=True)
+OUTLINE_EDITS_LIMIT = 1000
+
+
+def build_outline(view):
+    '''Patch outline of previous version with edits recorded since then if possible (ST4),
+    otherwise take the whole text of buffer'''
+    buffer_id, version = view.buffer_id(), view.change_count()
+    cached = BUFFER_CACHE.get(buffer_id, {}).get('outline')
+    edits = OUTLINE_EDITS.pop(buffer_id, None)
+    outline = None
+    if cached and edits and edits[0] == cached[0][0] and edits[2] == version:
+        outline = cached[1]
+        for a, b, string in edits[1]:
+            outline = outline.edit(a, b, string)
+        if len(outline.text) != view.size():
+            outline = None
+    if outline is None:
+        outline = Outline(view.substr(sublime.Region(0, view.size())))
+    if TextChangeListener is not object:
+        OUTLINE_EDITS[buffer_id] = (version, [], version)
+    return outline
+
+
+TextChangeListener = getattr(sublime_plugin, 'TextChangeListener', object)
+TODO_SYNTAXES = ('Packages/PlainTasks/PlainTasks.sublime-syntax', 'Packages/PlainTasks/PlainTasks.tmLanguage')
+
+
+class PlainTasksOutlineEdits(TextChangeListener):
+    '''record edits of buffers with cached outline, it is patched on next use (ST4 only);
+    attached to every buffer, because syntax of file opened from disk is not assigned yet
+    when applicability is decided, edits of other buffers are dropped in on_text_changed'''
+    @classmethod
+    def is_applicable(cls, buffer):
+        return True
+
+    def on_text_changed(self, changes):
+        buffer_id = self.buffer.id()
+        if buffer_id not in OUTLINE_EDITS:
+            return
+        start, edits, _ = OUTLINE_EDITS[buffer_id]
+        edits.extend((c.a.pt, c.b.pt, c.str) for c in changes)
+        view = self.buffer.primary_view()
+        if view is None or len(edits) > OUTLINE_EDITS_LIMIT:
+            del OUTLINE_EDITS[buffer_id]
+        else:
+            OUTLINE_EDITS[buffer_id] = (start, edits, view.change_count())
+
+
+# {view_id: {key: (scope, icon, flags)}} of regions as they were last added
+REGION_STYLES = track_state('region styles', {}, 'view')
+
+
+def update_regions(view, key, ranges, scope='', icon='', flags=0):
+    '''add_regions only if sorted (start, end) ranges or style differ from those in view,
+    so refreshing unchanged regions neither redraws gutter nor flickers'''
+    styles = REGION_STYLES.setdefault(view.id(), {})
+    style = (scope, icon, flags)
+    if [(r.a, r.b) for r in view.get_regions(key)] == ranges and (not ranges or styles.get(key) == style):
+        return False
+    view.add_regions(key, [sublime.Region(a, b) for a, b in ranges], scope, icon, flags)
+    styles[key] = style
+    return True
+
+
+def analyse_async(view, kind, analyse, apply):
+    '''Call analyse(outline) in worker thread and then apply(result) in main thread,
+    result is discarded if buffer was modified meanwhile'''
+    version = view.change_count()
+    outline = buffer_outline(view)
+
+    def finish(result):
+        if (not ST3 or view.is_valid()) and view.change_count() == version:
+            apply(result)
+
+    start_job(view, kind, lambda job: analyse(outline), finish, quiet=True)
+
+
+class Cancelled(Exception):
+    '''raised by Job.check in worker of cancelled or superseded job'''
+
+
+class Job(object):
+    '''Operation running in worker thread, cancellation is cooperative:
+    worker calls check() or progress() in its loops, they raise Cancelled'''
+    def __init__(self, view, kind, label, quiet=False):
+        self.view = view
+        self.kind = kind
+        self.label = label
+        self.quiet = quiet
+        self.cancelled = False
+        self.started = time.time()
+        self.elapsed = None
+        self.thread = None
+        self.reported = 0
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled()
+
+    def progress(self, done=None, total=None, label=None):
+        '''show progress in status bar, not more often than ten times per second'''
+        self.check()
+        if label:
+            self.label = label
+        now = time.time()
+        if self.quiet or now - self.reported < .1:
+            return
+        self.reported = now
+        msg = u'{0}… {1}%'.format(self.label, done * 100 // total) if total else u'{0}…'.format(self.label)
+        sublime.set_timeout(lambda: self.cancelled or self.view.set_status(job_status_key(self.kind), msg), 0)
+
+    def wait(self):
+        if self.thread:
+            self.thread.join()
+
+
+# {(view_id, kind): Job}, only running ones
+JOBS = {}
+# last finished jobs, (kind, label, seconds, outcome)
+JOB_HISTORY = []
+JOB_HISTORY_SIZE = 100
+
+
+def job_status_key(kind):
+    return 'plain_tasks_job_' + kind
+
+
+def start_job(view, kind, work, finish=None, label=None, quiet=False):
+    '''Call work(job) in new thread and then finish(result) in main thread;
+    job of the same kind already running in view is cancelled, i.e. superseded'''
+    import threading
+    key = (view.id(), kind)
+    if key in JOBS:
+        JOBS[key].cancel()
+    job = JOBS[key] = Job(view, kind, label or kind, quiet)
+
+    def end(outcome, result):
+        if JOBS.get(key) is not job:
+            return  # superseded after work returned, its result is stale
+        del JOBS[key]
+        view.erase_status(job_status_key(kind))
+        if outcome == 'done' and not job.cancelled and finish:
+            finish(result)
+
+    def run():
+        outcome, result = 'failed', None
+        try:
+            result = work(job)
+            outcome = 'cancelled' if job.cancelled else 'done'
+        except Cancelled:
+            outcome = 'cancelled'
+        finally:
+            job.elapsed = time.time() - job.started
+            JOB_HISTORY.append((kind, job.label, job.elapsed, outcome))
+            del JOB_HISTORY[:-JOB_HISTORY_SIZE]
+            sublime.set_timeout(lambda: end(outcome, result), 0)
+
+    job.thread = threading.Thread(target=run, name='PlainTasks ' + kind)
+    job.thread.start()
+    return job
+
+
+def cancel_jobs(view=None):
+    '''cancel all running jobs of view or all at all'''
+    for (view_id, _), job in list(JOBS.items()):
+        if view is None or view_id == view.id():
+            job.cancel()
+
+
+class PlainTasksBase(sublime_plugin.TextCommand):
+    def run(self, edit, **kwargs):
+        settings = self.settings = settings_snapshot(self.view)
+
+        self.taskpaper_compatible = settings.taskpaper_compatible
+        self.open_tasks_bullet = settings.open_tasks_bullet
+        self.done_tasks_bullet = settings.done_tasks_bullet
+        self.canc_tasks_bullet = settings.canc_tasks_bullet
+        self.before_date_space = settings.before_date_space
+        self.before_tasks_bullet_spaces = settings.before_tasks_bullet_spaces
+        self.tasks_bullet_space = settings.tasks_bullet_space
+
+        self.date_format = settings.date_format
+        self.done_tag = settings.done_tag
+        self.canc_tag = settings.canc_tag
+        self.done_date = settings.done_date
+
+        self.project_postfix = settings.project_postfix
+        self.archive_name = settings.archive_name
+        # org-mode style archive stuff
+        self.archive_org_default_filemask = settings.archive_org_default_filemask
+        self.archive_org_filemask = settings.archive_org_filemask
 
         if not ST3:
             self.sys_enc = locale.getpreferredencoding()
@@ -70,42 +620,28 @@ class PlainTasksEnabled(sublime_plugin.TextCommand):
 
 
 class PlainTasksFold(PlainTasksEnabled):
-    def exec_folding(self, visible_region):
-        self.view.unfold(sublime.Region(0, self.view.size()))
-        for i, d in enumerate(visible_region):
-            if not i:  # beginning of document
-                self.folding(0, d.a - 1)
-            else:  # all regions within
-                self.folding(visible_region[i-1].b + 1, d.a - 1)
-        if d:  # ending of document
-            self.folding(d.b + 1, self.view.size())
-
-    def folding(self, start, end):
-        if start < end:
-            self.view.fold(sublime.Region(start, end))
-
-    def add_projects_and_notes(self, task_regions):
-        '''Context is important, if task has note and belongs to projects, make em visible'''
-        def add_note(region):
-            # refactor: method in ArchiveCommand
-            next_line_begins = region.end() + 1
-            while self.view.scope_name(next_line_begins) == 'text.todo notes.todo ':
-                note = self.view.line(next_line_begins)
-                if note not in task_regions:
-                    task_regions.append(note)
-                next_line_begins = self.view.line(next_line_begins).end() + 1
-
-        projects = [r for r in get_all_projects_and_separators(self.view) if r.a < task_regions[~0].a]
-        for d in reversed(task_regions):
-            add_note(d)
-            for p in reversed(projects):
-                # refactor: different implementation in ArchiveCommand
-                project_block = self.view.indented_region(p.end() + 1)
-                due_block     = self.view.indented_region(d.begin())
-                if all((p not in task_regions, project_block.contains(due_block))):
-                    task_regions.append(p)
-                    add_note(p)
-                if self.view.indented_region(p.begin()).empty():
-                    break
-        task_regions.sort()
-        return task_regions
+    def fold_lines(self, outline, lines):
+        '''Fold everything but given lines (indexes in outline) and their context'''
+        tab_size = self.view.settings().get('tab_size', 4)
+        visible = [(outline.starts[i], outline.line_end(i)) for i in with_context(outline, lines, tab_size)]
+        self.exec_folding(fold_ranges(visible, len(outline.text)))
+
+    def exec_folding(self, folds):
+        '''touch only folds which differ from current ones'''
+        regions = [sublime.Region(a, b) for a, b in folds]
+        if not ST3:
+            self.view.unfold(sublime.Region(0, self.view.size()))
+            return self.view.fold(regions)
+        planned = set(folds)
+        current = self.view.folded_regions()
+        folded = set((r.a, r.b) for r in current)
+        stale = [r for r in current if (r.a, r.b) not in planned]
+        if stale:
+            self.view.unfold(stale)
+        new = [r for r in regions if (r.a, r.b) not in folded]
+        if new:
+            self.view.fold(new)
+
+
+if not ST3:
+    watch_global_settings()
@@ -4,9 +4,7 @@
 import sublime, sublime_plugin
 import os
 import re
-import webbrowser
 import itertools
-import threading
 from datetime import datetime, tzinfo, timedelta
 import time
 
@@ -14,9 +12,11 @@ platform = sublime.platform()
 ST3 = int(sublime.version()) >= 3000
 
 if ST3:
-    from .APlainTasksCommon import PlainTasksBase, PlainTasksFold, get_all_projects_and_separators
+    from .APlainTasksCommon import PlainTasksBase, PlainTasksFold, settings_snapshot, analyse_async, buffer_cached, buffer_outline, start_job, cancel_jobs, job_status_key, JOBS, update_regions, track_state
+    from .todo_parser import HEADER, OPEN, DONE, CANCELLED, priority_tags, tag_counts, count_changes, TagTrie
 else:
-    from APlainTasksCommon import PlainTasksBase, PlainTasksFold, get_all_projects_and_separators
+    from APlainTasksCommon import PlainTasksBase, PlainTasksFold, settings_snapshot, analyse_async, buffer_cached, buffer_outline, start_job, cancel_jobs, job_status_key, JOBS, update_regions, track_state
+    from todo_parser import HEADER, OPEN, DONE, CANCELLED, priority_tags, tag_counts, count_changes, TagTrie
     sublime_plugin.ViewEventListener = object
 
 # io is not operable in ST2 on Linux, but in all other cases io is better
@@ -27,8 +27,6 @@ else:
     import io
 
 NT = platform == 'windows'
-if NT:
-    import subprocess
 
 if ST3:
     from datetime import timezone
@@ -78,7 +76,7 @@ class PlainTasksNewCommand(PlainTasksBase):
         # list for ST3 support;
         # reversed because with multiple selections regions would be messed up after first iteration
         regions = itertools.chain(*(reversed(self.view.lines(region)) for region in reversed(list(self.view.sel()))))
-        header_to_task = self.view.settings().get('header_to_task', False)
+        header_to_task = self.settings.header_to_task
         # ST3 (3080) moves sel when call view.replace only by delta between original and
         # new regions, so if sel is not in eol and we replace line with two lines,
         # then cursor won’t be on next line as it should
@@ -155,8 +153,8 @@ class PlainTasksCompleteCommand(PlainTasksBase):
         done_line_end, now = self.format_line_end(self.done_tag, tznow())
         offset = len(done_line_end)
         rom = r'^(\s*)(\[\s\]|.)(\s*.*)$'
-        rdm = r'''
-            (?x)^(\s*)(\[x\]|.)                           # 0,1 indent & bullet
+        rdm = r'''(?x)
+            ^(\s*)(\[x\]|.)                               # 0,1 indent & bullet
             (\s*[^\b]*?(?:[^\@]|(?<!\s)\@|\@(?=\s))*?\s*) #   2 very task
             (?=
               ((?:\s@done|@project|@[wl]asted|$).*)   # 3 ending either w/ done or w/o it & no date
@@ -317,16 +315,15 @@ class PlainTasksCancelCommand(PlainTasksBase):
 
 class PlainTasksArchiveCommand(PlainTasksBase):
     def runCommand(self, edit, partial=False):
-        rds = 'meta.item.todo.completed'
-        rcs = 'meta.item.todo.cancelled'
-
         # finding archive section
         archive_pos = self.view.find(self.archive_name, 0, sublime.LITERAL)
 
+        outline = buffer_outline(self.view)
+        tab_size = self.view.settings().get('tab_size', 4)
         if partial:
-            all_tasks = self.get_archivable_tasks_within_selections()
+            all_tasks = self.get_archivable_tasks_within_selections(outline)
         else:
-            all_tasks = self.get_all_archivable_tasks(archive_pos, rds, rcs)
+            all_tasks = self.archivable_tasks(outline, archive_pos.a if archive_pos and archive_pos.a > 0 else self.view.size())
 
         if not all_tasks:
             sublime.status_message('Nothing to archive')
@@ -338,15 +335,12 @@ class PlainTasksArchiveCommand(PlainTasksBase):
                 self.view.insert(edit, self.view.size(), create_archive)
                 line = self.view.size()
 
-            projects = get_all_projects_and_separators(self.view)
-
             # adding tasks to archive section
-            for task in all_tasks:
-                line_content = self.view.substr(task)
+            for index in all_tasks:
+                line_content = outline.line(index)
                 match_task = re.match(r'^\s*(\[[x-]\]|.)(\s+.*$)', line_content, re.U)
-                current_scope = self.view.scope_name(task.a)
-                if rds in current_scope or rcs in current_scope:
-                    pr = self.get_task_project(task, projects)
+                if outline.kinds[index] in (DONE, CANCELLED):
+                    pr = self.task_project(outline, index, tab_size)
                     if self.project_postfix:
                         eol = u'{0}{1}{2}{3}\n'.format(
                             self.before_tasks_bullet_spaces,
@@ -364,78 +358,43 @@ class PlainTasksArchiveCommand(PlainTasksBase):
                 line += self.view.insert(edit, line, eol)
 
             # remove moved tasks (starting from the last one otherwise it screw up regions after the first delete)
-            for task in reversed(all_tasks):
-                self.view.erase(edit, self.view.full_line(task))
+            for index in reversed(all_tasks):
+                self.view.erase(edit, self.view.full_line(outline.starts[index]))
             self.view.run_command('plain_tasks_sort_by_date')
 
-    def get_task_project(self, task, projects):
-        index = -1
-        for ind, pr in enumerate(projects):
-            if task < pr:
-                if ind > 0:
-                    index = ind-1
-                break
-        #if there is no projects for task - return empty string
-        if index == -1:
-            return ''
-
-        prog = re.compile(r'^\n*(\s*)(.+):(?=\s|$)\s*(\@[^\s]+(\(.*?\))?\s*)*')
-        hierarhProject = ''
-
-        if index >= 0:
-            depth = re.match(r"\s*", self.view.substr(self.view.line(task))).group()
-            while index >= 0:
-                strProject = self.view.substr(projects[index])
-                if prog.match(strProject):
-                    spaces = prog.match(strProject).group(1)
-                    if len(spaces) < len(depth):
-                        hierarhProject = prog.match(strProject).group(2) + ((" / " + hierarhProject) if hierarhProject else '')
-                        depth = spaces
-                        if len(depth) == 0:
-                            break
-                else:
-                    sep = re.compile(r'(^\s*)---.{3,5}---+$')
-                    spaces = sep.match(strProject).group(1)
-                    if len(spaces) < len(depth):
-                        depth = spaces
-                        if len(depth) == 0:
-                            break
-                index -= 1
-        if not hierarhProject:
-            return ''
-        else:
-            return hierarhProject
-
-    def get_task_note(self, task, tasks):
-        note_line = task.end() + 1
-        while self.view.scope_name(note_line) == 'text.todo notes.todo ':
-            note = self.view.line(note_line)
-            if note not in tasks:
-                tasks.append(note)
-            note_line = self.view.line(note_line).end() + 1
-
-    def get_all_archivable_tasks(self, archive_pos, rds, rcs):
-        done_tasks = [i for i in self.view.find_by_selector(rds) if i.a < (archive_pos.a if archive_pos and archive_pos.a > 0 else self.view.size())]
-        for i in done_tasks:
-            self.get_task_note(i, done_tasks)
-
-        canc_tasks = [i for i in self.view.find_by_selector(rcs) if i.a < (archive_pos.a if archive_pos and archive_pos.a > 0 else self.view.size())]
-        for i in canc_tasks:
-            self.get_task_note(i, canc_tasks)
-
-        all_tasks = done_tasks + canc_tasks
-        all_tasks.sort()
-        return all_tasks
-
-    def get_archivable_tasks_within_selections(self):
-        all_tasks = []
-        for region in self.view.sel():
-            for l in self.view.lines(region):
-                line = self.view.line(l)
-                if ('completed' in self.view.scope_name(line.a)) or ('cancelled' in self.view.scope_name(line.a)):
-                    all_tasks.append(line)
-                    self.get_task_note(line, all_tasks)
-        return all_tasks
+    PROJECT_RX = re.compile(r'^\n*(\s*)(.+):(?=\s|$)\s*(\@[^\s]+(\(.*?\))?\s*)*')
+
+    @classmethod
+    def task_project(cls, outline, index, tab_size=4):
+        '''names of projects the task is nested in, outermost first, joined with slash'''
+        parents = outline.parents(tab_size)
+        projects = []
+        index = parents[index]
+        while index is not None:
+            if outline.kinds[index] == HEADER:
+                match = cls.PROJECT_RX.match(outline.line(index))
+                if match:
+                    projects.append(match.group(2))
+            index = parents[index]
+        return ' / '.join(reversed(projects))
+
+    @classmethod
+    def archivable_tasks(cls, outline, limit):
+        '''indexes of completed and cancelled tasks above limit (point of archive) and their notes'''
+        return cls.with_notes(outline, (i for i in range(outline.line_index(limit) + 1)
+                                        if outline.kinds[i] in (DONE, CANCELLED) and outline.starts[i] < limit))
+
+    def get_archivable_tasks_within_selections(self, outline):
+        lines = itertools.chain(*(range(outline.line_index(s.begin()), outline.line_index(s.end()) + 1) for s in self.view.sel()))
+        return self.with_notes(outline, (i for i in lines if outline.kinds[i] in (DONE, CANCELLED)))
+
+    @staticmethod
+    def with_notes(outline, tasks):
+        found = set()
+        for index in tasks:
+            found.add(index)
+            found.update(outline.notes(index))
+        return sorted(found)
 
 
 class PlainTasksNewTaskDocCommand(sublime_plugin.WindowCommand):
@@ -474,8 +433,10 @@ class PlainTasksOpenUrlCommand(sublime_plugin.TextCommand):
             if NT and all([ST3, ':' in url]):
                 # webbrowser uses os.startfile() under the hood, and it is not reliable in py3;
                 # thus call start command for url with scheme (eg skype:nick) and full path (eg c:\b)
+                import subprocess
                 subprocess.Popen(['start', url], shell=True)
             else:
+                import webbrowser
                 webbrowser.open_new_tab(url)
         else:
             self.search_bare_weblink_and_open(start, end)
@@ -506,6 +467,7 @@ class PlainTasksOpenUrlCommand(sublime_plugin.TextCommand):
             strUrl = exp.group(0)
             if strUrl.find("://") == -1:
                 strUrl = "http://" + strUrl
+            import webbrowser
             webbrowser.open_new_tab(strUrl)
         else:
             sublime.status_message("Looks like there is nothing to open")
@@ -555,8 +517,8 @@ class PlainTasksOpenLinkCommand(sublime_plugin.TextCommand):
             self.panel_hidden = True
             return
 
-        self.stop_thread = True
-        self.thread.join()
+        self.job.cancel()
+        self.job.wait()
         win = sublime.active_window()
         win.run_command('hide_overlay')
         res = self._current_res[selection]
@@ -579,7 +541,7 @@ class PlainTasksOpenLinkCommand(sublime_plugin.TextCommand):
             if text:
                 sublime.set_timeout(lambda: self.find_text(self.opened_file, text, line), 300)
 
-    def search_files(self, all_folders, fn, sym, line, col, text):
+    def search_files(self, job, all_folders, fn, sym, line, col, text):
         '''run in separate thread; worker'''
         fn = fn.replace('/', os.sep)
         if os.path.isfile(fn):  # check for full path
@@ -590,8 +552,7 @@ class PlainTasksOpenLinkCommand(sublime_plugin.TextCommand):
         seen_folders = []
         for folder in sorted(set(all_folders)):
             for root, subdirs, _ in os.walk(folder):
-                if self.stop_thread:
-                    return
+                job.progress(label=u'searching %s at %s' % (fn, root))
 
                 if root in seen_folders:
                     continue
@@ -599,9 +560,6 @@ class PlainTasksOpenLinkCommand(sublime_plugin.TextCommand):
                     seen_folders.append(root)
                 subdirs = [f for f in subdirs if os.path.join(root, f) not in seen_folders]
 
-                tname = '%s at %s' % (fn, root)
-                self.thread.name = tname if ST3 else tname.encode('utf8')
-
                 name = os.path.normpath(os.path.abspath(os.path.join(root, fn)))
                 if os.path.isfile(name):
                     item = (name, line, col, "f")
@@ -622,10 +580,6 @@ class PlainTasksOpenLinkCommand(sublime_plugin.TextCommand):
             sublime.set_timeout(lambda: self.window.show_quick_panel(entries, lambda i: self._on_panel_selection(i, text=text, line=line)), 1)
 
     def run(self, edit):
-        if hasattr(self, 'thread'):
-            if self.thread.is_alive:
-                self.stop_thread = True
-                self.thread.join()
         point = self.view.sel()[0].begin()
         line = self.view.substr(self.view.line(point))
         fn, sym, line, col, text = self.parse_link(line)
@@ -646,10 +600,10 @@ class PlainTasksOpenLinkCommand(sublime_plugin.TextCommand):
                     self._current_res.append((name, line, col, "f"))
 
         all_folders = win.folders() + [os.path.dirname(v.file_name()) for v in win.views() if v.file_name()]
-        self.stop_thread = False
-        self.thread = threading.Thread(target=self.search_files, args=(all_folders, fn, sym, line, col, text))
-        self.thread.setName('is starting')
-        self.thread.start()
+        # previous search in this view, if any, is superseded
+        self.job = start_job(self.view, 'open_link',
+                             lambda job: self.search_files(job, all_folders, fn, sym, line, col, text),
+                             label=u'searching %s' % fn, quiet=True)  # progress_bar animates status instead
         self.progress_bar()
 
     def find_text(self, view, text, line):
@@ -660,8 +614,7 @@ class PlainTasksOpenLinkCommand(sublime_plugin.TextCommand):
         view.show_at_center(result)
 
     def progress_bar(self, i=0, dir=1):
-        if not self.thread.is_alive():
-            PlainTasksStatsStatus.set_stats(self.view)
+        if not self.job.thread.is_alive():
             return
 
         if self._current_res and sublime.active_window().active_view().id() == self.view.id():
@@ -680,8 +633,7 @@ class PlainTasksOpenLinkCommand(sublime_plugin.TextCommand):
         if not after:  dir = -1
         if not before: dir = 1
         i += dir
-        self.view.set_status('PlainTasks', u'Please wait%s…%ssearching %s' %
-                             (' ' * before, ' ' * after, self.thread.name if ST3 else self.thread.name.decode('utf8')))
+        self.view.set_status(job_status_key('open_link'), u'Please wait%s…%s%s' % (' ' * before, ' ' * after, self.job.label))
         sublime.set_timeout(lambda: self.progress_bar(i, dir), 100)
         return
 
@@ -708,45 +660,53 @@ class PlainTasksOpenLinkCommand(sublime_plugin.TextCommand):
         return fn, sym, line or 0, col or 0, text
 
 
+class PlainTasksStopJobs(sublime_plugin.TextCommand):
+    '''cancel all operations running in background for view'''
+    def is_enabled(self):
+        return any(view_id == self.view.id() for view_id, _ in JOBS)
+
+    def run(self, edit):
+        cancel_jobs(self.view)
+
+
 class PlainTasksSortByDate(PlainTasksBase):
+    HAVE_DATE_RX = re.compile(r'(?mu)(^[ \t]*[^\n]*?\s\@(?:done|cancelled)\s*(\([\d\w,\.:\-\/ ]*\))[^\n]*$)')
+    DATE_PREFIX_RX = re.compile(r'^\([\d\w,\.:\-\/ ]*\)([^\b]*$)')
+
     def runCommand(self, edit):
         if not re.search(r'(?su)%[Yy][-./ ]*%m[-./ ]*%d\s*%H.*%M', self.date_format):
             # TODO: sort with dateutil so we wont depend on specific date_format
             return
         archive_pos = self.view.find(self.archive_name, 0, sublime.LITERAL)
         if archive_pos:
-            have_date = r'(^\s*[^\n]*?\s\@(?:done|cancelled)\s*(\([\d\w,\.:\-\/ ]*\))[^\n]*$)'
-            all_tasks_prefixed_date = []
-            all_tasks = self.view.find_all(have_date, 0, u"\\2\\1", all_tasks_prefixed_date)
-
-            tasks_prefixed_date = []
-            tasks = []
-            for ind, task in enumerate(all_tasks):
-                if task.a > archive_pos.b:
-                    tasks.append(task)
-                    tasks_prefixed_date.append(all_tasks_prefixed_date[ind])
-
-            notes = []
-            for ind, task in enumerate(tasks):
-                note_line = task.end() + 1
-                while self.view.scope_name(note_line) == 'text.todo notes.todo ':
-                    note = self.view.line(note_line)
-                    notes.append(note)
-                    tasks_prefixed_date[ind] += u'\n' + self.view.substr(note)
-                    note_line = note.end() + 1
-
-            to_remove = tasks+notes
-            to_remove.sort()
-            for i in reversed(to_remove):
-                self.view.erase(edit, self.view.full_line(i))
-
-            tasks_prefixed_date.sort(reverse=self.view.settings().get('new_on_top', True))
+            to_remove, tasks = self.sorted_archive(buffer_outline(self.view), archive_pos.b, self.settings.new_on_top)
+            for a, b in reversed(to_remove):
+                self.view.erase(edit, self.view.full_line(sublime.Region(a, b)))
+
             eol = archive_pos.end()
-            for a in tasks_prefixed_date:
-                eol += self.view.insert(edit, eol, u'\n' + re.sub(r'^\([\d\w,\.:\-\/ ]*\)([^\b]*$)', u'\\1', a))
+            for task in tasks:
+                eol += self.view.insert(edit, eol, u'\n' + task)
         else:
             sublime.status_message("Nothing to sort")
 
+    @classmethod
+    def sorted_archive(cls, outline, archive_end, new_on_top=False):
+        '''Return sorted (start, end) of tasks with date of completion after archive_end and of their notes,
+        and texts of those tasks with their notes sorted by that date'''
+        tasks, to_remove = [], []
+        for match in cls.HAVE_DATE_RX.finditer(outline.text):
+            if match.start() <= archive_end:
+                continue
+            to_remove.append(match.span())
+            task = match.group(2) + match.group(1)
+            for index in outline.notes(outline.line_index(match.end())):
+                to_remove.append((outline.starts[index], outline.line_end(index)))
+                task += u'\n' + outline.line(index)
+            tasks.append(task)
+        to_remove.sort()
+        tasks.sort(reverse=new_on_top)
+        return to_remove, [cls.DATE_PREFIX_RX.sub(u'\\1', task) for task in tasks]
+
 
 class PlainTasksRemoveBold(sublime_plugin.TextCommand):
     def run(self, edit):
@@ -767,49 +727,46 @@ class PlainTasksStatsStatus(sublime_plugin.EventListener):
 
     @staticmethod
     def set_stats(view):
-        view.set_status('PlainTasks', PlainTasksStatsStatus.get_stats(view))
+        settings = settings_snapshot(view)
+        analyse_async(view, 'stats',
+                      lambda outline: PlainTasksStatsStatus.get_stats(outline, settings),
+                      lambda msg: view.set_status('PlainTasks', msg))
 
     @staticmethod
-    def get_stats(view):
-        msgf = view.settings().get('stats_format', '$n/$a done ($percent%) $progress Last task @done $last')
+    def get_stats(outline, settings):
+        '''called in worker thread'''
+        msgf = settings.stats_format
+        text = outline.text
 
         special_interest = re.findall(r'{{.*?}}', msgf)
         for i in special_interest:
-            matches = view.find_all(i.strip('{}'))
-            pend, done, canc = [], [], []
-            for t in matches:
+            try:
+                matches = re.finditer(i.strip('{}'), text, re.M)
                 # one task may contain same tag/word several times—we count amount of tasks, not tags
-                t = view.line(t).a
-                scope = view.scope_name(t)
-                if 'pending' in scope and t not in pend:
-                    pend.append(t)
-                elif 'completed' in scope and t not in done:
-                    done.append(t)
-                elif 'cancelled' in scope and t not in canc:
-                    canc.append(t)
-            msgf = msgf.replace(i, '%d/%d/%d'%(len(pend), len(done), len(canc)))
-
-        ignore_archive = view.settings().get('stats_ignore_archive', False)
+                lines = set(outline.line_start(m.start()) for m in matches)
+            except re.error:
+                lines = ()
+            kinds = [outline.kind_at(t) for t in lines]
+            msgf = msgf.replace(i, '%d/%d/%d'%(kinds.count(OPEN), kinds.count(DONE), kinds.count(CANCELLED)))
+
+        ignore_archive = settings.stats_ignore_archive
+        limit = None
         if ignore_archive:
-            archive_pos = view.find(view.settings().get('archive_name', 'Archive:'), 0, sublime.LITERAL)
-            pend = len([i for i in view.find_by_selector('meta.item.todo.pending') if i.a < (archive_pos.a if archive_pos and archive_pos.a > 0 else view.size())])
-            done = len([i for i in view.find_by_selector('meta.item.todo.completed') if i.a < (archive_pos.a if archive_pos and archive_pos.a > 0 else view.size())])
-            canc = len([i for i in view.find_by_selector('meta.item.todo.cancelled') if i.a < (archive_pos.a if archive_pos and archive_pos.a > 0 else view.size())])
-        else:
-            pend = len(view.find_by_selector('meta.item.todo.pending'))
-            done = len(view.find_by_selector('meta.item.todo.completed'))
-            canc = len(view.find_by_selector('meta.item.todo.cancelled'))
+            archive_pos = text.find(settings.archive_name)
+            limit = archive_pos if archive_pos > 0 else len(text)
+        pend = outline.count(OPEN, limit)
+        done = outline.count(DONE, limit)
+        canc = outline.count(CANCELLED, limit)
         allt = pend + done + canc
         percent  = ((done+canc)/float(allt))*100 if allt else 0
         factor   = int(round(percent/10)) if percent<90 else int(percent/10)
 
-        barfull  = view.settings().get('bar_full', u'■')
-        barempty = view.settings().get('bar_empty', u'□')
+        barfull  = settings.bar_full
+        barempty = settings.bar_empty
         progress = '%s%s' % (barfull*factor, barempty*(10-factor)) if factor else ''
 
-        tasks_dates = []
-        view.find_all('(^\s*[^\n]*?\s\@(?:done)\s*(\([\d\w,\.:\-\/ ]*\))[^\n]*$)', 0, "\\2", tasks_dates)
-        date_format = view.settings().get('date_format', '(%y-%m-%d %H:%M)')
+        tasks_dates = [m[1] for m in re.findall(r'(?m)(^\s*[^\n]*?\s\@(?:done)\s*(\([\d\w,\.:\-\/ ]*\))[^\n]*$)', text)]
+        date_format = settings.date_format
         tasks_dates = [check_parentheses(date_format, t, is_date=True) for t in tasks_dates]
         tasks_dates.sort(reverse=True)
         last = tasks_dates[0] if tasks_dates else '(UNKNOWN)'
@@ -832,7 +789,7 @@ class PlainTasksCopyStats(sublime_plugin.TextCommand):
 
     def run(self, edit):
         msg = self.view.get_status('PlainTasks')
-        replacements = self.view.settings().get('replace_stats_chars', [])
+        replacements = settings_snapshot(self.view).replace_stats_chars
         if replacements:
             for o, r in replacements:
                 msg = msg.replace(o, r)
@@ -942,12 +899,14 @@ class PlainTasksFoldToTags(PlainTasksFold):
             return
 
         tags = self.extract_tags(tag_sels)
-        tasks = [self.view.line(f) for f in self.view.find_all(r'[ \t](%s)' % '|'.join(tags)) if 'pending' in self.view.scope_name(f.a)]
+        outline = buffer_outline(self.view)
+        lines = set(outline.line_index(m.start()) for m in re.finditer(r'[ \t](%s)' % '|'.join(tags), outline.text))
+        tasks = [i for i in lines if outline.kinds[i] == OPEN]
         if not tasks:
             sublime.status_message('Pending tasks with given tags are not found')
             print(tags, tag_sels)
             return
-        self.exec_folding(self.add_projects_and_notes(tasks))
+        self.fold_lines(outline, tasks)
 
     def extract_tags(self, tag_sels):
         tags = []
@@ -973,32 +932,50 @@ class PlainTasksAddGutterIconsForTags(sublime_plugin.EventListener):
     def on_activated(self, view):
         if not view.score_selector(0, "text.todo") > 0:
             return
-        view.erase_regions('critical')
-        view.erase_regions('high')
-        view.erase_regions('low')
-        view.erase_regions('today')
-        icon_critical = view.settings().get('icon_critical', '')
-        icon_high = view.settings().get('icon_high', '')
-        icon_low = view.settings().get('icon_low', '')
-        icon_today = view.settings().get('icon_today', '')
-        if not any((icon_critical, icon_high, icon_low, icon_today)):
-            return
+        settings = settings_snapshot(view)
+        icons = dict((tag, getattr(settings, 'icon_' + tag)) for tag in ('critical', 'high', 'low', 'today'))
+        if not any(icons.values()):
+            # icons may have been removed from settings since they were added
+            return self.add_icons(view, icons, dict((tag, []) for tag in icons))
+        analyse_async(view, 'priority_tags', priority_tags, lambda found: self.add_icons(view, icons, found))
+
+    @staticmethod
+    def add_icons(view, icons, found):
+        for tag, icon in icons.items():
+            update_regions(view, tag, found[tag] if icon else [], 'string.other.tag.todo.' + tag, icon, sublime.HIDDEN)
 
-        critical = 'string.other.tag.todo.critical'
-        high = 'string.other.tag.todo.high'
-        low = 'string.other.tag.todo.low'
-        today = 'string.other.tag.todo.today'
-        r_critical = view.find_by_selector(critical)
-        r_high = view.find_by_selector(high)
-        r_low = view.find_by_selector(low)
-        r_today = view.find_by_selector(today)
+    def on_post_save(self, view):
+        self.on_activated(view)
+
+    def on_load(self, view):
+        self.on_activated(view)
+
+
+# {buffer_id: {tag: amount}} and trie of tags of all buffers together
+TAG_TRIE = TagTrie()
+TAG_COUNTS = track_state('tag counts', {}, 'buffer', on_drop=lambda buffer_id, counts: counts and TAG_TRIE.update(counts, -1))
 
-        if not any((r_critical, r_high, r_low, r_today)):
+
+class PlainTasksTagCompletions(sublime_plugin.EventListener):
+    '''Complete tags used in open documents, most used first; tags are counted in worker
+    when buffer is activated, loaded, saved or left unmodified for a second'''
+    def on_query_completions(self, view, prefix, locations):
+        point = locations[0] - len(prefix)
+        if not view.score_selector(point, 'text.todo') > 0 or view.substr(point - 1) != '@':
+            return []
+        # typed prefix itself is counted too once buffer is idle
+        return [[u'{0}\t{1}×'.format(tag, count), tag] for tag, count in TAG_TRIE.complete(prefix) if tag != prefix]
+
+    def on_activated(self, view):
+        if not view.score_selector(0, 'text.todo') > 0:
             return
-        view.add_regions('critical', r_critical, critical, icon_critical, sublime.HIDDEN)
-        view.add_regions('high', r_high, high, icon_high, sublime.HIDDEN)
-        view.add_regions('low', r_low, low, icon_low, sublime.HIDDEN)
-        view.add_regions('today', r_today, today, icon_today, sublime.HIDDEN)
+        analyse_async(view, 'tag_counts', lambda outline: tag_counts(outline.text), lambda counts: self.count(view, counts))
+
+    def on_modified(self, view):
+        if not view.score_selector(0, 'text.todo') > 0:
+            return
+        version = view.change_count()
+        sublime.set_timeout(lambda: (not ST3 or view.is_valid()) and view.change_count() == version and self.on_activated(view), 1000)
 
     def on_post_save(self, view):
         self.on_activated(view)
@@ -1006,9 +983,15 @@ class PlainTasksAddGutterIconsForTags(sublime_plugin.EventListener):
     def on_load(self, view):
         self.on_activated(view)
 
+    @staticmethod
+    def count(view, counts):
+        '''apply only difference with previous counts of buffer to trie'''
+        TAG_TRIE.update(count_changes(TAG_COUNTS.get(view.buffer_id(), {}), counts))
+        TAG_COUNTS[view.buffer_id()] = counts
 
-class PlainTasksHover(sublime_plugin.ViewEventListener):
-    '''Show popup with actions when hover over bullet'''
+
+class PlainTasksHover(object):
+    '''Show popup with actions when hover over bullet; driven by PlainTasksCaretDispatcher'''
 
     msg = ('<style>'  # four curly braces because it will be modified with format method twice
             'html {{{{background-color: color(var(--background) blenda(white 75%))}}}}'
@@ -1034,31 +1017,25 @@ class PlainTasksHover(sublime_plugin.ViewEventListener):
     archivetofile = '<a href="tofile\v{point}"><span class="icon" id="icon-outside">📤</span> <span id="outside">Archive to file</span></a>'
 
     actions = {
-        'text.todo meta.item.todo.pending': '<p>{complete}</p><p>{cancel}</p>'.format(complete=complete, cancel=cancel),
-        'text.todo meta.item.todo.completed': '<p>{archive}</p><p>{archivetofile}</p><p>{complete}</p>'.format(archive=archive, archivetofile=archivetofile, complete=complete),
-        'text.todo meta.item.todo.cancelled': '<p>{archive}</p><p>{archivetofile}</p><p>{complete}</p><p>{cancel}</p>'.format(archive=archive, archivetofile=archivetofile, complete=complete, cancel=cancel)
+        OPEN: '<p>{complete}</p><p>{cancel}</p>'.format(complete=complete, cancel=cancel),
+        DONE: '<p>{archive}</p><p>{archivetofile}</p><p>{complete}</p>'.format(archive=archive, archivetofile=archivetofile, complete=complete),
+        CANCELLED: '<p>{archive}</p><p>{archivetofile}</p><p>{complete}</p><p>{cancel}</p>'.format(archive=archive, archivetofile=archivetofile, complete=complete, cancel=cancel)
     }
 
-    @classmethod
-    def is_applicable(cls, settings):
-        return settings.get('syntax') == 'Packages/PlainTasks/PlainTasks.sublime-syntax'
+    def __init__(self, view):
+        self.view = view
 
-    def on_hover(self, point, hover_zone):
+    def on_hover(self, point, hover_zone, contexts):
         self.view.hide_popup()
         if hover_zone != sublime.HOVER_TEXT:
             return
 
-        line = self.view.line(point)
-        line_scope_name = self.view.scope_name(line.a).strip()
-        if 'meta.item.todo' not in line_scope_name:
-            return
-
-        bullet = any(('bullet' in self.view.scope_name(p) for p in (point, point - 1)))
-        if not bullet:
+        context = contexts.hover(point)
+        if not context.bullet:
             return
 
         width, height = self.view.viewport_extent()
-        self.view.show_popup(self.msg.format(actions=self.actions.get(line_scope_name)).format(point=point), 0, point or self.view.sel()[0].begin() or 1, width, height / 2, self.exec_action)
+        self.view.show_popup(self.msg.format(actions=self.actions.get(context.kind)).format(point=point), 0, point or self.view.sel()[0].begin() or 1, width, height / 2, self.exec_action)
 
     def exec_action(self, msg):
         action, at = msg.split('\v')
@@ -1076,44 +1053,85 @@ class PlainTasksHover(sublime_plugin.ViewEventListener):
 
 
 class PlainTasksGotoTag(sublime_plugin.TextCommand):
+    '''panel of tags and then panel of occurrences of chosen tag,
+    strings of lines are made only for occurrences of chosen tag'''
     def run(self, edit):
         self.initial_viewport = self.view.viewport_position()
         self.initial_sels = list(self.view.sel())
 
-        self.tags = sorted(
-            [r for r in self.view.find_by_selector('meta.tag.todo')
-             if not any(s in self.view.scope_name(r.a) for s in ('completed', 'cancelled'))
-             ] +
-            self.view.find_by_selector('string.other.tag.todo.critical') +
-            self.view.find_by_selector('string.other.tag.todo.high') +
-            self.view.find_by_selector('string.other.tag.todo.low') +
-            self.view.find_by_selector('string.other.tag.todo.today')
-            )
-        window = self.view.window() or sublime.active_window()
-        items = [[self.view.substr(t), u'{0}: {1}'.format(self.view.rowcol(t.a)[0], self.view.substr(self.view.line(t)).strip())] for t in self.tags]
+        # tags of pending tasks and panel items of their names, built once per version of buffer
+        self.tags, self.names = buffer_cached(self.view, 'goto_tags', self.tag_index)
+        items = buffer_cached(self.view, 'goto_tag_items', self.panel_items)
+        self.point = self.view.layout_to_text(self.initial_viewport) if ST3 else 0
+        closest = self.closest(range(len(self.tags)))
+        selected_index = next((i for i, (_, found) in enumerate(self.names) if closest in found), 0)
+        self.show_panel(items, self.on_tag_done, selected_index, self.on_tag_highlighted)
 
+    @staticmethod
+    def tag_index(view):
+        '''Return (start, end, row) of tags and list of (name, indexes of its tags) in order of text'''
+        outline = buffer_outline(view)
+        text, tags, names = outline.text, [], {}
+        for _, a, b, row in outline.tags:
+            names.setdefault(text[a:b].rstrip(), []).append(len(tags))
+            tags.append((a, b, row))
+        return tags, sorted(names.items(), key=lambda name: name[1][0])
+
+    @staticmethod
+    def panel_items(view):
+        _, names = buffer_cached(view, 'goto_tags', PlainTasksGotoTag.tag_index)
+        return [[name, u'{0} occurrence{1}'.format(len(found), '' if len(found) == 1 else 's')] for name, found in names]
+
+    def show_panel(self, items, on_done, selected_index, on_highlighted):
+        window = self.view.window() or sublime.active_window()
         if ST3:
-            from bisect import bisect_left
-            # find the closest tag after current position of viewport, to avoid scrolling
-            closest_index = bisect_left([r.a for r in self.tags], self.view.layout_to_text(self.initial_viewport))
-            llen = len(self.tags)
-            selected_index = closest_index if closest_index < llen else llen - 1
-            window.show_quick_panel(items, self.on_done, 0, selected_index, self.on_highlighted)
+            window.show_quick_panel(items, on_done, 0, selected_index, on_highlighted)
         else:
-            window.show_quick_panel(items, self.on_done)
+            window.show_quick_panel(items, on_done)
+
+    def closest(self, indexes):
+        '''index of the closest tag after current position of viewport, to avoid scrolling'''
+        from bisect import bisect_left
+        position = bisect_left([self.tags[i][0] for i in indexes], self.point)
+        return indexes[min(position, len(indexes) - 1)] if indexes else None
 
-    def on_done(self, index):
+    def on_tag_done(self, index):
         if index < 0:
+            return self.on_done(None)
+        found = self.names[index][1]
+        if len(found) == 1:
+            return self.on_done(found[0])
+        outline = buffer_outline(self.view)
+        self.found = found
+        items = [[outline.text[a:b], u'{0}: {1}'.format(row, outline.line(row).strip())]
+                 for a, b, row in (self.tags[i] for i in found)]
+        selected_index = found.index(self.closest(found))
+        # panel cannot be shown from callback of other one
+        sublime.set_timeout(lambda: self.show_panel(items, self.on_occurrence_done, selected_index, self.on_occurrence_highlighted), 0)
+
+    def on_tag_highlighted(self, index):
+        self.on_highlighted(self.closest(self.names[index][1]))
+
+    def on_occurrence_done(self, index):
+        self.on_done(self.found[index] if index >= 0 else None)
+
+    def on_occurrence_highlighted(self, index):
+        self.on_highlighted(self.found[index])
+
+    def on_done(self, tag):
+        if tag is None:
             self.view.sel().clear()
             self.view.sel().add_all(self.initial_sels)
             self.view.set_viewport_position(self.initial_viewport)
             return
 
+        a, b, _ = self.tags[tag]
         self.view.sel().clear()
-        self.view.sel().add(sublime.Region(self.tags[index].a))
-        self.view.show_at_center(self.tags[index])
+        self.view.sel().add(sublime.Region(a))
+        self.view.show_at_center(sublime.Region(a, b))
 
-    def on_highlighted(self, index):
+    def on_highlighted(self, tag):
+        region = sublime.Region(*self.tags[tag][:2])
         self.view.sel().clear()
-        self.view.sel().add(self.tags[index])
-        self.view.show(self.tags[index], True)
+        self.view.sel().add(region)
+        self.view.show(region, True)
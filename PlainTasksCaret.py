@@ -0,0 +1,112 @@
+# coding: utf-8
+import re
+import sublime, sublime_plugin
+
+ST3 = int(sublime.version()) >= 3000
+if ST3:
+    from .todo_parser import classify, bullet_span, TAG_PATTERN, DUE_TAG_RX, OPEN, DONE, CANCELLED
+    from .PlainTasks import PlainTasksHover
+    from .PlainTasksDates import PlainTasksViewEventListener, PlainTasksPreviewShortDate, PlainTasksChooseDate
+else:
+    from todo_parser import classify, bullet_span, TAG_PATTERN, DUE_TAG_RX, OPEN, DONE, CANCELLED
+    from PlainTasks import PlainTasksHover
+    from PlainTasksDates import PlainTasksViewEventListener, PlainTasksPreviewShortDate, PlainTasksChooseDate
+
+
+class CaretContext(object):
+    '''What is at point, computed once and shared by all handlers
+    tag
+        Region of pending task’s tag under point (end inclusive) or None
+    due
+        tuple (region of tag, region of parentheses, string within parentheses, line) or None
+    kind, bullet
+        kind of line and whether point is on bullet, only for hover
+    '''
+    __slots__ = ('point', 'tag', 'due', 'kind', 'bullet')
+
+    def __init__(self, point, tag=None, due=None, kind=None, bullet=False):
+        self.point = point
+        self.tag = tag
+        self.due = due
+        self.kind = kind
+        self.bullet = bullet
+
+    def key(self):
+        '''handlers care only about these, the same key means nothing relevant changed'''
+        return ((self.tag.a, self.tag.b) if self.tag else None,
+                (self.due[0].a, self.due[0].b, self.due[2]) if self.due else None)
+
+
+TAG_RX = re.compile(TAG_PATTERN)
+
+
+class CaretContextProvider(object):
+    '''Patterns are matched against line of caret only, so cost does not grow with buffer'''
+    def __init__(self, view):
+        self.view = view
+
+    def line(self, point):
+        '''Return line region, its content and content prefixed by newline,
+        so lookbehind of patterns works at start of line as it does in buffer'''
+        line = self.view.line(point)
+        content = self.view.substr(line)
+        return line, content, u'\n' + content
+
+    @staticmethod
+    def hit(rx, text, offset, inclusive=False):
+        '''Return match of rx in text covering offset or None'''
+        for match in rx.finditer(text):
+            if match.start() > offset:
+                break
+            if offset < match.end() + (1 if inclusive else 0):
+                return match
+        return None
+
+    def caret(self, point):
+        line, content, text = self.line(point)
+        offset = point - line.a + 1
+        kind = None
+        tag = self.hit(TAG_RX, text, offset, inclusive=True)
+        if tag:
+            kind = classify(content)[0]
+            tag = sublime.Region(line.a + tag.start() - 1, line.a + tag.end() - 1) if kind == OPEN else None
+        due = self.hit(DUE_TAG_RX, text, offset)
+        if due:
+            kind = kind or classify(content)[0]
+            due = (sublime.Region(line.a + due.start() - 1, line.a + due.end() - 1),
+                   sublime.Region(line.a + due.start(1) - 1, line.a + due.end(1) - 1),
+                   due.group(2), content) if kind in (OPEN, DONE, CANCELLED) else None
+        return CaretContext(point, tag, due)
+
+    def hover(self, point):
+        line, content, _ = self.line(point)
+        span = bullet_span(content)
+        bullet = bool(span) and line.a + span[0] <= point <= line.a + span[1]
+        return CaretContext(point, kind=classify(content)[0], bullet=bullet)
+
+
+class PlainTasksCaretDispatcher(PlainTasksViewEventListener):
+    '''Compute context of caret once per selection change and pass it to handlers,
+    which are not called at all while nothing relevant is changed'''
+    def __init__(self, view):
+        self.view = view
+        self.contexts = CaretContextProvider(view)
+        self.handlers = [PlainTasksPreviewShortDate(view), PlainTasksChooseDate(view)]
+        self.hover = PlainTasksHover(view)
+        self.last = None
+
+    def on_selection_modified_async(self):
+        sel = self.view.sel()
+        if not len(sel):
+            return
+        s = sel[0]
+        context = self.contexts.caret(s.a) if s.empty() else CaretContext(s.a)
+        key = context.key()
+        if key == self.last:
+            return
+        self.last = key
+        for handler in self.handlers:
+            handler.update(context)
+
+    def on_hover(self, point, hover_zone):
+        self.hover.on_hover(point, hover_zone, self.contexts)
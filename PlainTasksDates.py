@@ -3,7 +3,6 @@ import sublime, sublime_plugin
 import json
 import re
 import locale
-import calendar
 import itertools
 from datetime import datetime
 from datetime import timedelta
@@ -11,24 +10,24 @@ from datetime import timedelta
 NT = sublime.platform() == 'windows'
 ST3 = int(sublime.version()) >= 3000
 if ST3:
-    from .APlainTasksCommon import PlainTasksBase, PlainTasksEnabled, PlainTasksFold
+    from .APlainTasksCommon import PlainTasksBase, PlainTasksEnabled, PlainTasksFold, buffer_cached, buffer_cache_put, settings_snapshot, analyse_async, buffer_outline, update_regions, TODO_SYNTAXES
+    from .todo_parser import due_tags, HEADER, EMPTY, NOTE, OPEN
+    from collections import OrderedDict
     MARK_SOON = sublime.DRAW_NO_FILL
     MARK_INVALID = sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE | sublime.DRAW_SQUIGGLY_UNDERLINE
 else:
-    from APlainTasksCommon import PlainTasksBase, PlainTasksEnabled, PlainTasksFold
+    from APlainTasksCommon import PlainTasksBase, PlainTasksEnabled, PlainTasksFold, buffer_cached, buffer_cache_put, settings_snapshot, analyse_async, buffer_outline, update_regions, TODO_SYNTAXES
+    from todo_parser import due_tags, HEADER, EMPTY, NOTE, OPEN
     MARK_SOON = MARK_INVALID = 0
     sublime_plugin.ViewEventListener = object
+    OrderedDict = dict  # no calendar in ST2
 
 
-try:  # unavailable dependencies shall not break basic functionality
+def dateutil_parse(date_string, **kwargs):
+    # imported on first use, dateutil is slow to import and needed only for rare formats;
+    # unavailable dependency raises ImportError, i.e. shall not break basic functionality
     from dateutil import parser as dateutil_parser
-    from dateutil.relativedelta import relativedelta
-except:
-    dateutil_parser = None
-
-
-if ST3:
-    locale.setlocale(locale.LC_ALL, '')
+    return dateutil_parser.parse(date_string, **kwargs)
 
 
 def is_yearfirst(date_format):
@@ -102,11 +101,14 @@ def convert_date(matchstr, now):
         return date, None
 
 
-def increase_date(view, region, text, now, date_format):
+def increase_date(view, region, text, now, date_format, line_content=None, errors=None):
+    '''errors is list to collect (point, error, text) of invalid @created instead of reporting them,
+    which needs main thread'''
     # relative from date of creation if any
     if '++' in text:
-        line = view.line(region)
-        line_content = view.substr(line)
+        if line_content is None:
+            line = view.line(region)
+            line_content = view.substr(line)
         created = re.search(r'(?mxu)@created\(([\d\w,\.:\-\/ @]*)\)', line_content)
         if created:
             created_date, error = parse_date(created.group(1),
@@ -115,9 +117,10 @@ def increase_date(view, region, text, now, date_format):
                                              dayfirst=is_dayfirst(date_format),
                                              default=now)
             if error:
-                ln = (view.rowcol(line.a)[0] + 1)
-                print(u'\nPlainTasks:\nError at line %d\n\t%s\ncaused by text:\n\t"%s"\n' % (ln, error, created.group(0)))
-                sublime.status_message(u'@created date is invalid at line %d, see console for details' % ln)
+                if errors is None:
+                    report_invalid_created(view, region.a if region else 0, error, created.group(0))
+                else:
+                    errors.append((region.a if region else 0, error, created.group(0)))
             else:
                 now = created_date
 
@@ -162,17 +165,25 @@ def expand_short_date(view, start, end, now, date_format):
     region = sublime.Region(start + 1, end)
     text = view.substr(region)
     # print(text)
+    date, error = short_date(view, region, text, now, date_format)
+    return date, error, sublime.Region(start, end + 1)
 
-    if '+' in text:
-        date, error = increase_date(view, region, text, now, date_format)
-    else:
-        date, error = parse_date(text,
-                                 date_format,
-                                 yearfirst=is_yearfirst(date_format),
-                                 dayfirst=is_dayfirst(date_format),
-                                 default=now)
 
-    return date, error, sublime.Region(start, end + 1)
+def report_invalid_created(view, point, error, text):
+    ln = (view.rowcol(view.line(point).a)[0] + 1) if view else 0
+    print(u'\nPlainTasks:\nError at line %d\n\t%s\ncaused by text:\n\t"%s"\n' % (ln, error, text))
+    sublime.status_message(u'@created date is invalid at line %d, see console for details' % ln)
+
+
+def short_date(view, region, text, now, date_format, line_content=None):
+    '''region is text within parentheses'''
+    if '+' in text:
+        return increase_date(view, region, text, now, date_format, line_content)
+    return parse_date(text,
+                      date_format,
+                      yearfirst=is_yearfirst(date_format),
+                      dayfirst=is_dayfirst(date_format),
+                      default=now)
 
 
 def parse_date(date_string, date_format='(%y-%m-%d %H:%M)', yearfirst=True, dayfirst=False, default=None):
@@ -203,10 +214,12 @@ def parse_date(date_string, date_format='(%y-%m-%d %H:%M)', yearfirst=True, dayf
             # e.g. @due(2-1) is always Fabruary 1st of next year,
             # but dateutil consider it this year
             raise Exception("Special case of short date: less than 3 numbers")
-        date = dateutil_parser.parse(bare_date_string,
-                                     yearfirst=yearfirst,
-                                     dayfirst=dayfirst,
-                                     default=default)
+        date = natural_date(bare_date_string, yearfirst, dayfirst, default, date_format)
+        if date is None:
+            date = dateutil_parse(bare_date_string,
+                                  yearfirst=yearfirst,
+                                  dayfirst=dayfirst,
+                                  default=default)
         if NT and all((date.year < 1900, '%y' in date_format)):
             return None, ('format %y requires year >= 1900 on Windows', date.year, date.month, date.day, date.hour, date.minute)
     except Exception as e:
@@ -217,9 +230,97 @@ def parse_date(date_string, date_format='(%y-%m-%d %H:%M)', yearfirst=True, dayf
     return date, error
 
 
-def format_delta(view, delta):
+MONTHS = ('january', 'february', 'march', 'april', 'may', 'june',
+          'july', 'august', 'september', 'october', 'november', 'december')
+NATURAL_TIME = re.compile(r'(?:^|\s+)(\d{1,2}):(\d{2})$')
+NATURAL_NUMERIC = re.compile(r'^(\d+)([-./])(\d+)\2(\d+)$')
+NATURAL_NAMED = re.compile(r'[-./\s]+')
+
+
+def natural_date(date_string, yearfirst, dayfirst, default, date_format='(%y-%m-%d %H:%M)'):
+    '''
+    Built-in parser for the forms dateutil is used for the most,
+    return the same datetime as dateutil does, or None if form is not supported;
+    raise ValueError for year which date_format cannot represent, instead of
+    leaving it to dateutil whose versions disagree about it
+    '''
+    year, month, day, hour, minute = default.year, default.month, default.day, default.hour, default.minute
+    time = NATURAL_TIME.search(date_string)
+    if time:
+        hour, minute = int(time.group(1)), int(time.group(2))
+        date_string = date_string[:time.start()]
+
+    numeric = NATURAL_NUMERIC.match(date_string)
+    if numeric:
+        a, _, b, c = numeric.groups()
+        if len(a) > 2 or yearfirst:
+            year, month, day = a, b, c
+        elif dayfirst:
+            day, month, year = a, b, c
+        else:
+            month, day, year = a, b, c
+        if len(year) > 4 or len(month) > 2 or len(day) > 2:
+            return None
+        year = _full_year(year)
+    elif date_string.isdigit():
+        if len(date_string) > 2 and int(date_string) > 31:
+            year = int(date_string)
+            if year < 1000 and '%Y' not in date_format:
+                raise ValueError('format %y cannot represent year %d' % year)
+        elif len(date_string) <= 2 and time:
+            day = int(date_string)
+        else:
+            return None
+    elif date_string:
+        parts = [p for p in NATURAL_NAMED.split(date_string.lower()) if p]
+        names = [p.rstrip('.') for p in parts if not p.isdigit()]
+        numbers = [p for p in parts if p.isdigit()]
+        if len(names) != 1 or len(numbers) > 2:
+            return None
+        month = next((i for i, m in enumerate(MONTHS, 1) if names[0] in (m, m[:3]) or names[0] == 'sept' == m[:4]), None)
+        if not month:
+            return None
+        if len(numbers) == 1 and len(numbers[0]) <= 2:
+            day = int(numbers[0])
+        elif len(numbers) == 2 and sum(len(n) > 2 for n in numbers) == 1:
+            year, day = sorted(numbers, key=len, reverse=True)
+            year, day = int(year), int(day)
+        else:
+            return None
+    elif not time:
+        return None
+
+    try:
+        return datetime(int(year), int(month), int(day), hour, minute)
+    except ValueError:
+        return None
+
+
+def _full_year(year):
+    '''two-digit year is the closest to the current one, like in dateutil'''
+    if len(year) > 2:
+        return int(year)
+    now = datetime.now().year
+    year = int(year) + now // 100 * 100
+    if year >= now + 50:
+        year -= 100
+    elif year < now - 50:
+        year += 100
+    return year
+
+
+def shift_months(date, months):
+    import calendar
+    year, month = divmod(date.month - 1 + months, 12)
+    year += date.year
+    return date.replace(year=year, month=month + 1, day=min(date.day, calendar.monthrange(year, month + 1)[1]))
+
+
+def format_delta(view, delta, decimal_minutes=None):
     delta -= timedelta(microseconds=delta.microseconds)
-    if view.settings().get('decimal_minutes', False):
+    if decimal_minutes is None:
+        decimal_minutes = view.settings().get('decimal_minutes', False)
+    if decimal_minutes:
         days = delta.days
         delta = u'%s%s%s%s' % (days or '', ' day, ' if days == 1 else '', ' days, ' if days > 1 else '', '%.2f' % (delta.seconds / 3600.0) if delta.seconds else '')
     else:
@@ -231,80 +332,110 @@ def format_delta(view, delta):
     return delta.strip(' ,')
 
 
+def due_counts(view):
+    '''Return dict {(year, month, day): amount of pending tasks due that day},
+    built once per version of buffer (and per day, because short dates are relative);
+    highlighting of due tags counts them in worker, so usually they are ready'''
+    return buffer_cached(view, 'due_counts', build_due_counts, extra=datetime.now().date())
+
+
+def build_due_counts(view):
+    return count_due_days(buffer_outline(view), settings_snapshot(view), [])
+
+
+def count_due_days(outline, settings, errors=None):
+    now = datetime.now()
+    default = now - timedelta(seconds=now.second, microseconds=now.microsecond)
+    counts = {}
+    for point, _, line, text in due_tags(outline):
+        date, error = due_date(None, sublime.Region(point), text, line, settings, default, errors)
+        if not error:
+            day = (date.year, date.month, date.day)
+            counts[day] = counts.get(day, 0) + 1
+    return counts
+
+
 class PlainTasksToggleHighlightPastDue(PlainTasksEnabled):
     def run(self, edit):
-        highlight_on = self.view.settings().get('highlight_past_due', True)
-        self.view.erase_regions('past_due')
-        self.view.erase_regions('due_soon')
-        self.view.erase_regions('misformatted')
-        if not highlight_on:
+        settings = settings_snapshot(self.view)
+        if not settings.highlight_past_due:
+            for key in ('past_due', 'due_soon', 'misformatted'):
+                update_regions(self.view, key, [])
             return
+        today = datetime.now().date()
+
+        def analyse(outline):
+            errors = []
+            counts = {}
+            return group_due_tags(outline, settings, errors, counts), counts, errors
+
+        analyse_async(self.view, 'due_tags', analyse, lambda result: self.highlight(result[0], result[1], today, result[2]))
+
+    def highlight(self, groups, counts=None, today=None, errors=()):
+        settings = settings_snapshot(self.view)
+        past_due, due_soon, misformatted, phantoms = groups
+        for point, error, text in errors:
+            report_invalid_created(self.view, point, error, text)
+        if counts is not None:
+            buffer_cache_put(self.view, 'due_counts', counts, extra=today)
+        update_regions(self.view, 'past_due', past_due, settings.scope_past_due, settings.icon_past_due)
+        update_regions(self.view, 'due_soon', due_soon, settings.scope_due_soon, settings.icon_due_soon, MARK_SOON)
+        update_regions(self.view, 'misformatted', misformatted, settings.scope_misformatted, settings.icon_misformatted, MARK_INVALID)
 
-        pattern = r'@due(\([^@\n]*\))'
-        dates_strings = []
-        dates_regions = self.view.find_all(pattern, 0, '\\1', dates_strings)
-        if not dates_regions:
-            if ST3:
-                self.view.settings().set('plain_tasks_remain_time_phantoms', [])
+        if not ST3:
             return
+        self.set_phantoms(phantoms if settings.show_remain_due else [])
 
-        past_due, due_soon, misformatted, phantoms = self.group_due_tags(dates_strings, dates_regions)
+    def set_phantoms(self, phantoms):
+        # any change of view settings drops settings snapshot, so do not touch them in vain
+        phantoms = [list(p) for p in phantoms]
+        if self.view.settings().get('plain_tasks_remain_time_phantoms', []) != phantoms:
+            self.view.settings().set('plain_tasks_remain_time_phantoms', phantoms)
 
-        scope_past_due = self.view.settings().get('scope_past_due', 'string.other.tag.todo.critical')
-        scope_due_soon = self.view.settings().get('scope_due_soon', 'string.other.tag.todo.high')
-        scope_misformatted = self.view.settings().get('scope_misformatted', 'string.other.tag.todo.low')
-        icon_past_due = self.view.settings().get('icon_past_due', 'circle')
-        icon_due_soon = self.view.settings().get('icon_due_soon', 'dot')
-        icon_misformatted = self.view.settings().get('icon_misformatted', '')
-        self.view.add_regions('past_due', past_due, scope_past_due, icon_past_due)
-        self.view.add_regions('due_soon', due_soon, scope_due_soon, icon_due_soon, MARK_SOON)
-        self.view.add_regions('misformatted', misformatted, scope_misformatted, icon_misformatted, MARK_INVALID)
 
-        if not ST3:
-            return
-        if self.view.settings().get('show_remain_due', False):
-            self.view.settings().set('plain_tasks_remain_time_phantoms', phantoms)
+def due_date(view, region, text, line, settings, default, errors=None):
+    '''Return (date, error) for text in parentheses of @due in line, view may be None'''
+    if '+' in text:
+        return increase_date(view, region, text, default, settings.date_format, line_content=line, errors=errors)
+    return parse_date(text,
+                      date_format=settings.date_format,
+                      yearfirst=settings.yearfirst,
+                      dayfirst=settings.dayfirst,
+                      default=default)
+
+
+def group_due_tags(outline, settings, errors, counts=None):
+    '''Return lists of (start, end) of past due, due soon and misformatted tags and list of phantoms;
+    may be called in worker thread, so invalid @created dates are only appended to errors;
+    counts, if given, is filled like count_due_days does from the same parsed dates'''
+    past_due, due_soon, misformatted, phantoms = [], [], [], []
+    now = datetime.now()
+    default = now - timedelta(seconds=now.second, microseconds=now.microsecond)  # for short dates w/o time
+    due_soon_threshold = settings.highlight_due_soon * 60 * 60
+
+    # anything but completed and cancelled tasks
+    for start, end, line, text in due_tags(outline, (HEADER, EMPTY, NOTE, OPEN)):
+        region = sublime.Region(start, end)
+        date, error = due_date(None, region, text, line, settings, default, errors)
+        if error:
+            # print(error)
+            misformatted.append((start, end))
         else:
-            self.view.settings().set('plain_tasks_remain_time_phantoms', [])
-
-    def group_due_tags(self, dates_strings, dates_regions):
-        past_due, due_soon, misformatted, phantoms = [], [], [], []
-        date_format = self.view.settings().get('date_format', '(%y-%m-%d %H:%M)')
-        yearfirst = is_yearfirst(date_format)
-        now = datetime.now()
-        default = now - timedelta(seconds=now.second, microseconds=now.microsecond)  # for short dates w/o time
-        due_soon_threshold = self.view.settings().get('highlight_due_soon', 24) * 60 * 60
-
-        for i, region in enumerate(dates_regions):
-            if any(s in self.view.scope_name(region.a) for s in ('completed', 'cancelled')):
-                continue
-            text = dates_strings[i]
-            if '+' in text:
-                date, error = increase_date(self.view, region, text, default, date_format)
-                # print(date, date_format)
-            else:
-                date, error = parse_date(text,
-                                         date_format=date_format,
-                                         yearfirst=yearfirst,
-                                         dayfirst=is_dayfirst(date_format),
-                                         default=default)
-                # print(date, date_format, yearfirst)
-            if error:
-                # print(error)
-                misformatted.append(region)
+            if counts is not None and outline.kind_at(start) == OPEN:
+                day = (date.year, date.month, date.day)
+                counts[day] = counts.get(day, 0) + 1
+            if now >= date:
+                past_due.append((start, end))
+                phantoms.append((start, '-' + format_delta(None, default - date, settings.decimal_minutes)))
             else:
-                if now >= date:
-                    past_due.append(region)
-                    phantoms.append((region.a, '-' + format_delta(self.view, default - date)))
-                else:
-                    phantoms.append((region.a, format_delta(self.view, date - default)))
-                    if due_soon_threshold:
-                        td = (date - now)
-                        # timedelta.total_seconds() is not available in 2.6.x
-                        time_left = (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10**6) / 10.0**6
-                        if time_left < due_soon_threshold:
-                            due_soon.append(region)
-        return past_due, due_soon, misformatted, phantoms
+                phantoms.append((start, format_delta(None, date - default, settings.decimal_minutes)))
+                if due_soon_threshold:
+                    td = (date - now)
+                    # timedelta.total_seconds() is not available in 2.6.x
+                    time_left = (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10**6) / 10.0**6
+                    if time_left < due_soon_threshold:
+                        due_soon.append((start, end))
+    return past_due, due_soon, misformatted, phantoms
 
 
 class PlainTasksHLDue(sublime_plugin.EventListener):
@@ -322,13 +453,16 @@ class PlainTasksHLDue(sublime_plugin.EventListener):
 
 class PlainTasksFoldToDueTags(PlainTasksFold):
     def run(self, edit):
-        if not self.view.settings().get('highlight_past_due', True):
+        if not settings_snapshot(self.view).highlight_past_due:
             return sublime.message_dialog('highlight_past_due setting must be true')
-        self.view.run_command('plain_tasks_toggle_highlight_past_due')
-        dues = sorted(self.view.line(r) for r in (self.view.get_regions('past_due') + self.view.get_regions('due_soon')))
+        outline, errors = buffer_outline(self.view), []
+        past_due, due_soon, _, _ = group_due_tags(outline, settings_snapshot(self.view), errors)
+        for point, error, text in errors:
+            report_invalid_created(self.view, point, error, text)
+        dues = set(outline.line_index(a) for a, _ in past_due + due_soon)
         if not dues:
             return sublime.message_dialog('No overdue tasks.\nCongrats!')
-        self.exec_folding(self.add_projects_and_notes(dues))
+        self.fold_lines(outline, dues)
 
 
 class PlainTasksCalculateTotalTimeForProject(PlainTasksEnabled):
@@ -377,7 +511,18 @@ class PlainTasksCalculateTimeForTask(PlainTasksEnabled):
         if not started_matches:
             return
 
-        date_format = self.view.settings().get('date_format', '(%y-%m-%d %H:%M)')
+        date_format = settings_snapshot(self.view).date_format
+        delta = format_delta(self.view, self.time_spent(started_matches, toggle_matches, now, date_format))
+
+        tag = ' @%s(%s)' % (tag, delta.rstrip(', ') if delta else ('a bit' if '%H' in date_format else 'less than day'))
+        eol = int(eol)
+        if self.view.substr(sublime.Region(eol - 2, eol)) == '  ':
+            eol -= 2  # keep double whitespace at eol
+        self.view.insert(edit, eol, tag)
+
+    @staticmethod
+    def time_spent(started_matches, toggle_matches, now, date_format):
+        '''Return timedelta between start and now without pauses between pairs of toggles'''
         start = datetime.strptime(started_matches[0], date_format)
         end = datetime.strptime(now, date_format)
 
@@ -385,24 +530,17 @@ class PlainTasksCalculateTimeForTask(PlainTasksEnabled):
         all_times = [start] + toggle_times + [end]
         pairs = zip(all_times[::2], all_times[1::2])
         deltas = [pair[1] - pair[0] for pair in pairs]
-
-        delta = format_delta(self.view, sum(deltas, timedelta()))
-
-        tag = ' @%s(%s)' % (tag, delta.rstrip(', ') if delta else ('a bit' if '%H' in date_format else 'less than day'))
-        eol = int(eol)
-        if self.view.substr(sublime.Region(eol - 2, eol)) == '  ':
-            eol -= 2  # keep double whitespace at eol
-        self.view.insert(edit, eol, tag)
+        return sum(deltas, timedelta())
 
 
 class PlainTasksReCalculateTimeForTasks(PlainTasksEnabled):
-    def run(self, edit):
-        started = r'^\s*[^\b]*?\s*@started(\([\d\w,\.:\-\/ @]*\)).*$'
-        toggle = r'@toggle(\([\d\w,\.:\-\/ @]*\))'
-        calculated = r'([ \t]@[lw]asted\([\d\w,\.:\-\/ @]*\))'
-        done = r'^\s*[^\b]*?\s*@(done|cancell?ed)[ \t]*(\([\d\w,\.:\-\/ @]*\)).*$'
+    STARTED_RX = re.compile(r'(?u)^\s*[^\b]*?\s*@started(\([\d\w,\.:\-\/ @]*\)).*$')
+    TOGGLE_RX = re.compile(r'(?u)@toggle(\([\d\w,\.:\-\/ @]*\))')
+    CALCULATED_RX = re.compile(r'(?u)([ \t]@[lw]asted\([\d\w,\.:\-\/ @]*\))')
+    DONE_RX = re.compile(r'(?u)^\s*[^\b]*?\s*@(done|cancell?ed)[ \t]*(\([\d\w,\.:\-\/ @]*\)).*$')
 
-        date_format = self.view.settings().get('date_format', '(%y-%m-%d %H:%M)')
+    def run(self, edit):
+        date_format = settings_snapshot(self.view).date_format
         default_now = datetime.now().strftime(date_format)
 
         regions = itertools.chain(*(reversed(self.view.lines(region)) for region in reversed(list(self.view.sel()))))
@@ -411,18 +549,7 @@ class PlainTasksReCalculateTimeForTasks(PlainTasksEnabled):
             if not any(s in current_scope for s in ('completed', 'cancelled')):
                 continue
 
-            line_contents = self.view.substr(line)
-
-            done_match = re.match(done, line_contents, re.U)
-            now = done_match.group(2) if done_match else default_now
-
-            started_matches = re.findall(started, line_contents, re.U)
-            toggle_matches = re.findall(toggle, line_contents, re.U)
-            calc_matches = re.findall(calculated, line_contents, re.U)
-
-            for match in calc_matches:
-                line_contents = line_contents.replace(match, '')
-
+            line_contents, started_matches, toggle_matches, now = self.recalculate(self.view.substr(line), default_now)
             self.view.replace(edit, line, line_contents)
             self.view.run_command(
                 'plain_tasks_calculate_time_for_task', {
@@ -433,6 +560,18 @@ class PlainTasksReCalculateTimeForTasks(PlainTasksEnabled):
                     'tag': 'lasted' if 'completed' in current_scope else 'wasted'}
             )
 
+    @classmethod
+    def recalculate(cls, line_contents, default_now):
+        '''Return line without @lasted and @wasted tags, dates of @started and @toggle tags,
+        and date of completion or default_now'''
+        done_match = cls.DONE_RX.match(line_contents)
+        now = done_match.group(2) if done_match else default_now
+        started_matches = cls.STARTED_RX.findall(line_contents)
+        toggle_matches = cls.TOGGLE_RX.findall(line_contents)
+        for match in cls.CALCULATED_RX.findall(line_contents):
+            line_contents = line_contents.replace(match, '')
+        return line_contents, started_matches, toggle_matches, now
+
 
 class PlainTaskInsertDate(PlainTasksBase):
     def runCommand(self, edit, region=None, date=None):
@@ -470,47 +609,39 @@ class PlainTasksReplaceShortDate(PlainTasksBase):
 class PlainTasksViewEventListener(sublime_plugin.ViewEventListener):
     @classmethod
     def is_applicable(cls, settings):
-        return settings.get('syntax') in ('Packages/PlainTasks/PlainTasks.sublime-syntax', 'Packages/PlainTasks/PlainTasks.tmLanguage')
+        return settings.get('syntax') in TODO_SYNTAXES
 
 
-class PlainTasksPreviewShortDate(PlainTasksViewEventListener):
+class PlainTasksPreviewShortDate(object):
+    '''Preview date of @due tag under caret; driven by PlainTasksCaretDispatcher'''
     def __init__(self, view):
         self.view = view
         self.phantoms = sublime.PhantomSet(view, 'plain_tasks_preview_short_date')
 
-    def on_selection_modified_async(self):
+    def update(self, context):
         self.phantoms.update([])  # https://github.com/SublimeTextIssues/Core/issues/1497
-        s = self.view.sel()[0]
-        if not (s.empty() and 'meta.tag.todo' in self.view.scope_name(s.a)):
-            return
-
-        rgn = self.view.extract_scope(s.a)
-        text = self.view.substr(rgn)
-        match = re.match(r'@due\(([^@\n]*)\)[\s$]*', text)
-        # print(s, rgn, text)
-
-        if not match:
-            return
-        # print(match.group(1))
-        preview_offset = self.view.settings().get('due_preview_offset', 0)
-        remain_format = self.view.settings().get('due_remain_format', '{time} remaining')
-        overdue_format = self.view.settings().get('due_overdue_format', '{time} overdue')
+        if context.due:
+            self.preview(*context.due)
 
+    def preview(self, tag_region, region, string, line_content):
+        settings = settings_snapshot(self.view)
+        preview_offset = settings.due_preview_offset
+        remain_format = settings.due_remain_format
+        overdue_format = settings.due_overdue_format
 
-        date_format = self.view.settings().get('date_format', '(%y-%m-%d %H:%M)')
-        start = rgn.a + 5  # within parenthesis
+        date_format = settings.date_format
         now = datetime.now().replace(second=0, microsecond=0)
-        date, error, region = expand_short_date(self.view, start, start, now, date_format)
+        date, error = short_date(self.view, sublime.Region(region.a + 1, region.b - 1), string, now, date_format, line_content)
 
         upd = []
         if not error:
             if now >= date:
-                delta = '-' + format_delta(self.view, now - date)
+                delta = '-' + format_delta(self.view, now - date, settings.decimal_minutes)
             else:
-                delta = format_delta(self.view, date - now)
+                delta = format_delta(self.view, date - now, settings.decimal_minutes)
             content = (overdue_format if '-' in delta else remain_format).format(time=delta.lstrip('-') or 'a little bit')
             if content:
-                if self.view.settings().get('show_remain_due', False):
+                if settings.show_remain_due:
                     # replace existing remain/overdue phantom
                     phantoms = self.view.settings().get('plain_tasks_remain_time_phantoms', [])
                     for index, (point, _) in enumerate(phantoms):
@@ -524,7 +655,7 @@ class PlainTasksPreviewShortDate(PlainTasksViewEventListener):
                         content,
                         sublime.LAYOUT_BELOW))
             date = date.strftime(date_format).strip('()')
-        if date == match.group(1).strip():
+        if date == string.strip():
             self.phantoms.update(upd)
             return
 
@@ -537,19 +668,33 @@ class PlainTasksPreviewShortDate(PlainTasksViewEventListener):
         self.phantoms.update(upd)
 
 
-class PlainTasksChooseDate(sublime_plugin.ViewEventListener):
+class PlainTasksChooseDate(object):
+    '''Show date picker when caret enters tag; driven by PlainTasksCaretDispatcher'''
     def __init__(self, view):
         self.view = view
 
-    @classmethod
-    def is_applicable(cls, settings):
-        return settings.get('show_calendar_on_tags')
+    def update(self, context):
+        if context.tag and settings_snapshot(self.view).show_calendar_on_tags:
+            self.view.run_command('plain_tasks_calendar', {'point': context.point})
 
-    def on_selection_modified_async(self):
-        s = self.view.sel()[0]
-        if not (s.empty() and any('meta.tag.todo ' in self.view.scope_name(n) for n in (s.a, s.a - 1))):
-            return
-        self.view.run_command('plain_tasks_calendar', {'point': s.a})
+
+# rendered popups, {(y, m, d, locale, heat): html with TIME_STAMP and TIME_TEXT for time}, least recently used first
+CALENDAR_CACHE = OrderedDict()
+CALENDAR_CACHE_SIZE = 64
+TIME_STAMP = u'-HH-MM"'  # end of links
+TIME_TEXT = u'>HH:MM<'
+LOCALE_SET = []  # user’s locale is set once, on first calendar, it is slow and needed only for names of months
+
+
+def calendar_locale():
+    '''Return locale of names of months and days, set to native on first call'''
+    if not LOCALE_SET:
+        LOCALE_SET.append(True)
+        try:
+            locale.setlocale(locale.LC_ALL, '')
+        except locale.Error:
+            pass
+    return locale.getlocale(locale.LC_TIME)
 
 
 class PlainTasksCalendar(sublime_plugin.TextCommand):
@@ -588,18 +733,34 @@ class PlainTasksCalendar(sublime_plugin.TextCommand):
 
     def generate_calendar(self, date=None):
         date = date or datetime.now()
-        y, m, d, H, M = date.year, date.month, date.day, date.hour, date.minute
-
-        content = ('<style> #today {{color: var(--background); background-color: var(--foreground)}}</style>'
-                   '<br> <center><big>{prev_month} {next_month} {month}'
-                   '    {prev_year} {next_year} {year}</big></center><br><br>'
+        counts = due_counts(self.view)
+        heat = tuple(counts.get((date.year, date.month, day), 0) for day in range(1, 32))
+        key = (date.year, date.month, date.day, calendar_locale(), heat)
+        content = CALENDAR_CACHE.pop(key, None)
+        if content is None:
+            content = self.render_calendar(date, heat)
+            if len(CALENDAR_CACHE) >= CALENDAR_CACHE_SIZE:
+                CALENDAR_CACHE.popitem(last=False)
+        CALENDAR_CACHE[key] = content
+        return content.replace(TIME_STAMP, u'-{0}-{1}"'.format(date.hour, date.minute)).replace(TIME_TEXT, date.strftime('>%H:%M<'))
+
+    def render_calendar(self, date, heat):
+        '''heat is amount of pending tasks due at each day of month;
+        time is left as TIME_STAMP in links and as TIME_TEXT, rendered popup does not depend on it'''
+        y, m, d, H, M = date.year, date.month, date.day, 'HH', 'MM'
+
+        content = ('<style> #today {{color: var(--background); background-color: var(--foreground)}}'
+                   ' .due1 {{background-color: color(var(--orangish) alpha(0.25))}}'
+                   ' .due2 {{background-color: color(var(--orangish) alpha(0.5))}}'
+                   ' .due3 {{background-color: color(var(--redish) alpha(0.75))}}</style>'
+                   '<br> <center><big>{prev_month} {next_month} {month}'
+                   '    {prev_year} {next_year} {year}</big></center><br><br>'
                    '{table}<br> {time}<br><br><hr>'
-                   '<br> Click day to insert date '
-                   '<br> into view, click month or '
-                   '<br> time to switch the picker <br><br>'
+                   '<br> Click day to insert date '
+                   '<br> into view, click month or '
+                   '<br> time to switch the picker <br><br>'
                    )
 
-        locale.setlocale(locale.LC_ALL, '')  # to get native month name
         month = '<a href="month:{0}-{1}-{2}-{3}-{4}">{5}</a>'.format(y, m, d, H, M, date.strftime('%B'))
         prev_month = '<a href="prev_month:{0}-{1}-{2}-{3}-{4}">←</a>'.format(y, m, d, H, M)
         next_month = '<a href="next_month:{0}-{1}-{2}-{3}-{4}">→</a>'.format(y, m, d, H, M)
@@ -608,15 +769,18 @@ class PlainTasksCalendar(sublime_plugin.TextCommand):
         year = '<a href="year:{0}-{1}-{2}-{3}-{4}">{0}</a>'.format(y, m, d, H, M)
 
         table = ''
+        import calendar
         for week in calendar.Calendar().monthdayscalendar(y, m):
             row = ['']
             for day in week:
-                link = '<a href="day:{0}-{1}-{2}-{3}-{4}"{5}>{2}</a>'.format(y, m, day, H, M, ' id="today"' if d == day else '')
-                cell = ('  %s' % link if day < 10 else ' %s' % link) if day else '   '
+                due = heat[day - 1] if day else 0
+                attrs = (' id="today"' if d == day else '') + (' class="due%d"' % (1 if due == 1 else 2 if due < 4 else 3) if due else '')
+                link = '<a href="day:{0}-{1}-{2}-{3}-{4}"{5}>{2}</a>'.format(y, m, day, H, M, attrs)
+                cell = ('  %s' % link if day < 10 else ' %s' % link) if day else '   '
                 row.append(cell)
-            table += ' '.join(row + ['<br><br>'])
+            table += ' '.join(row + ['<br><br>'])
 
-        time = '<a href="time:{0}-{1}-{2}-{3}-{4}">{5}</a>'.format(y, m, d, H, M, date.strftime('%H:%M'))
+        time = '<a href="time:{0}-{1}-{2}-{3}-{4}">HH:MM</a>'.format(y, m, d, H, M)
         return content.format(
             prev_month=prev_month, next_month=next_month, month=month,
             prev_year=prev_year, next_year=next_year, year=year,
@@ -675,7 +839,7 @@ class PlainTasksCalendar(sublime_plugin.TextCommand):
 
         def shift(stamp, month=0, year=0):
             y, m, d, H, M = (int(i) for i in stamp.split('-'))
-            date = datetime(y, m, d, H, M, 0) + relativedelta(months=month, years=year)
+            date = shift_months(datetime(y, m, d, H, M, 0), month + year * 12)
             self.view.update_popup(self.generate_calendar(date))
 
         case = {
@@ -700,6 +864,9 @@ class PlainTasksRemain(PlainTasksViewEventListener):
         self.view.settings().add_on_change('plain_tasks_remain_time_phantoms', self.check_setting)
         self.phantoms = self.view.settings().get('plain_tasks_remain_time_phantoms', [])
 
+    def on_pre_close(self):
+        self.view.settings().clear_on_change('plain_tasks_remain_time_phantoms')
+
     def check_setting(self):
         '''add_on_change is issued on change of any setting in settings object'''
         new_value = self.view.settings().get('plain_tasks_remain_time_phantoms', [])
@@ -713,8 +880,9 @@ class PlainTasksRemain(PlainTasksViewEventListener):
         if not self.phantoms:
             self.phantom_set.update([])
             return
-        remain_format = self.view.settings().get('due_remain_format', '{time} remaining')
-        overdue_format = self.view.settings().get('due_overdue_format', '{time} overdue')
+        settings = settings_snapshot(self.view)
+        remain_format = settings.due_remain_format
+        overdue_format = settings.due_overdue_format
 
         upd = []
         for point, content in self.phantoms:
@@ -0,0 +1,375 @@
+# coding: utf-8
+import os
+import sys
+import threading
+import time
+from collections import deque
+import sublime, sublime_plugin
+
+ST3 = int(sublime.version()) >= 3000
+if ST3:
+    from .APlainTasksCommon import state_sizes
+else:
+    from APlainTasksCommon import state_sizes
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    import tracemalloc
+except ImportError:  # Python before 3.4
+    tracemalloc = None
+
+clock = getattr(time, 'perf_counter', time.time)
+# modules of package are files next to this one
+PACKAGE_DIR = os.path.dirname(__file__)
+
+# durations kept per handler, percentiles are computed from them
+HISTOGRAM_SIZE = 1000
+# invocations of all handlers kept to find the slowest recent ones
+RECENT_SIZE = 200
+SLOWEST = 10
+
+
+class Histogram(object):
+    '''Ring buffer of last durations of handler and count of all its calls'''
+    def __init__(self):
+        self.durations = deque(maxlen=HISTOGRAM_SIZE)
+        self.calls = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self.durations.append(seconds)
+        self.calls += 1
+        self.total += seconds
+
+    def percentiles(self, *qs):
+        return percentiles(list(self.durations), qs)
+
+
+def percentiles(values, qs):
+    '''Return value below which is q of values, for each q in qs (nearest rank)'''
+    values = sorted(values)
+    if not values:
+        return [None] * len(qs)
+    return [values[min(len(values) - 1, max(0, int(q * len(values) + .5) - 1))] for q in qs]
+
+
+# {'Class.method': Histogram}
+HISTOGRAMS = {}
+# (seconds, 'Class.method', size of view, file name or view name, time.time())
+RECENT = deque(maxlen=RECENT_SIZE)
+RECORD_LOCK = threading.Lock()
+# {(class, method name): original function} of instrumented handlers
+INSTRUMENTED = {}
+# [cProfile.Profile, invocations left, window] while profiling, see PlainTasksPerfProfileCommand
+PROFILE = []
+MAIN_THREAD = threading.current_thread()
+# View methods counted while perf_api_calls is on, each one is a call to Sublime Text
+API_METHODS = ('scope_name', 'substr', 'line', 'full_line', 'lines', 'find', 'find_all', 'find_by_selector',
+               'indented_region', 'extract_scope', 'match_selector', 'score_selector', 'rowcol', 'text_point',
+               'size', 'sel', 'add_regions', 'get_regions', 'erase_regions', 'insert', 'erase', 'replace')
+# {name: original View method} of counted ones
+API_ORIGINALS = {}
+# {name: [calls, seconds]} per handler being run in main thread, innermost last
+API_ACCOUNTS = []
+# counted calls being run, calls made by API itself (e.g. full_line calling line) are not counted
+API_DEPTH = [0]
+
+
+def handler_view(handler, args):
+    '''view which handler works with, if any: of text command or listener, active one of window'''
+    view = getattr(handler, 'view', None)
+    if view is None and args and isinstance(args[0], sublime.View):
+        view = args[0]
+    if view is None and getattr(handler, 'window', None) is not None:
+        view = handler.window.active_view()
+    if view is None and getattr(handler, 'buffer', None) is not None:
+        view = handler.buffer.primary_view()
+    return view
+
+
+def record(key, seconds, view):
+    size, name = None, ''
+    if view is not None:
+        size, name = view.size(), view.file_name() or view.name()
+    with RECORD_LOCK:
+        histogram = HISTOGRAMS.get(key)
+        if histogram is None:
+            histogram = HISTOGRAMS[key] = Histogram()
+        histogram.add(seconds)
+        RECENT.append((seconds, key, size, name, time.time()))
+
+
+def instrumented(name, function):
+    '''Return wrapper of handler which records its durations and profiles it if asked'''
+    def wrapper(self, *args, **kwargs):
+        key = '%s.%s' % (type(self).__name__, name)
+        main = threading.current_thread() is MAIN_THREAD
+        profile = PROFILE and PROFILE[0] if main else None
+        accounted = main and bool(API_ORIGINALS)
+        if accounted:
+            API_ACCOUNTS.append({})
+        started = clock()
+        if profile:
+            PROFILE[0] = None  # nested handlers are profiled as part of this one
+            profile.enable()
+        try:
+            return function(self, *args, **kwargs)
+        finally:
+            if profile:
+                profile.disable()
+            seconds = clock() - started
+            if accounted:
+                account = API_ACCOUNTS.pop()
+                if not API_ACCOUNTS:
+                    print_api_calls(key, account, seconds)
+            record(key, seconds, handler_view(self, args))
+            if profile and PROFILE:
+                PROFILE[0] = profile
+                profiled()
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__ = function.__doc__
+    wrapper.instrumented = function
+    return wrapper
+
+
+def package_classes():
+    '''commands and listeners defined in modules of package, but this one'''
+    bases = [getattr(sublime_plugin, name, object) for name in (
+        'ApplicationCommand', 'WindowCommand', 'TextCommand', 'EventListener', 'ViewEventListener', 'TextChangeListener')]
+    found, stack = [], [b for b in bases if b is not object]
+    while stack:
+        cls = stack.pop()
+        stack.extend(cls.__subclasses__())
+        module = sys.modules.get(cls.__module__)
+        if os.path.dirname(getattr(module, '__file__', None) or '') == PACKAGE_DIR and cls.__module__ != __name__ and cls not in found:
+            found.append(cls)
+    return found
+
+
+def instrument(on=True):
+    '''wrap run, runCommand and event handlers defined in package classes, or unwrap them;
+    nothing is wrapped while instrumentation is off, so it costs nothing then'''
+    if not on:
+        for (cls, name), function in INSTRUMENTED.items():
+            setattr(cls, name, function)
+        INSTRUMENTED.clear()
+        return
+    for cls in package_classes():
+        for name, function in list(vars(cls).items()):
+            if not (name in ('run', 'runCommand') or name.startswith('on_')) or not callable(function):
+                continue
+            if isinstance(function, (staticmethod, classmethod)) or hasattr(function, 'instrumented'):
+                continue
+            INSTRUMENTED[(cls, name)] = function
+            setattr(cls, name, instrumented(name, function))
+
+
+def counted(name, method):
+    '''Return wrapper of View method which adds its calls in main thread to API_ACCOUNTS'''
+    def wrapper(*args, **kwargs):
+        if not API_ACCOUNTS or API_DEPTH[0] or threading.current_thread() is not MAIN_THREAD:
+            return method(*args, **kwargs)
+        started = clock()
+        API_DEPTH[0] += 1
+        try:
+            return method(*args, **kwargs)
+        finally:
+            API_DEPTH[0] -= 1
+            seconds = clock() - started
+            for account in API_ACCOUNTS:
+                entry = account.get(name)
+                if entry is None:
+                    entry = account[name] = [0, 0.0]
+                entry[0] += 1
+                entry[1] += seconds
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+def count_api(on=True):
+    '''wrap View methods of API_METHODS to count their calls, or unwrap them'''
+    if not on:
+        for name, method in API_ORIGINALS.items():
+            setattr(sublime.View, name, method)
+        API_ORIGINALS.clear()
+        return
+    methods = vars(sublime.View)
+    for name in API_METHODS:
+        if name in methods and name not in API_ORIGINALS:
+            API_ORIGINALS[name] = methods[name]
+            setattr(sublime.View, name, counted(name, methods[name]))
+
+
+def api_calls(function, *args, **kwargs):
+    '''Return {View method: number of calls} made by function(*args, **kwargs) in main thread'''
+    counting = bool(API_ORIGINALS)
+    count_api()
+    API_ACCOUNTS.append({})
+    try:
+        function(*args, **kwargs)
+    finally:
+        account = API_ACCOUNTS.pop()
+        if not counting:
+            count_api(False)
+    return dict((name, calls) for name, (calls, _) in account.items())
+
+
+def print_api_calls(key, account, seconds):
+    '''write calls made by handler to console, most frequent first'''
+    if not account:
+        return
+    calls = sum(c for c, _ in account.values())
+    spent = sum(s for _, s in account.values())
+    print(u'PlainTasks: {0} made {1} API calls, {2:.1f} of {3:.1f} ms'.format(key, calls, spent * 1000, seconds * 1000))
+    for name, (c, s) in sorted(account.items(), key=lambda i: -i[1][0]):
+        print(u'\t{0}\t{1:.1f} ms\t{2}'.format(c, s * 1000, name))
+
+
+def apply_setting():
+    '''perf_api_calls needs handlers instrumented too, calls are counted per handler'''
+    settings = sublime.load_settings('PlainTasks.sublime-settings')
+    count_api(settings.get('perf_api_calls', False))
+    if not PROFILE:
+        instrument(settings.get('perf_instrumentation', False) or bool(API_ORIGINALS))
+
+
+def profiled():
+    '''count down profiled invocation, show statistics after the last one'''
+    PROFILE[1] -= 1
+    if PROFILE[1] > 0:
+        return
+    import pstats
+    profile, _, window = PROFILE
+    del PROFILE[:]
+    apply_setting()
+    stream = StringIO()
+    stats = pstats.Stats(profile, stream=stream)
+    stats.sort_stats('cumulative').print_stats(40)
+    sublime.set_timeout(lambda: show_report(window, u'PlainTasks profile', stream.getvalue()), 0)
+
+
+def show_report(window, name, text):
+    view = window.new_file()
+    view.set_name(name)
+    view.set_scratch(True)
+    view.run_command('append', {'characters': text})
+    view.set_read_only(True)
+    return view
+
+
+def ms(seconds):
+    return u'{0:8.1f}'.format(seconds * 1000) if seconds is not None else u'       –'
+
+
+def report():
+    '''Return text of report: percentiles of durations per handler, slowest recent invocations'''
+    with RECORD_LOCK:
+        histograms = [(key, h.calls, h.total, h.percentiles(.5, .95, .99), max(h.durations)) for key, h in HISTOGRAMS.items()]
+        recent = sorted(RECENT, key=lambda r: -r[0])[:SLOWEST]
+    lines = [u'PlainTasks handlers, milliseconds ({0})'.format(u'instrumented' if INSTRUMENTED else u'perf_instrumentation is off'), u'',
+             u'{0:<56}{1:>8}{2:>9}{3:>9}{4:>9}{5:>9}{6:>10}'.format(u'handler', u'calls', u'p50', u'p95', u'p99', u'max', u'total')]
+    for key, calls, total, (p50, p95, p99), longest in sorted(histograms, key=lambda h: -h[3][1]):
+        lines.append(u'{0:<56}{1:>8} {2} {3} {4} {5} {6:>9.0f}'.format(key, calls, ms(p50), ms(p95), ms(p99), ms(longest), total * 1000))
+    lines += [u'', u'Slowest of last {0} invocations'.format(RECENT_SIZE), u'']
+    for seconds, key, size, name, when in recent:
+        lines.append(u'{0} {1:<56}{2:>10} chars  {3}  {4}'.format(
+            ms(seconds), key, size if size is not None else u'–', time.strftime('%H:%M:%S', time.localtime(when)), name))
+    return u'\n'.join(lines) + u'\n'
+
+
+class PlainTasksPerfReportCommand(sublime_plugin.WindowCommand):
+    '''show durations of commands and event handlers recorded while perf_instrumentation is on'''
+    def run(self, reset=False):
+        if reset:
+            with RECORD_LOCK:
+                HISTOGRAMS.clear()
+                RECENT.clear()
+            return sublime.status_message(u'PlainTasks: performance records are reset')
+        if not HISTOGRAMS:
+            return sublime.status_message(u'PlainTasks: nothing is recorded, set "perf_instrumentation": true in settings')
+        show_report(self.window, u'PlainTasks performance', report())
+
+
+class PlainTasksPerfProfileCommand(sublime_plugin.WindowCommand):
+    '''profile next invocations of commands and event handlers with cProfile and show statistics'''
+    def run(self, invocations=10):
+        import cProfile
+        PROFILE[:] = [cProfile.Profile(), invocations, self.window]
+        if not INSTRUMENTED:
+            instrument()
+        sublime.status_message(u'PlainTasks: profiling next {0} commands and events'.format(invocations))
+
+    def is_enabled(self):
+        return not PROFILE
+
+
+def kb(size):
+    return u'{0:10.1f} KB'.format(size / 1024.0)
+
+
+def memory_report(traced=15):
+    '''Return text of report: estimated bytes of state per view and its buffer, then per file,
+    and lines of package allocating most memory if tracemalloc traces'''
+    held = {}  # {(per, key): [(bytes, name)]}
+    for name, per, key, derived, size in state_sizes():
+        held.setdefault((per, key), []).append((size, name + (u' (derived)' if derived else u'')))
+    budget = sublime.load_settings('PlainTasks.sublime-settings').get('cache_budget', 64)
+    total = sum(size for parts in held.values() for size, _ in parts)
+    lines = [u'PlainTasks state, estimated with sys.getsizeof: {0}, cache_budget {1} MB'.format(kb(total).strip(), budget), u'']
+
+    def add(title, parts):
+        lines.append(u'{0}  {1}'.format(kb(sum(size for size, _ in parts)), title))
+        lines.extend(u'    {0}  {1}'.format(kb(size), name) for size, name in sorted(parts, reverse=True))
+
+    for window in sublime.windows():
+        for view in window.views():
+            parts = held.pop(('view', view.id()), []) + held.pop(('buffer', view.buffer_id()), [])
+            if parts:
+                add(u'{0} (view {1}, buffer {2})'.format(view.file_name() or view.name() or u'untitled', view.id(), view.buffer_id()), parts)
+    for (per, key), parts in sorted(held.items(), key=lambda i: (i[0][0], str(i[0][1]))):
+        add(key if per == 'file' else u'closed {0} {1}'.format(per, key), parts)
+
+    if tracemalloc and tracemalloc.is_tracing():
+        package = os.path.dirname(os.path.abspath(__file__))
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(True, os.path.join(package, '*'))])
+        current, peak = tracemalloc.get_traced_memory()
+        lines += [u'', u'tracemalloc: {0} traced, {1} at peak; lines of package holding most of it'.format(kb(current).strip(), kb(peak).strip()), u'']
+        for stat in snapshot.statistics('lineno')[:traced]:
+            frame = stat.traceback[0]
+            lines.append(u'{0}  {1}:{2}'.format(kb(stat.size), os.path.basename(frame.filename), frame.lineno))
+    return u'\n'.join(lines) + u'\n'
+
+
+class PlainTasksMemoryReportCommand(sublime_plugin.WindowCommand):
+    '''show estimated memory held per view, with trace argument start or stop tracemalloc'''
+    def run(self, trace=None):
+        if trace is None:
+            return show_report(self.window, u'PlainTasks memory', memory_report())
+        if trace:
+            tracemalloc.start()
+        else:
+            tracemalloc.stop()
+        sublime.status_message(u'PlainTasks: tracemalloc is {0}'.format(u'started' if trace else u'stopped'))
+
+    def is_enabled(self, trace=None):
+        return trace is None or tracemalloc is not None and tracemalloc.is_tracing() != trace
+
+
+def plugin_loaded():
+    sublime.load_settings('PlainTasks.sublime-settings').add_on_change('plain_tasks_perf', apply_setting)
+    apply_setting()
+
+
+def plugin_unloaded():
+    sublime.load_settings('PlainTasks.sublime-settings').clear_on_change('plain_tasks_perf')
+    del PROFILE[:]
+    instrument(False)
+    count_api(False)
+
+
+if not ST3:
+    sublime.set_timeout(plugin_loaded, 0)  # modules after this one are loaded by then
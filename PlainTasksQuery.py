@@ -0,0 +1,355 @@
+# coding: utf-8
+import io
+import os
+import sublime, sublime_plugin
+from datetime import datetime, timedelta
+
+ST3 = int(sublime.version()) >= 3000
+if ST3:
+    from .APlainTasksCommon import PlainTasksFold, buffer_cached, buffer_outline, analyse_async, settings_snapshot, start_job, track_state
+    from .PlainTasksDates import due_date
+    from .todo_parser import Outline, HEADER, NOTE
+    from .todo_query import TaskIndex, QueryError, compile_query, PROJECT_NAME_RX, TASKS, FuzzyIndex, fuzzy_entries
+else:
+    from APlainTasksCommon import PlainTasksFold, buffer_cached, buffer_outline, analyse_async, settings_snapshot, start_job, track_state
+    from PlainTasksDates import due_date
+    from todo_parser import Outline, HEADER, NOTE
+    from todo_query import TaskIndex, QueryError, compile_query, PROJECT_NAME_RX, TASKS, FuzzyIndex, fuzzy_entries
+
+QUERY_HISTORY = []  # recent queries, last is the latest
+SEARCH_HISTORY = []
+QUERY_HISTORY_SIZE = 20
+
+
+def remember(query, history=QUERY_HISTORY):
+    if query in history:
+        history.remove(query)
+    history.append(query)
+    del history[:-QUERY_HISTORY_SIZE]
+
+
+def task_index(outline, indexes, settings, tab_size, kinds=TASKS):
+    '''Return TaskIndex of lines of kinds of outline, indexes is dict kept per version of buffer;
+    may be called in worker thread'''
+    key = (settings.date_format, settings.yearfirst, settings.dayfirst, tab_size, kinds)
+    if key not in indexes:
+        now = datetime.now()
+        default = now - timedelta(seconds=now.second, microseconds=now.microsecond)
+        parse_date = lambda text, line: due_date(None, None, text, line, settings, default, [])[0]
+        indexes[key] = TaskIndex(outline, parse_date, tab_size, kinds)
+    return indexes[key]
+
+
+class PlainTasksQuery(PlainTasksFold):
+    '''Fold to tasks matching query, or list them in quick panel if show is "list";
+    query is asked in input panel if not given'''
+    def run(self, edit, query=None, show='fold'):
+        if query is None:
+            window = self.view.window() or sublime.active_window()
+            window.show_input_panel(u'Query (e.g. @high and not done and due < 3d and project ~ "name"):',
+                                    QUERY_HISTORY[-1] if QUERY_HISTORY else u'',
+                                    lambda q: self.view.run_command('plain_tasks_query', {'query': q, 'show': show}),
+                                    None, None)
+            return
+        try:
+            compiled = compile_query(query)
+        except QueryError as e:
+            return sublime.status_message(u'Query: %s' % e)
+        remember(query)
+        settings = settings_snapshot(self.view)
+        tab_size = self.view.settings().get('tab_size', 4)
+        # index is built in worker thread, but once per version of buffer
+        indexes = buffer_cached(self.view, 'task_indexes', lambda view: {})
+        analyse_async(self.view, 'query',
+                      lambda outline: task_index(outline, indexes, settings, tab_size).select(compiled),
+                      lambda lines: self.show(lines, show, tab_size))
+
+    def show(self, lines, show, tab_size):
+        if not lines:
+            return sublime.status_message(u'No tasks match the query')
+        outline = buffer_outline(self.view)
+        if show == 'list':
+            return self.list(outline, lines, tab_size)
+        self.fold_lines(outline, lines)
+        sublime.status_message(u'Tasks matching the query: %d' % len(lines))
+
+    def list(self, outline, lines, tab_size):
+        parents, kinds = outline.parents(tab_size), outline.kinds
+        items = []
+        for index in lines:
+            projects, parent = [], parents[index]
+            while parent is not None:
+                if kinds[parent] == HEADER:
+                    projects.append(PROJECT_NAME_RX.match(outline.line(parent)).group(1))
+                parent = parents[parent]
+            items.append([outline.line(index).strip(), u' / '.join(reversed(projects)) or u' '])
+        self.points = [outline.starts[i] for i in lines]
+        window = self.view.window() or sublime.active_window()
+        window.show_quick_panel(items, self.on_done)
+
+    def on_done(self, index):
+        if index < 0:
+            return
+        point = self.points[index]
+        self.view.sel().clear()
+        self.view.sel().add(sublime.Region(point))
+        self.view.show_at_center(sublime.Region(point))
+
+
+TODO_FILE_ENDINGS = ('.todo', '.tasks', 'todolist.txt')  # file_extensions of syntax
+# {path of todo file: ((modification time, tab size), FuzzyIndex)}, for files not open in window
+FILE_INDEXES = track_state('go to task file indexes', {}, 'file', derived=True)
+GOTO_TASK_LIMIT = 500  # items in quick panel
+
+
+def file_cached(cache, path, extra, build):
+    '''Return build(outline of file), it is called again only if file was modified (or extra changed);
+    cache is {path: ((modification time, extra), value)}'''
+    version = (os.path.getmtime(path), extra)
+    cached = cache.get(path)
+    if not cached or cached[0] != version:
+        with io.open(path, encoding='utf-8', errors='replace') as f:
+            text = f.read()
+        cached = cache[path] = (version, build(Outline(text)))
+    return cached[1]
+
+
+# {path of directory: (modification time, (subdirectories, todo files, archives))}
+DIRECTORY_LISTINGS = track_state('todo file listings', {}, 'file', derived=True)
+
+
+def directory_listing(path):
+    '''Return (paths of subdirectories, of todo files, of archives) in directory;
+    it is listed again only if its modification time changed, i.e. entries were added or removed'''
+    mtime = os.path.getmtime(path)
+    cached = DIRECTORY_LISTINGS.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    subdirs, todos, archives = [], [], []
+    for name in os.listdir(path):
+        full = os.path.join(path, name)
+        if os.path.isdir(full):
+            if not name.startswith('.') and not os.path.islink(full):
+                subdirs.append(full)
+            continue
+        lower = name.lower()
+        if lower.endswith(TODO_FILE_ENDINGS):
+            todos.append(full)
+        elif os.path.splitext(lower)[0].endswith('_archive'):
+            archives.append(full)
+    listing = subdirs, todos, archives
+    DIRECTORY_LISTINGS[path] = (mtime, listing)
+    return listing
+
+
+def todo_files(folders, archives=False):
+    '''generator of paths of todo files in folders, and of archives written by
+    plain_tasks_org_archive (named like name_archive.ext) if archives; hidden folders are skipped
+    and only directories modified since last call are listed again'''
+    for folder in folders:
+        pending = [folder]
+        while pending:
+            path = pending.pop()
+            try:
+                subdirs, todos, archived = directory_listing(path)
+            except (IOError, OSError):
+                DIRECTORY_LISTINGS.pop(path, None)
+                continue
+            for name in todos:
+                yield name
+            if archives:
+                for name in archived:
+                    yield name
+            pending.extend(reversed(subdirs))
+
+
+def todo_views(window):
+    '''Return {buffer id: view} of todo views of window'''
+    views = {}
+    for view in window.views():
+        if view.score_selector(0, 'text.todo') > 0:
+            views.setdefault(view.buffer_id(), view)
+    return views
+
+
+def source_name(source):
+    '''source is view or path'''
+    if isinstance(source, sublime.View):
+        return os.path.basename(source.file_name() or source.name() or u'untitled')
+    return os.path.basename(source)
+
+
+def go_to_line(window, source, line):
+    '''source is view or path'''
+    if not isinstance(source, sublime.View):
+        return window.open_file(u'%s:%d' % (source, line + 1), sublime.ENCODED_POSITION)
+    if ST3 and not source.is_valid():
+        return
+    window.focus_view(source)
+    point = source.text_point(line, 0)
+    source.sel().clear()
+    source.sel().add(sublime.Region(point))
+    source.show_at_center(point)
+
+
+def fuzzy_index(outline, source, tab_size):
+    '''FuzzyIndex of projects and pending tasks of outline, payload is (source, line index, projects);
+    may be called in worker thread'''
+    index = FuzzyIndex((text, depth, (source, line, projects))
+                       for text, depth, line, projects in fuzzy_entries(outline, tab_size))
+    index.blocks  # sorted out here rather than on first search
+    return index
+
+
+class PlainTasksGotoTask(sublime_plugin.WindowCommand):
+    '''Fuzzy go to project or pending task of any todo file of window, open or in its folders;
+    indexes are built in worker thread while pattern is typed in input panel, best match
+    is shown in status bar on every change and all matches are listed in quick panel'''
+    def run(self, pattern=None):
+        view = self.window.active_view()
+        if not view:
+            return
+        tab_size = view.settings().get('tab_size', 4)
+        views = todo_views(self.window)
+        # indexes of open buffers are kept per version of buffer and built in worker
+        sources = [(buffer_cached(v, 'fuzzy_indexes', lambda v: {}), buffer_outline(v), v) for v in views.values()]
+        opened = set(v.file_name() for v in views.values() if v.file_name())
+        folders = self.window.folders()
+        self.indexes, self.pattern, self.typed = None, pattern, None
+        start_job(view, 'goto_task', lambda job: self.index(job, sources, folders, opened, tab_size),
+                  self.indexed, label=u'indexing tasks')
+        if pattern is None:
+            self.window.show_input_panel(u'Go to task or project:', u'', self.on_done, self.on_change, None)
+
+    def index(self, job, sources, folders, opened, tab_size):
+        '''run in worker thread'''
+        indexes = []
+        for cached, outline, view in sources:
+            job.check()
+            if tab_size not in cached:
+                cached[tab_size] = fuzzy_index(outline, view, tab_size)
+            indexes.append(cached[tab_size])
+        for path in todo_files(folders):
+            job.progress(label=u'indexing %s' % path)
+            if path in opened:
+                continue
+            try:
+                indexes.append(file_cached(FILE_INDEXES, path, tab_size,
+                                           lambda outline: fuzzy_index(outline, path, tab_size)))
+            except (IOError, OSError):
+                FILE_INDEXES.pop(path, None)
+        return indexes
+
+    def indexed(self, indexes):
+        self.indexes = indexes
+        if self.pattern is not None:
+            self.show(self.pattern)
+        elif self.typed:
+            self.on_change(self.typed)
+
+    def search(self, pattern, limit):
+        '''best entries of all indexes'''
+        ranked = []
+        for index in self.indexes:
+            ranked.extend(index.ranked(pattern, limit))
+        ranked.sort(key=lambda r: (r[0], r[1][1], len(r[1][0])))
+        return [entry for _, entry in ranked[:limit]]
+
+    def on_change(self, pattern):
+        self.typed = pattern
+        if self.indexes is None or not pattern.strip():
+            return
+        found = self.search(pattern, 1)
+        sublime.status_message(u'Best match: %s' % self.item(found[0])[0] if found else u'No tasks match')
+
+    def on_done(self, pattern):
+        self.pattern = pattern
+        if self.indexes is not None:
+            self.show(pattern)
+
+    def show(self, pattern):
+        self.found = self.search(pattern, GOTO_TASK_LIMIT)
+        if not self.found:
+            return sublime.status_message(u'No tasks match "%s"' % pattern)
+        self.window.show_quick_panel([self.item(entry) for entry in self.found], self.go)
+
+    def item(self, entry):
+        text, _, (source, line, projects) = entry
+        return [text, u'%s: %s' % (source_name(source), projects) if projects else source_name(source)]
+
+    def go(self, index):
+        if index >= 0:
+            source, line, _ = self.found[index][2]
+            go_to_line(self.window, source, line)
+
+
+SEARCHED = TASKS + (NOTE, HEADER)
+# {path: ((modification time, settings), TaskIndex)} of todo and archive files not open in window
+SEARCH_INDEXES = track_state('search file indexes', {}, 'file', derived=True)
+SEARCH_LIMIT = 1000  # items in quick panel
+
+
+class PlainTasksSearch(sublime_plugin.WindowCommand):
+    '''Search tasks, notes and projects of all todo and archive files of window, open ones
+    and those in its folders; query is like for plain_tasks_query, but bare words are
+    looked up in inverted index of words; indexes of files are kept until they are modified'''
+    def run(self, query=None):
+        if query is None:
+            self.window.show_input_panel(u'Search (e.g. deploy backend done date > 2016-01-01):',
+                                         SEARCH_HISTORY[-1] if SEARCH_HISTORY else u'',
+                                         lambda q: self.window.run_command('plain_tasks_search', {'query': q}),
+                                         None, None)
+            return
+        view = self.window.active_view()
+        if not view:
+            return
+        try:
+            compiled = compile_query(query, words=True)
+        except QueryError as e:
+            return sublime.status_message(u'Search: %s' % e)
+        remember(query, SEARCH_HISTORY)
+        settings = settings_snapshot(view)
+        tab_size = view.settings().get('tab_size', 4)
+        views = todo_views(self.window)
+        sources = [(buffer_cached(v, 'task_indexes', lambda v: {}), buffer_outline(v), v) for v in views.values()]
+        opened = set(v.file_name() for v in views.values() if v.file_name())
+        folders = self.window.folders()
+        start_job(view, 'search', lambda job: self.search(job, compiled, sources, folders, opened, settings, tab_size),
+                  self.show, label=u'searching')
+
+    def search(self, job, compiled, sources, folders, opened, settings, tab_size):
+        '''run in worker thread, return list of (source, line index, text)'''
+        now, found = datetime.now(), []
+
+        def add(source, index):
+            outline = index.outline
+            found.extend((source, line, outline.line(line).strip()) for line in index.select(compiled, now))
+
+        for cached, outline, view in sources:
+            job.check()
+            add(view, task_index(outline, cached, settings, tab_size, SEARCHED))
+        extra = (settings.date_format, settings.yearfirst, settings.dayfirst, tab_size)
+        for path in todo_files(folders, archives=True):
+            job.progress(label=u'searching %s' % path)
+            if path in opened:
+                continue
+            try:
+                add(path, file_cached(SEARCH_INDEXES, path, extra,
+                                      lambda outline: task_index(outline, {}, settings, tab_size, SEARCHED)))
+            except (IOError, OSError):
+                SEARCH_INDEXES.pop(path, None)
+        return found
+
+    def show(self, found):
+        if not found:
+            return sublime.status_message(u'Nothing found')
+        if len(found) > SEARCH_LIMIT:
+            sublime.status_message(u'Found %d, first %d are listed' % (len(found), SEARCH_LIMIT))
+        self.found = found[:SEARCH_LIMIT]
+        self.window.show_quick_panel([[text, u'%s:%d' % (source_name(source), line + 1)]
+                                      for source, line, text in self.found], self.go)
+
+    def go(self, index):
+        if index >= 0:
+            source, line, _ = self.found[index]
+            go_to_line(self.window, source, line)
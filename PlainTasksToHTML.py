@@ -3,9 +3,13 @@
 import sublime
 import os
 import re
-import webbrowser
-import cgi
-import tempfile
+import json
+import itertools
+
+try:
+    from html import escape
+except ImportError:  # ST2 & ST3 before 3.2
+    from cgi import escape
 
 platform = sublime.platform()
 ST2 = int(sublime.version()) < 3000
@@ -18,11 +22,13 @@ else:
     import io
 
 if not ST2:
-    from .plist_parser import parse_file
+    from .APlainTasksCommon import start_job
     from .PlainTasks import PlainTasksBase
+    from .todo_parser import tokenize_lines, OPEN, DONE, CANCELLED, HEADER, EMPTY, SEPARATOR, ARCHIVE
 else:
-    from plist_parser import parse_file
+    from APlainTasksCommon import start_job
     from PlainTasks import PlainTasksBase
+    from todo_parser import tokenize_lines, OPEN, DONE, CANCELLED, HEADER, EMPTY, SEPARATOR, ARCHIVE
 
 
 def hex_to_rgba(value):
@@ -87,7 +93,14 @@ scope_to_tag = {  # key is name of regex group, value is regex expression
     '__sep_archive': r'archive(?:\.todo(?!\.))?'
 }
 allrxinone = r'|'.join([('(?P<%s>%s)' % (t, r)) for t, r in scope_to_tag.items()])
-SCOPES_REGEX = re.compile(allrxinone)
+SCOPES_REGEX = None  # compiled on first export
+
+
+def scopes_regex():
+    global SCOPES_REGEX
+    if SCOPES_REGEX is None:
+        SCOPES_REGEX = re.compile(allrxinone)
+    return SCOPES_REGEX
 
 
 def convert_tmtheme_to_css(theme_file):
@@ -95,6 +108,10 @@ def convert_tmtheme_to_css(theme_file):
     if not theme_file:
         return default_ccsl
 
+    if ST2:
+        from plist_parser import parse_file
+    else:
+        from .plist_parser import parse_file
     theme_as_dict = parse_file(theme_file)
     cssl = []
 
@@ -129,7 +146,7 @@ def convert_tmtheme_to_css(theme_file):
         if scope == 'keyword':
             props_str += 'width: 100%; '
 
-        mo = re.search(SCOPES_REGEX, scope)
+        mo = scopes_regex().search(scope)
         tag = mo.lastgroup.replace('__', '.').replace('_', '-') if mo else ''
         if tag:
             cssl.append('%s { %s}' % (tag, props_str))
@@ -144,187 +161,174 @@ def convert_tmtheme_to_css(theme_file):
     return cssl
 
 
+# bump it whenever output of convert_tmtheme_to_css is changed to invalidate cache files
+CSS_CONVERTER_VERSION = 1
+THEME_CSS_CACHE = {}  # path: {'key': [mtime, version], 'css': [lines]}, mirrors cache file
+
+
+def theme_css_cache_file():
+    if not hasattr(sublime, 'cache_path'):  # ST2
+        return None
+    return os.path.join(sublime.cache_path(), 'PlainTasks', 'theme_css.json')
+
+
+def load_theme_css_cache():
+    cache_file = theme_css_cache_file()
+    if not cache_file or not os.path.exists(cache_file):
+        return
+    try:
+        with io.open(cache_file, 'r', encoding='utf8') as f:
+            THEME_CSS_CACHE.update(json.loads(f.read()))
+    except (IOError, OSError, ValueError) as e:
+        print('PlainTasks: cannot read %s, %s' % (cache_file, e))
+
+
+def save_theme_css_cache():
+    cache_file = theme_css_cache_file()
+    if not cache_file:
+        return
+    try:
+        if not os.path.isdir(os.path.dirname(cache_file)):
+            os.makedirs(os.path.dirname(cache_file))
+        with io.open(cache_file, 'w', encoding='utf8') as f:
+            f.write(u'%s' % json.dumps(THEME_CSS_CACHE, ensure_ascii=False))
+    except (IOError, OSError) as e:
+        print('PlainTasks: cannot write %s, %s' % (cache_file, e))
+
+
+def cached_tmtheme_to_css(theme_file):
+    '''convert_tmtheme_to_css memoized in memory and in cache file,
+    entry is valid while path, mtime and CSS_CONVERTER_VERSION are the same'''
+    try:
+        key = [os.path.getmtime(theme_file), CSS_CONVERTER_VERSION]
+    except (OSError, TypeError):
+        return convert_tmtheme_to_css(theme_file)
+    if not THEME_CSS_CACHE:
+        load_theme_css_cache()
+    entry = THEME_CSS_CACHE.get(theme_file)
+    if entry and entry['key'] == key:
+        return entry['css']
+    css = convert_tmtheme_to_css(theme_file)
+    THEME_CSS_CACHE[theme_file] = {'key': key, 'css': css}
+    save_theme_css_cache()
+    return css
+
+
+TEMPLATE_PLACEHOLDER = re.compile(r'\$(title|css|content)')
+EXPORT_CHUNK_LINES = 1000
+
+
+def split_template(template):
+    '''Return list, even items are literal text, odd items are names of placeholders'''
+    return TEMPLATE_PLACEHOLDER.split(template)
+
+
+def render_template(parts, write, **values):
+    '''pass template to write callable piece by piece;
+    value of placeholder is either string or iterable of strings (chunks)'''
+    for i, part in enumerate(parts):
+        if not i % 2:
+            write(part)
+            continue
+        value = values[part]
+        if isinstance(value, (type(''), type(u''))):
+            write(value)
+        else:
+            for chunk in value:
+                write(chunk)
+
+
+# css classes of lines rendered as a whole
+LINE_CLASSES = {HEADER: 'header', EMPTY: 'empty-line', SEPARATOR: 'sep', ARCHIVE: 'sep-archive'}
+BULLET_CLASSES = {OPEN: 'pending', DONE: 'done', CANCELLED: 'cancelled'}
+TAG_CLASSES = {OPEN: 'tag', DONE: 'tag-done', CANCELLED: 'tag-cancelled'}
+
+
 class PlainTasksConvertToHtml(PlainTasksBase):
     def is_enabled(self):
         return self.view.score_selector(0, "text.todo") > 0
 
     def runCommand(self, edit, ask=False):
-        all_lines_regions = self.view.split_by_newlines(sublime.Region(0, self.view.size()))
-        html_doc = []
-        patterns = {'HEADER':    'text.todo keyword.control.header.todo ',
-                    'EMPTY':     'text.todo ',
-                    'NOTE':      'text.todo notes.todo ',
-                    'OPEN':      'text.todo meta.item.todo.pending ',
-                    'DONE':      'text.todo meta.item.todo.completed ',
-                    'CANCELLED': 'text.todo meta.item.todo.cancelled ',
-                    'SEPARATOR': 'text.todo meta.punctuation.separator.todo ',
-                    'ARCHIVE':   'text.todo meta.punctuation.archive.todo '
-                    }
-        for r in all_lines_regions:
-            i = self.view.scope_name(r.a)
-
-            if patterns['HEADER'] in i:
-                ht = '<span class="header">%s</span>' % cgi.escape(self.view.substr(r))
-
-            elif i == patterns['EMPTY']:
-                # these are empty lines (i.e. linebreaks, but span can be {display:none})
-                ht = '<span class="empty-line">%s</span>' % self.view.substr(r)
-
-            elif patterns['NOTE'] in i:
-                scopes = self.extracting_scopes(self, r, i)
-                note = '<span class="note">'
-                for s in scopes:
-                    sn = self.view.scope_name(s.a)
-                    if 'italic' in sn:
-                        note += '<i>%s</i>' % cgi.escape(self.view.substr(s).strip('_*'))
-                    elif 'bold' in sn:
-                        note += '<b>%s</b>' % cgi.escape(self.view.substr(s).strip('_*'))
-                    elif 'url' in sn:
-                        note += '<a href="{0}">{0}</a>'.format(cgi.escape(self.view.substr(s).strip('<>')))
-                    else:
-                        note += cgi.escape(self.view.substr(s))
-                ht = note + '</span>'
-
-            elif patterns['OPEN'] in i:
-                scopes = self.extracting_scopes(self, r)
-                indent = self.view.substr(sublime.Region(r.a, scopes[0].a)) if r.a != scopes[0].a else ''
-                pending = '<span class="open">%s' % indent
-                for s in scopes:
-                    sn = self.view.scope_name(s.a)
-                    if 'bullet' in sn:
-                        pending += '<span class="bullet-pending">%s</span>' % self.view.substr(s)
-                    elif 'meta.tag' in sn:
-                        pending += '<span class="tag">%s</span>' % cgi.escape(self.view.substr(s))
-                    elif 'tag.todo.today' in sn:
-                        pending += '<span class="tag-today">%s</span>' % self.view.substr(s)
-                    elif 'tag.todo.critical' in sn:
-                        pending += '<span class="tag-critical">%s</span>' % self.view.substr(s)
-                    elif 'tag.todo.high' in sn:
-                        pending += '<span class="tag-high">%s</span>' % self.view.substr(s)
-                    elif 'tag.todo.low' in sn:
-                        pending += '<span class="tag-low">%s</span>' % self.view.substr(s)
-                    elif 'italic' in sn:
-                        pending += '<i>%s</i>' % cgi.escape(self.view.substr(s).strip('_*'))
-                    elif 'bold' in sn:
-                        pending += '<b>%s</b>' % cgi.escape(self.view.substr(s).strip('_*'))
-                    elif 'url' in sn:
-                        pending += '<a href="{0}">{0}</a>'.format(cgi.escape(self.view.substr(s).strip('<>')))
-                    else:
-                        pending += cgi.escape(self.view.substr(s))
-                ht = pending + '</span>'
-
-            elif patterns['DONE'] in i:
-                scopes = self.extracting_scopes(self, r)
-                indent = self.view.substr(sublime.Region(r.a, scopes[0].a)) if r.a != scopes[0].a else ''
-                done = '<span class="done">%s' % indent
-                for s in scopes:
-                    sn = self.view.scope_name(s.a)
-                    if 'bullet' in sn:
-                        done += '<span class="bullet-done">%s</span>' % self.view.substr(s)
-                    elif 'tag.todo.completed' in sn:
-                        done += '<span class="tag-done">%s</span>' % cgi.escape(self.view.substr(s))
-                    else:
-                        done += cgi.escape(self.view.substr(s))
-                ht = done + '</span>'
-
-            elif patterns['CANCELLED'] in i:
-                scopes = self.extracting_scopes(self, r)
-                indent = self.view.substr(sublime.Region(r.a, scopes[0].a)) if r.a != scopes[0].a else ''
-                cancelled = '<span class="cancelled">%s' % indent
-                for s in scopes:
-                    sn = self.view.scope_name(s.a)
-                    if 'bullet' in sn:
-                        cancelled += '<span class="bullet-cancelled">%s</span>' % self.view.substr(s)
-                    elif 'tag.todo.cancelled' in sn:
-                        cancelled += '<span class="tag-cancelled">%s</span>' % cgi.escape(self.view.substr(s))
-                    else:
-                        cancelled += cgi.escape(self.view.substr(s))
-                ht = cancelled + '</span>'
-
-            elif patterns['SEPARATOR'] in i:
-                ht = '<span class="sep">%s</span>' % cgi.escape(self.view.substr(r))
-
-            elif patterns['ARCHIVE'] in i:
-                ht = '<span class="sep-archive">%s</span>' % cgi.escape(self.view.substr(r))
-
-            else:
-                sublime.error_message('Hey! you are not supposed to see this message.\n'
-                                      'Please, report an issue in PlainTasks repository on GitHub.')
-            html_doc.append(ht)
-
+        text = self.view.substr(sublime.Region(0, self.view.size()))
         title = os.path.basename(self.view.file_name()) if self.view.file_name() else 'Export'
-        html  = self.produce_html_from_template(title, html_doc)
+        parts = self.load_template()
+        css = '\n'.join(self.theme_css())
 
         if ask:
+            html = []
+            render_template(parts, html.append, title=title, css=css, content=self.html_chunks(text))
             window = sublime.active_window()
             nv = window.new_file()
             nv.set_syntax_file('Packages/HTML/HTML.tmLanguage')
             nv.set_name(title + '.html')
-            nv.insert(edit, 0, html)
+            nv.insert(edit, 0, u''.join(html))
             window.run_command('close_file')
             return
 
-        tmp_html = tempfile.NamedTemporaryFile(delete=False, suffix='.html')
-        tmp_html.write(html.encode('utf-8'))
-        tmp_html.close()
-        webbrowser.open_new_tab("file://%s" % tmp_html.name)
+        # export of the same view which is still running is superseded
+        start_job(self.view, 'export', lambda job: self.export(job, parts, title, css, text), self.open_in_browser,
+                  label=u'Exporting to HTML')
 
-    def produce_html_from_template(self, title, html_doc):
-        html_lines = []
+    def export(self, job, parts, title, css, text):
+        '''run in separate thread; write html into temporary file chunk by chunk'''
+        total = text.count('\n') + 1
+        import tempfile
+        tmp_html = tempfile.NamedTemporaryFile(delete=False, suffix='.html')
+        written = False
+        try:
+            render_template(parts, lambda chunk: tmp_html.write(chunk.encode('utf-8')),
+                            title=title, css=css, content=self.html_chunks(text, lambda done: job.progress(done, total)))
+            written = True
+        finally:
+            tmp_html.close()
+            if not written:  # cancelled or failed, exception goes on
+                os.remove(tmp_html.name)
+        return tmp_html.name
+
+    def open_in_browser(self, name):
+        import webbrowser
+        webbrowser.open_new_tab("file://%s" % name)
+
+    def theme_css(self):
         ppath = sublime.packages_path()
         tmtheme = os.path.join(ppath, self.view.settings().get('color_scheme').replace('Packages/', '', 1))
-        css = '\n'.join(convert_tmtheme_to_css(tmtheme))
-        with io.open(os.path.join(ppath, 'PlainTasks/templates/template.html'), 'r', encoding='utf8') as template:
-            for line in template:
-                line = (line.replace('$title', title)
-                            .replace('$content', '\n'.join(html_doc))
-                            .replace('$css', css)
-                            .strip('\n'))
-                html_lines.append(line)
-        return u'\n'.join(html_lines)
-
-    def extracting_scopes(self, edit, region, scope_name=''):
-        '''extract scope for each char in line wo dups, ineffective but it works?'''
-        scopes = []
-
-        for p in range(region.b-region.a):
-            p += region.a
-            sr = self.view.extract_scope(p)
-            # fix multi-line, because variable region is always a single line
-            if sr.a < region.a or sr.b - 1 > region.b:
-                if scopes and p == scopes[~0].b:  # *text* inbetween *markups*
-                    sr = sublime.Region(p, region.b)
-                else:  # multi-line
-                    sr = sublime.Region(region.a, region.b)
-            # main block, add unique entity to the list
-            if sr not in scopes:
-                scopes.append(sr)
-            elif scopes and self.view.scope_name(p) != self.view.scope_name(scopes[~0].a):
-                scopes.append(sublime.Region(p, region.b))
-            # fix intersecting regions, e.g. markup in notes
-            if scopes and sr.a < scopes[~0].b and p - 1 == scopes[~0].b:
-                scopes.append(sublime.Region(scopes[~0].b, sr.b))
-
-        if scopes and scopes[~0].b > region.b:
-            # avoid line break at eol
-            scopes[~0] = sublime.Region(scopes[~0].a, region.b)
-
-        if len(scopes) > 1:
-            # fix bullet
-            if scopes[0].intersects(scopes[1]):
-                scopes[0] = sublime.Region(scopes[0].a, scopes[1].a)
-            # fix text after tag(s)
-            if scopes[~0].b < region.b or scopes[~0].a < region.a:
-                scopes.append(sublime.Region(scopes[~0].b, region.b))
-            new_scopes = scopes[:0:~0]
-            for i, s in enumerate(new_scopes):
-                # fix overall intersections
-                if s.intersects(scopes[~(i + 1)]):
-                    if scopes[~(i + 1)].b < s.b:
-                        scopes[~i] = sublime.Region(scopes[~(i + 1)].b, s.b)
-                        new_scopes[i] = scopes[~i]
-                    else:
-                        scopes[~(i + 1)] = sublime.Region(scopes[~(i + 1)].a, s.a)
-                        if len(new_scopes) > i + 1:
-                            new_scopes[i + 1] = scopes[~(i + 1)]
-        return scopes
+        return cached_tmtheme_to_css(tmtheme)
+
+    def load_template(self):
+        template = os.path.join(sublime.packages_path(), 'PlainTasks/templates/template.html')
+        with io.open(template, 'r', encoding='utf8') as f:
+            return split_template(f.read())
+
+    def html_chunks(self, text, progress=None):
+        '''generator of html for EXPORT_CHUNK_LINES lines of text at once'''
+        lines = tokenize_lines(text)
+        done = 0
+        while True:
+            chunk = [self.line_to_html(kind, runs) for kind, runs in itertools.islice(lines, EXPORT_CHUNK_LINES)]
+            if not chunk:
+                return
+            yield (u'\n' if done else u'') + u'\n'.join(chunk)
+            done += len(chunk)
+            if progress:
+                progress(done)
+
+    def line_to_html(self, kind, runs):
+        if kind in LINE_CLASSES:
+            return '<span class="%s">%s</span>' % (LINE_CLASSES[kind], escape(''.join(f for _, f in runs), False))
+        # notes & tasks, kind is css class as well
+        return '<span class="%s">%s</span>' % (kind, ''.join(self.run_to_html(kind, t, f) for t, f in runs))
+
+    def run_to_html(self, kind, token, fragment):
+        if token == 'bullet':
+            return '<span class="bullet-%s">%s</span>' % (BULLET_CLASSES[kind], fragment)
+        if token == 'italic':
+            return '<i>%s</i>' % escape(fragment.strip('_*'), False)
+        if token == 'bold':
+            return '<b>%s</b>' % escape(fragment.strip('_*'), False)
+        if token == 'url':
+            return '<a href="{0}">{0}</a>'.format(escape(fragment.strip('<>'), False))
+        if token == 'tag':
+            return '<span class="%s">%s</span>' % (TAG_CLASSES[kind], escape(fragment, False))
+        if token in ('today', 'critical', 'high', 'low'):
+            return '<span class="tag-%s">%s</span>' % (token, fragment)
+        return escape(fragment, False)
@@ -0,0 +1,9 @@
+"""Performance benchmarks for PlainTasks, run from the root of the package, e.g.
+
+    python -m benchmarks.bench_plist
+    python -m benchmarks.bench_core --sizes 1000,10000,100000 --json results.json
+    python -m benchmarks.bench_commands --sizes 1000,10000 --json commands.json
+
+Modules here are not loaded by Sublime Text, they must not import ``sublime``;
+bench_commands imports its headless stand-in from tests/headless.
+"""
@@ -0,0 +1,119 @@
+# coding: utf-8
+"""Time commands end to end on synthetic documents (see corpus.py) and real files,
+in the headless stand-in of Sublime Text API from tests/headless.
+
+    python -m benchmarks.bench_commands [--sizes 1000,10000] [--files a.todo,b.todo]
+                                        [--cases complete,archive] [--repeat N]
+                                        [--json results.json] [--baseline results.json] [--threshold 1.25]
+
+Each run gets fresh view with the document, caret in its middle; time includes work
+done in worker threads and callbacks, until all of them are finished. Output and
+options are those of bench_core.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests', 'headless'))
+
+import sublime  # noqa: E402
+import sublime_plugin  # noqa: E402
+from benchmarks.bench_core import documents, compare  # noqa: E402
+
+SYNTAX = 'Packages/PlainTasks/PlainTasks.sublime-syntax'
+
+# name: (command, args, selection), selection is 'middle' task or 'all'
+CASES = [
+    ('new', ('plain_tasks_new', None, 'middle')),
+    ('complete', ('plain_tasks_complete', None, 'middle')),
+    ('cancel', ('plain_tasks_cancel', None, 'middle')),
+    ('archive', ('plain_tasks_archive', None, 'middle')),
+    ('sort_by_date', ('plain_tasks_sort_by_date', None, 'middle')),
+    ('recalculate', ('plain_tasks_re_calculate_time_for_tasks', None, 'all')),
+    ('highlight_due', ('plain_tasks_toggle_highlight_past_due', None, 'middle')),
+    ('fold_to_due', ('plain_tasks_fold_to_due_tags', None, 'middle')),
+    ('query', ('plain_tasks_query', {'query': '@high and not @waiting'}, 'middle')),
+    ('goto_tag', ('plain_tasks_goto_tag', None, 'middle')),
+]
+
+
+def open_view(window, text, selection):
+    view = window.new_file(syntax=SYNTAX)
+    view.set_scratch(True)
+    view.run_command('append', {'characters': text})
+    view.sel().clear()
+    if selection == 'all':
+        view.sel().add(sublime.Region(0, view.size()))
+    else:
+        middle = view.find(u'^\\s*☐', view.size() // 2)
+        view.sel().add(sublime.Region(middle.b if middle.b >= 0 else 0))
+    sublime.run_timeouts(5)  # events of opening are not timed
+    return view
+
+
+def bench(text, cases, repeat):
+    '''Return {case: best time in seconds}'''
+    window = sublime.active_window()
+    results = {}
+    for name, (command, args, selection) in CASES:
+        if name not in cases:
+            continue
+        times = []
+        for _ in range(repeat + 1):  # the first one warms up
+            view = open_view(window, text, selection)
+            started = time.time()
+            view.run_command(command, args)
+            sublime.run_timeouts(60)
+            times.append(time.time() - started)
+            view.close()
+        results[name] = min(times[1:])
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000', help='lines in synthetic documents')
+    parser.add_argument('--files', default='', help='real documents, comma separated')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--cases', default=','.join(name for name, _ in CASES))
+    parser.add_argument('--repeat', type=int, default=5, help='for 1k lines, fewer for bigger documents')
+    parser.add_argument('--json', help='save results')
+    parser.add_argument('--baseline', help='compare with saved results')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown which is regression')
+    args = parser.parse_args(argv)
+
+    sublime_plugin.load_package(ROOT, 'PlainTasks')
+    cases = set(args.cases.split(','))
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    results, regressions = {}, []
+    for name, text in documents(args):
+        lines = text.count('\n') + 1
+        repeat = max(1, min(args.repeat, args.repeat * 1000 // lines))
+        results[name] = bench(text, cases, repeat)
+        print(name)
+        if name in baseline:
+            regressions += compare(name, results[name], baseline[name], args.threshold)
+        else:
+            for case, seconds in sorted(results[name].items()):
+                print('    %-16s %10.2fms' % (case, seconds * 1000))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'meta': {'python': platform.python_version(), 'platform': platform.platform(),
+                                'seed': args.seed, 'repeat': args.repeat, 'sublime': sublime.version()},
+                       'results': results}, f, indent=2, sort_keys=True)
+    for name, case in regressions:
+        print('regression: %s, %s' % (case, name))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,215 @@
+# coding: utf-8
+"""Time core algorithms on synthetic documents (see corpus.py) and real files.
+
+    python -m benchmarks.bench_core [--sizes 1000,10000,100000] [--files a.todo,b.todo]
+                                    [--cases classify,stats] [--repeat N]
+                                    [--json results.json] [--baseline results.json] [--threshold 1.25]
+
+Prints best time of each case per document; --json saves them, --baseline compares
+them to saved ones, exit status is 1 if any case is slower than threshold allows.
+No view is involved: archivable, sort_archive, recalculate, stats, due_dates and
+html_export time the functions their commands call, imported with the package in the headless stand-in of Sublime
+Text API from tests/headless; bench_commands times commands end to end.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import timeit
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests', 'headless'))
+
+import sublime  # noqa: E402
+import sublime_plugin  # noqa: E402
+from benchmarks.corpus import document, DATE_FORMAT  # noqa: E402
+from todo_parser import (Outline, HEADER, EMPTY, NOTE, OPEN, DONE, CANCELLED,  # noqa: E402
+                         tokenize_lines, due_tags, priority_tags, tag_counts, TagTrie, with_context)
+from todo_query import TaskIndex, TASKS, compile_query, FuzzyIndex, fuzzy_entries  # noqa: E402
+
+QUERY = u'@high and not @waiting and due < 3d or project ~ "^Back"'
+PATTERNS = (u'dep', u'rel notes', u'bkd', u'zzz')
+# differences below it are noise rather than regressions
+NOISE = 0.001
+
+
+def parse_date(text, line):
+    try:
+        return datetime.strptime(text, DATE_FORMAT)
+    except ValueError:
+        return None
+
+
+def prepared(text):
+    '''Outline with starts and kinds computed'''
+    outline = Outline(text)
+    outline.kinds
+    return outline
+
+
+def fresh(outline):
+    '''Outline sharing computed starts and kinds, but nothing computed from them'''
+    return Outline(outline.text, outline.starts, outline.kinds)
+
+
+def plugin(name):
+    '''module of package, which is loaded on first call'''
+    sublime_plugin.load_package(ROOT, 'PlainTasks')
+    return sys.modules['PlainTasks.' + name]
+
+
+def with_settings(text):
+    '''prepared outline and settings snapshot of package defaults, with date format of corpus'''
+    settings = sublime.load_settings('PlainTasks.sublime-settings')
+    snapshot = plugin('APlainTasksCommon').PlainTasksSettings(settings)
+    snapshot.date_format = DATE_FORMAT
+    return prepared(text), snapshot
+
+
+def sorted_archive(outline, settings):
+    '''what plain_tasks_sort_by_date moves, it does nothing without archive'''
+    start = outline.text.find(settings.archive_name)
+    if start < 0:
+        return [], []
+    return plugin('PlainTasks').PlainTasksSortByDate.sorted_archive(outline, start + len(settings.archive_name), settings.new_on_top)
+
+
+def html_export(text):
+    '''html of whole text, as plain_tasks_convert_to_html writes it chunk by chunk'''
+    return sum(len(chunk) for chunk in plugin('PlainTasksToHTML').PlainTasksConvertToHtml(None).html_chunks(text))
+
+
+def archived(outline, settings):
+    '''what plain_tasks_archive looks up: completed and cancelled tasks above archive with
+    their notes, and projects of the tasks'''
+    command = plugin('PlainTasks').PlainTasksArchiveCommand
+    limit = outline.text.find(settings.archive_name)
+    tasks = command.archivable_tasks(outline, limit if limit > 0 else len(outline.text))
+    return [(index, command.task_project(outline, index)) for index in tasks if outline.kinds[index] in (DONE, CANCELLED)]
+
+
+def recalculated(outline, settings):
+    '''what plain_tasks_re_calculate_time_for_tasks computes for selected lines, here for all of them'''
+    recalculate = plugin('PlainTasksDates').PlainTasksReCalculateTimeForTasks.recalculate
+    time_spent = plugin('PlainTasksDates').PlainTasksCalculateTimeForTask.time_spent
+    now = datetime(2017, 1, 1).strftime(settings.date_format)
+    spent = []
+    for index, kind in enumerate(outline.kinds):
+        if kind != DONE and kind != CANCELLED:
+            continue
+        _, started, toggles, finished = recalculate(outline.line(index), now)
+        if started:
+            try:
+                spent.append(time_spent(started, toggles, finished, settings.date_format))
+            except ValueError:
+                pass
+    return spent
+
+
+# name: (setup(text), run(prepared)), run is timed, setup is not
+CASES = [
+    ('classify', (lambda text: text, lambda text: Outline(text).kinds)),
+    ('line_starts', (lambda text: text, lambda text: Outline(text).starts)),
+    ('edit', (prepared, lambda outline: outline.edit(len(outline.text) // 2, len(outline.text) // 2, u'\n☐ new task').kinds)),
+    ('stats', (with_settings, lambda args: plugin('PlainTasks').PlainTasksStatsStatus.get_stats(fresh(args[0]), args[1]))),
+    ('due_tags', (prepared, lambda outline: list(due_tags(outline, (HEADER, EMPTY, NOTE, OPEN))))),
+    ('due_dates', (with_settings, lambda args: plugin('PlainTasksDates').group_due_tags(fresh(args[0]), args[1], [], {}))),
+    ('archivable', (with_settings, lambda args: archived(fresh(args[0]), args[1]))),
+    ('priority_tags', (prepared, lambda outline: priority_tags(fresh(outline)))),
+    ('fold_context', (prepared, lambda outline: with_context(fresh(outline), [i for i, k in enumerate(outline.kinds) if k == OPEN][::7]))),
+    ('sort_archive', (with_settings, lambda args: sorted_archive(fresh(args[0]), args[1]))),
+    ('recalculate', (with_settings, lambda args: recalculated(*args))),
+    ('html_export', (lambda text: text, html_export)),
+    ('tokenize', (lambda text: text, lambda text: sum(1 for _ in tokenize_lines(text)))),
+    ('tag_trie', (lambda text: text, lambda text: TagTrie().update(tag_counts(text)))),
+    ('task_index', (prepared, lambda outline: TaskIndex(outline, parse_date))),
+    ('query', (lambda text: TaskIndex(prepared(text), parse_date),
+               lambda index: index.select(compile_query(QUERY), datetime(2016, 12, 30)))),
+    ('word_index', (prepared, lambda outline: TaskIndex(outline, None, 4, TASKS + (NOTE, HEADER)).words)),
+    ('fuzzy_index', (prepared, lambda outline: FuzzyIndex(fuzzy_entries(outline)).blocks)),
+    ('fuzzy_search', (lambda text: FuzzyIndex(fuzzy_entries(prepared(text))),
+                      lambda index: [index.search(p) for p in PATTERNS])),
+]
+
+
+def bench(text, cases, repeat):
+    '''Return {case: best time in seconds}'''
+    results = {}
+    for name, (setup, run) in CASES:
+        if name not in cases:
+            continue
+        argument = setup(text)
+        run(argument)  # warm up, e.g. compiled regexes and lazy indexes of argument
+        results[name] = min(timeit.repeat(lambda: run(argument), number=1, repeat=repeat))
+    return results
+
+
+def documents(args):
+    '''generator of (name, text)'''
+    for size in (int(s) for s in args.sizes.split(',') if s):
+        yield '%d lines' % size, document(size, args.seed)
+    for name in (n for n in args.files.split(',') if n):
+        with io.open(name, encoding='utf-8') as f:
+            yield os.path.basename(name), f.read()
+
+
+def compare(name, results, baseline, threshold):
+    '''print ratios to baseline, return list of regressed cases'''
+    regressions = []
+    for case, seconds in sorted(results.items()):
+        before = baseline.get(case)
+        if before is None:
+            continue
+        ratio = seconds / before if before else float('inf')
+        regressed = ratio > threshold and seconds - before > NOISE
+        if regressed:
+            regressions.append((name, case))
+        print('    %-16s %10.2fms %10.2fms %6.2fx%s' % (case, before * 1000, seconds * 1000, ratio, '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,100000', help='lines in synthetic documents, up to 1000000')
+    parser.add_argument('--files', default='', help='real documents, comma separated')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--cases', default=','.join(name for name, _ in CASES))
+    parser.add_argument('--repeat', type=int, default=10, help='for 10k lines, fewer for bigger documents')
+    parser.add_argument('--json', help='save results')
+    parser.add_argument('--baseline', help='compare with saved results')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown which is regression')
+    args = parser.parse_args(argv)
+
+    cases = set(args.cases.split(','))
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    results, regressions = {}, []
+    for name, text in documents(args):
+        lines = text.count('\n') + 1
+        repeat = max(1, min(args.repeat, args.repeat * 10000 // lines))
+        results[name] = bench(text, cases, repeat)
+        print(name)
+        if name in baseline:
+            regressions += compare(name, results[name], baseline[name], args.threshold)
+        else:
+            for case, seconds in sorted(results[name].items()):
+                print('    %-16s %10.2fms' % (case, seconds * 1000))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'meta': {'python': platform.python_version(), 'platform': platform.platform(),
+                                'seed': args.seed, 'repeat': args.repeat},
+                       'results': results}, f, indent=2, sort_keys=True)
+    for name, case in regressions:
+        print('regression: %s, %s' % (case, name))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+# coding: utf-8
+"""Compare parsing paths of plist_parser on bundled themes and synthetic plists.
+
+    python -m benchmarks.bench_plist [--repeat N] [--sizes 100,1000,10000]
+"""
+import argparse
+import glob
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from plist_parser import XmlPropertyListParser  # noqa: E402
+
+METHODS = ('_parse_using_expat', '_parse_using_etree', '_parse_using_sax_parser')
+
+ITEM = u'''
+    <dict>
+      <key>name</key>
+      <string>Item %d</string>
+      <key>scope</key>
+      <string>meta.item.todo.pending.n%d</string>
+      <key>settings</key>
+      <dict>
+        <key>foreground</key>
+        <string>#%06x</string>
+        <key>fontStyle</key>
+        <string>bold</string>
+      </dict>
+    </dict>'''
+
+
+def synthetic_plist(items):
+    '''tmTheme-like plist with given number of scope settings'''
+    return (u'<?xml version="1.0" encoding="UTF-8"?>\n'
+            u'<plist version="1.0"><dict><key>name</key><string>Synthetic</string>'
+            u'<key>settings</key><array>%s\n  </array></dict></plist>' %
+            u''.join(ITEM % (i, i, i % 0xffffff) for i in range(items))).encode('utf-8')
+
+
+def bench(data, repeat):
+    '''Return dict method: best time of parsing data in seconds, None if unavailable'''
+    results = {}
+    for method in METHODS:
+        parse = lambda: getattr(XmlPropertyListParser(), method)(data)
+        try:
+            parse()
+        except ImportError:
+            results[method] = None
+            continue
+        results[method] = min(timeit.repeat(parse, number=1, repeat=repeat))
+    return results
+
+
+def report(name, results):
+    cells = ['%8.2fms' % (t * 1000) if t is not None else '%10s' % 'n/a' for t in (results[m] for m in METHODS)]
+    print('%-40s %s' % (name, ' '.join(cells)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--sizes', default='100,1000,10000', help='items in synthetic plists')
+    args = parser.parse_args(argv)
+
+    print('%-40s %s' % ('', ' '.join('%10s' % m.replace('_parse_using_', '')[:10] for m in METHODS)))
+    for theme in sorted(glob.glob(os.path.join(ROOT, '*.hidden-tmTheme'))):
+        with open(theme, 'rb') as f:
+            report(os.path.basename(theme), bench(f.read(), args.repeat))
+    for size in (int(s) for s in args.sizes.split(',')):
+        report('synthetic, %d items' % size, bench(synthetic_plist(size), max(1, args.repeat // 5)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# coding: utf-8
+"""Synthetic todo documents: nested projects, notes, tags, dates and a large archive.
+
+    python -m benchmarks.corpus [--sizes 1000,10000] [--seed 1] [--out DIR]
+
+writes DIR/corpus-<lines>.todo for each size (``benchmarks/corpus`` by default).
+"""
+import argparse
+import io
+import os
+import random
+from datetime import datetime, timedelta
+
+WORDS = (u'write update review fix deploy refactor release test call email plan draft check '
+         u'merge backup migrate document design meet order book pay clean prepare send read '
+         u'server client backend frontend parser index report invoice budget schema cache '
+         u'docs team release notes build pipeline database config account query feature').split()
+PROJECTS = (u'Work Home Backend Frontend Infrastructure Errands Reading Finance Travel Garden '
+            u'Research Hiring Marketing Support Design Ops Health Learning').split()
+TAGS = (u'@high', u'@low', u'@critical', u'@today', u'@waiting', u'@someday', u'@phone', u'@errand')
+DATE_FORMAT = u'(%y-%m-%d %H:%M)'
+ARCHIVE = u'＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿＿'
+
+
+class Corpus(object):
+    '''Generator of lines, ratios are close to real world documents:
+    active part is a fifth of the document and the rest is archive'''
+    def __init__(self, seed=1, now=datetime(2016, 12, 30, 10, 0)):
+        self.random = random.Random(seed)
+        self.now = now
+
+    def date(self, days_from, days_to):
+        delta = timedelta(days=self.random.randint(days_from, days_to), minutes=self.random.randint(0, 24 * 60))
+        return (self.now + delta).strftime(DATE_FORMAT)
+
+    def text(self):
+        return u' '.join(self.random.choice(WORDS) for _ in range(self.random.randint(2, 8)))
+
+    def tags(self):
+        choice, chance = self.random.choice, self.random.random
+        tags = [choice(TAGS)] if chance() < .3 else []
+        if chance() < .15:
+            tags.append(u'@due%s' % self.date(-20, 60))
+        if chance() < .05:
+            tags.append(u'@tag(%s)' % choice(WORDS))
+        return tags
+
+    def task(self, indent):
+        r = self.random.random()
+        tags = self.tags()
+        if r < .6:
+            bullet = u'☐'
+            if self.random.random() < .1:
+                tags.append(u'@started%s' % self.date(-10, -1))
+                if self.random.random() < .5:
+                    tags.append(u'@toggle%s' % self.date(-1, 0))
+        elif r < .9:
+            bullet = u'✔'
+            tags += [u'@started%s' % self.date(-30, -2), u'@done%s' % self.date(-1, 0),
+                     u'@lasted(%dd%dh%dm)' % (self.random.randint(0, 9), self.random.randint(0, 23), self.random.randint(0, 59))]
+        else:
+            bullet = u'✘'
+            tags.append(u'@cancelled%s' % self.date(-30, 0))
+        return u' '.join([indent + bullet, self.text()] + tags)
+
+    def project(self, depth, budget):
+        '''lines of project with nested ones, about budget lines'''
+        indent = u'    ' * depth
+        lines = [u'%s%s %s:%s' % (indent, self.random.choice(PROJECTS), self.random.randint(1, 999),
+                                 u' ' + self.random.choice(TAGS) if self.random.random() < .1 else u'')]
+        while len(lines) < budget:
+            r = self.random.random()
+            if r < .08 and depth < 3 and budget - len(lines) > 10:
+                lines.extend(self.project(depth + 1, self.random.randint(5, min(60, budget - len(lines)))))
+            elif r < .25 and lines and lines[-1].lstrip()[:1] in u'☐✔✘':
+                lines.append(u'%s    %s' % (indent, self.text().capitalize()))  # note of the task above
+            else:
+                lines.append(self.task(indent + u'    '))
+        lines.append(u'')
+        return lines
+
+    def archived(self):
+        project = u'%s %d' % (self.random.choice(PROJECTS), self.random.randint(1, 999))
+        if self.random.random() < .85:
+            return u'    ✔ %s @done%s @project(%s)' % (self.text(), self.date(-3000, -1), project)
+        return u'    ✘ %s @cancelled%s @project(%s)' % (self.text(), self.date(-3000, -1), project)
+
+    def lines(self, size):
+        '''Return list of size lines'''
+        active = max(size // 5, 10)
+        lines = []
+        while len(lines) < active:
+            lines.extend(self.project(0, self.random.randint(10, 200)))
+        lines[active:] = []
+        lines += [u'', ARCHIVE, u'Archive:']
+        while len(lines) < size:
+            lines.append(self.archived())
+        return lines[:size]
+
+    def document(self, size):
+        return u'\n'.join(self.lines(size))
+
+
+def document(size, seed=1):
+    '''text of synthetic todo document of size lines'''
+    return Corpus(seed).document(size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000', help='lines in documents')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus'))
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.out):
+        os.makedirs(args.out)
+    for size in (int(s) for s in args.sizes.split(',')):
+        name = os.path.join(args.out, 'corpus-%d.todo' % size)
+        with io.open(name, 'w', encoding='utf-8') as f:
+            f.write(document(size, args.seed))
+        print(name)
+
+
+if __name__ == '__main__':
+    main()
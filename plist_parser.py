@@ -16,7 +16,9 @@ import re
 import sys
 
 
-if sys.version_info >= (3,):
+PY3 = sys.version_info >= (3,)
+
+if PY3:
     # Some forwards compatability
     basestring = str
 
@@ -79,7 +81,7 @@ class XmlPropertyListParser(object):
     def endDocument(self):
         self._assert(self.__plist is not None, "A top level element must be <plist>.")
         self._assert(
-            len(self.__stack) is 0,
+            len(self.__stack) == 0,
             "multiple objects at top level.")
 
     def startElement(self, name, attributes):
@@ -94,12 +96,13 @@ class XmlPropertyListParser(object):
         if name in XmlPropertyListParser.PARSE_CALLBACKS:
             # Creates character string from buffered characters.
             content = ''.join(self.__characters)
-            # For compatibility with ``xml.etree`` and ``plistlib``,
+            # For compatibility with ``xml.etree`` and ``plistlib`` of Python 2,
             # convert text string to ascii, if possible
-            try:
-                content = content.encode('ascii')
-            except (UnicodeError, AttributeError):
-                pass
+            if not PY3:
+                try:
+                    content = content.encode('ascii')
+                except (UnicodeError, AttributeError):
+                    pass
             XmlPropertyListParser.PARSE_CALLBACKS[name](self, name, content)
             self.__characters = None
 
@@ -237,15 +240,42 @@ class XmlPropertyListParser(object):
     def _to_stream(self, io_or_string):
         if isinstance(io_or_string, basestring):
             # Creates a string stream for in-memory contents.
+            if PY3:
+                from io import BytesIO
+                return BytesIO(io_or_string.encode('utf-8'))
             from cStringIO import StringIO
             return StringIO(io_or_string)
+        elif PY3 and isinstance(io_or_string, bytes):
+            from io import BytesIO
+            return BytesIO(io_or_string)
         elif hasattr(io_or_string, 'read') and callable(getattr(io_or_string, 'read')):
             return io_or_string
         else:
             raise TypeError('Can\'t convert %s to file-like-object' % type(io_or_string))
 
+    def _parse_using_expat(self, xml_input):
+        from xml.parsers.expat import ParserCreate, ExpatError
+
+        parser = ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self.startElement
+        parser.EndElementHandler = self.endElement
+        parser.CharacterDataHandler = self.characters
+        self.startDocument()
+        try:
+            parser.ParseFile(self._to_stream(xml_input))
+        except ExpatError as e:
+            raise PropertyListParseError(e)
+
+        self.endDocument()
+        return self.__plist
+
     def _parse_using_etree(self, xml_input):
-        from xml.etree.cElementTree import iterparse
+        try:
+            from xml.etree.cElementTree import iterparse
+        except ImportError:
+            # cElementTree is deprecated since Python 3.3 and removed in 3.9
+            from xml.etree.ElementTree import iterparse
 
         parser = iterparse(self._to_stream(xml_input), events=('start', 'end'))
         self.startDocument()
@@ -290,10 +320,14 @@ class XmlPropertyListParser(object):
         ...              r'</plist>')
         {'Python': '.py'}
         """
+        try:
+            return self._parse_using_expat(xml_input)
+        except ImportError:
+            pass
         try:
             return self._parse_using_etree(xml_input)
         except ImportError:
-            # No xml.etree.ccElementTree found.
+            # No xml.etree found.
             return self._parse_using_sax_parser(xml_input)
 
 
@@ -306,5 +340,5 @@ def parse_string(io_or_string):
 def parse_file(file_path):
     """Parse the specified file and return the resulting object.
     """
-    with open(file_path) as f:
+    with open(file_path, 'rb') as f:
         return XmlPropertyListParser().parse(f)
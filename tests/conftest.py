@@ -0,0 +1,20 @@
+# coding: utf-8
+'''Run tests with pytest outside of Sublime Text: the package is loaded as PlainTasks
+on top of the headless stand-in of Sublime Text API from tests/headless'''
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'headless'))
+
+import sublime_plugin  # noqa: E402
+
+sublime_plugin.load_package(os.path.dirname(HERE), 'PlainTasks')
+
+
+def pytest_collect_file(file_path, parent):
+    '''test.py is named for UnitTesting, pytest does not collect it by default'''
+    if file_path.name == 'test.py' and str(file_path.parent) == HERE:
+        return pytest.Module.from_parent(parent, path=file_path)
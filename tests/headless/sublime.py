@@ -0,0 +1,1485 @@
+# coding: utf-8
+'''Headless stand-in for the parts of Sublime Text API which PlainTasks uses, so commands
+run and can be timed in plain python, see tests/conftest.py; Sublime Text never loads it.
+
+Buffers are plain strings, scopes come from syntax definitions of loaded packages
+(tmLanguage, or sublime-syntax if PyYAML is installed) tokenized line by line, callbacks
+of set_timeout are called by run_timeouts(). Functions and attributes in upper case and
+those documented as "not in API" exist only here.'''
+import atexit
+import copy
+import heapq
+import io
+import itertools
+import json
+import os
+import plistlib
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_right
+
+VERSION = '4126'
+
+LITERAL = 1
+IGNORECASE = 2
+
+ENCODED_POSITION = 1
+TRANSIENT = 4
+FORCE_GROUP = 8
+ADD_TO_SELECTION = 32
+
+MONOSPACE_FONT = 1
+KEEP_OPEN_ON_FOCUS_LOST = 2
+
+HTML = 1
+COOPERATE_WITH_AUTO_COMPLETE = 2
+HIDE_ON_MOUSE_MOVE = 4
+HIDE_ON_MOUSE_MOVE_AWAY = 8
+
+DRAW_EMPTY = 1
+HIDE_ON_MINIMAP = 2
+DRAW_EMPTY_AS_OVERWRITE = 4
+PERSISTENT = 16
+DRAW_OUTLINED = DRAW_NO_FILL = 32
+HIDDEN = 128
+DRAW_NO_OUTLINE = 256
+DRAW_SOLID_UNDERLINE = 512
+DRAW_STIPPLED_UNDERLINE = 1024
+DRAW_SQUIGGLY_UNDERLINE = 2048
+
+HOVER_TEXT = 1
+HOVER_GUTTER = 2
+HOVER_MARGIN = 3
+
+CLASS_WORD_START = 1
+CLASS_WORD_END = 2
+CLASS_LINE_START = 64
+CLASS_LINE_END = 128
+CLASS_EMPTY_LINE = 256
+
+LAYOUT_INLINE = 0
+LAYOUT_BELOW = 1
+LAYOUT_BLOCK = 2
+
+IDS = itertools.count(1)
+PLATFORM_NAMES = {'linux': 'Linux', 'osx': 'OSX', 'windows': 'Windows'}
+
+
+def version():
+    return VERSION
+
+
+def platform():
+    return {'darwin': 'osx', 'win32': 'windows'}.get(sys.platform, 'linux')
+
+
+def arch():
+    return 'x64'
+
+
+def channel():
+    return 'stable'
+
+
+# what status_message, error_message and message_dialog showed, oldest first: (kind, text)
+MESSAGES = []
+CLIPBOARD = [u'']
+
+
+def status_message(msg):
+    MESSAGES.append(('status', msg))
+
+
+def error_message(msg):
+    MESSAGES.append(('error', msg))
+
+
+def message_dialog(msg):
+    MESSAGES.append(('message', msg))
+
+
+def ok_cancel_dialog(msg, ok_title=''):
+    MESSAGES.append(('ok_cancel', msg))
+    return True
+
+
+def set_clipboard(text):
+    CLIPBOARD[0] = text
+
+
+def get_clipboard(size_limit=16777216):
+    return CLIPBOARD[0]
+
+
+# heap of (due time, order, callback)
+TIMEOUTS = []
+TIMEOUTS_LOCK = threading.Lock()
+TIMEOUTS_ORDER = itertools.count()
+
+
+def set_timeout(callback, delay=0):
+    with TIMEOUTS_LOCK:
+        heapq.heappush(TIMEOUTS, (time.time() + delay / 1000.0, next(TIMEOUTS_ORDER), callback))
+
+
+set_timeout_async = set_timeout
+
+
+def run_timeouts(wait=0):
+    '''not in API: call callbacks which are due, the way main thread does between events;
+    with wait (seconds) keep doing that while worker threads run, delayed callbacks are left
+    for later calls'''
+    deadline = time.time() + wait
+    while True:
+        with TIMEOUTS_LOCK:
+            due = TIMEOUTS and TIMEOUTS[0][0] <= time.time()
+            callback = heapq.heappop(TIMEOUTS)[2] if due else None
+        if callback:
+            callback()
+            continue
+        workers = [t for t in threading.enumerate() if t is not threading.current_thread() and not t.daemon]
+        if not workers or time.time() >= deadline:
+            return
+        time.sleep(.001)
+
+
+# {package name: directory}
+PACKAGES = {}
+DATA_PATH = []
+
+
+def add_package(name, path):
+    '''not in API: make package at path available as Packages/name'''
+    PACKAGES[name] = os.path.abspath(path)
+    link = os.path.join(packages_path(), name)
+    if not os.path.exists(link):
+        try:
+            os.symlink(PACKAGES[name], link, target_is_directory=True)
+        except (OSError, NotImplementedError):
+            pass  # resources are still found through PACKAGES
+
+
+def data_path():
+    '''not in API: temporary data directory holding Packages, Installed Packages and Cache,
+    removed at exit, so neither files nor caches are shared between runs'''
+    if not DATA_PATH:
+        DATA_PATH.append(tempfile.mkdtemp(prefix='sublime-data-'))
+        atexit.register(shutil.rmtree, DATA_PATH[0], True)
+    return DATA_PATH[0]
+
+
+def _data_directory(name):
+    path = os.path.join(data_path(), name)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
+def packages_path():
+    return _data_directory('Packages')
+
+
+def installed_packages_path():
+    return _data_directory('Installed Packages')
+
+
+def cache_path():
+    return _data_directory('Cache')
+
+
+def resource_file(name):
+    '''not in API: file of resource Packages/package/path'''
+    _, package, path = name.split('/', 2)
+    if package not in PACKAGES:
+        raise IOError('resource not found: ' + name)
+    return os.path.join(PACKAGES[package], *path.split('/'))
+
+
+def load_resource(name):
+    with io.open(resource_file(name), encoding='utf-8') as f:
+        return f.read()
+
+
+def find_resources(pattern):
+    import fnmatch
+    found = []
+    for package, root in sorted(PACKAGES.items()):
+        for folder, dirs, files in os.walk(root):
+            for fn in sorted(files):
+                if fnmatch.fnmatch(fn, pattern):
+                    found.append('/'.join(['Packages', package, os.path.relpath(os.path.join(folder, fn), root).replace(os.sep, '/')]))
+    return found
+
+
+JSON_JUNK = re.compile(r'("(?:\\.|[^"\\])*")|//[^\n]*|/\*.*?\*/|,(?=\s*[}\]])', re.S)
+
+
+def decode_value(text):
+    '''json with comments and trailing commas, as in sublime-settings'''
+    return json.loads(JSON_JUNK.sub(lambda m: m.group(1) or '', text))
+
+
+def encode_value(value, pretty=False):
+    return json.dumps(value, indent=4 if pretty else None, ensure_ascii=False)
+
+
+class Settings(object):
+    '''values fall back to parents, the way view settings fall back to settings files'''
+    def __init__(self, values=None, parents=()):
+        self.values = dict(values or {})
+        self.parents = list(parents)
+        self.callbacks = {}
+
+    def get(self, key, default=None):
+        if key in self.values:
+            return copy.deepcopy(self.values[key])
+        for parent in self.parents:
+            if parent.has(key):
+                return parent.get(key)
+        return default
+
+    def has(self, key):
+        return key in self.values or any(parent.has(key) for parent in self.parents)
+
+    def set(self, key, value):
+        self.values[key] = copy.deepcopy(value)
+        self.changed()
+
+    def erase(self, key):
+        self.values.pop(key, None)
+        self.changed()
+
+    def to_dict(self):
+        values = {}
+        for parent in reversed(self.parents):
+            values.update(parent.to_dict())
+        values.update(copy.deepcopy(self.values))
+        return values
+
+    def add_on_change(self, tag, callback):
+        self.callbacks.setdefault(tag, []).append(callback)
+
+    def clear_on_change(self, tag):
+        self.callbacks.pop(tag, None)
+
+    def changed(self):
+        for callbacks in list(self.callbacks.values()):
+            for callback in list(callbacks):
+                callback()
+
+
+# {file name: Settings}
+SETTINGS = {}
+
+
+def load_settings(base_name):
+    '''merged files of that name of all packages, platform specific ones last'''
+    if base_name not in SETTINGS:
+        stem, ext = os.path.splitext(base_name)
+        values = {}
+        for name in (base_name, u'{0} ({1}){2}'.format(stem, PLATFORM_NAMES[platform()], ext)):
+            for package, root in sorted(PACKAGES.items()):
+                path = os.path.join(root, name)
+                if os.path.isfile(path):
+                    with io.open(path, encoding='utf-8') as f:
+                        values.update(decode_value(f.read()))
+        SETTINGS[base_name] = Settings(values)
+    return SETTINGS[base_name]
+
+
+def save_settings(base_name):
+    pass
+
+
+class Region(object):
+    __slots__ = ('a', 'b', 'xpos')
+
+    def __init__(self, a, b=None, xpos=-1):
+        if b is None:
+            b = a
+        self.a = a
+        self.b = b
+        self.xpos = xpos
+
+    def __str__(self):
+        return '(%d, %d)' % (self.a, self.b)
+
+    __repr__ = __str__
+
+    def __len__(self):
+        return self.size()
+
+    def __eq__(self, rhs):
+        return isinstance(rhs, Region) and self.a == rhs.a and self.b == rhs.b
+
+    def __ne__(self, rhs):
+        return not self == rhs
+
+    def __lt__(self, rhs):
+        lhb, rhb = self.begin(), rhs.begin()
+        return lhb < rhb or (lhb == rhb and self.end() < rhs.end())
+
+    def __gt__(self, rhs):
+        return rhs < self
+
+    def __contains__(self, v):
+        return self.contains(v)
+
+    def to_tuple(self):
+        return (self.a, self.b)
+
+    def empty(self):
+        return self.a == self.b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def size(self):
+        return abs(self.a - self.b)
+
+    def contains(self, x):
+        if isinstance(x, Region):
+            return self.contains(x.a) and self.contains(x.b)
+        return self.begin() <= x <= self.end()
+
+    def cover(self, rhs):
+        a, b = min(self.begin(), rhs.begin()), max(self.end(), rhs.end())
+        return Region(a, b) if self.a <= self.b else Region(b, a)
+
+    def intersection(self, rhs):
+        if self.end() <= rhs.begin() or rhs.end() <= self.begin():
+            return Region(0)
+        return Region(max(self.begin(), rhs.begin()), min(self.end(), rhs.end()))
+
+    def intersects(self, rhs):
+        lb, le, rb, re_ = self.begin(), self.end(), rhs.begin(), rhs.end()
+        return ((lb == rb and le == re_) or (lb < rb < le) or (lb < re_ < le) or
+                (rb < lb < re_) or (rb < le < re_))
+
+
+def shifted(point, a, b, size):
+    '''point after text between a and b was replaced by size characters;
+    insertion right at point moves it, as typing at caret does'''
+    if point < a or (point == a and a != b):
+        return point
+    if point >= b:
+        return point + size - (b - a)
+    return a
+
+
+class Selection(object):
+    def __init__(self, view_id=0):
+        self.view_id = view_id
+        self.regions = [Region(0)]
+
+    def __len__(self):
+        return len(self.regions)
+
+    def __getitem__(self, index):
+        region = self.regions[index]
+        return Region(region.a, region.b, region.xpos)
+
+    def __iter__(self):
+        return iter([self[i] for i in range(len(self.regions))])
+
+    def __eq__(self, rhs):
+        return isinstance(rhs, Selection) and [r.to_tuple() for r in self] == [r.to_tuple() for r in rhs]
+
+    def __str__(self):
+        return str(self.regions)
+
+    def is_valid(self):
+        return True
+
+    def clear(self):
+        self.regions = []
+
+    def add(self, region):
+        if not isinstance(region, Region):
+            region = Region(region)
+        self.regions.append(Region(region.a, region.b, region.xpos))
+        self.merge()
+
+    def add_all(self, regions):
+        for region in regions:
+            self.add(region)
+
+    def subtract(self, region):
+        kept = []
+        for r in self.regions:
+            if not r.intersects(region) and not (r.empty() and region.contains(r.a)):
+                kept.append(r)
+                continue
+            if r.begin() < region.begin():
+                kept.append(Region(r.begin(), region.begin()))
+            if r.end() > region.end():
+                kept.append(Region(region.end(), r.end()))
+        self.regions = kept
+        self.merge()
+
+    def contains(self, region):
+        return any(r.contains(region) for r in self.regions)
+
+    def merge(self):
+        '''overlapping regions become one, as do cursors at the same point'''
+        merged = []
+        for r in sorted(self.regions):
+            last = merged[-1] if merged else None
+            if last and (r.begin() < last.end() or r.to_tuple() == last.to_tuple() or
+                         (r.begin() == last.end() and (r.empty() or last.empty()) and not (r.empty() and last.empty()))):
+                merged[-1] = last.cover(r)
+            else:
+                merged.append(r)
+        self.regions = merged
+
+    def shift(self, a, b, size):
+        for r in self.regions:
+            r.a, r.b = shifted(r.a, a, b, size), shifted(r.b, a, b, size)
+        self.merge()
+
+
+class Edit(object):
+    '''valid only while run method of TextCommand is running'''
+    def __init__(self, view):
+        self.view = view
+        self.valid = True
+
+
+class HistoricPosition(object):
+    __slots__ = ('pt', 'row', 'col', 'col_utf16', 'col_utf8')
+
+    def __init__(self, pt, row, col, col_utf16, col_utf8):
+        self.pt = pt
+        self.row = row
+        self.col = col
+        self.col_utf16 = col_utf16
+        self.col_utf8 = col_utf8
+
+
+class TextChange(object):
+    __slots__ = ('a', 'b', 'len_utf16', 'len_utf8', 'str')
+
+    def __init__(self, a, b, string):
+        self.a = a
+        self.b = b
+        self.str = string
+        self.len_utf16 = len(string.encode('utf-16-le')) // 2
+        self.len_utf8 = len(string.encode('utf-8'))
+
+
+class Buffer(object):
+    def __init__(self):
+        self.buffer_id = next(IDS)
+        self.text = u''
+        self.version = 0
+        self.saved_version = 0
+        self.path = None
+        self.view_list = []
+        self.changes = []  # TextChange since listeners were notified
+        self.listeners = None  # attached TextChangeListeners, see sublime_plugin
+        self.scopes = Scopes(None)
+        self.anchor = (0, 0)  # point and its row, rows of other points are counted from it
+
+    def id(self):
+        return self.buffer_id
+
+    def file_name(self):
+        return self.path
+
+    def views(self):
+        return list(self.view_list)
+
+    def primary_view(self):
+        return self.view_list[0] if self.view_list else None
+
+    def position(self, point):
+        '''HistoricPosition of point, its row is counted from the last one'''
+        text = self.text
+        anchor, row = self.anchor
+        if anchor <= point:
+            row += text.count(u'\n', anchor, point)
+        else:
+            row -= text.count(u'\n', point, anchor)
+        self.anchor = (point, row)
+        start = text.rfind(u'\n', 0, point) + 1
+        part = text[start:point]
+        return HistoricPosition(point, row, point - start, len(part.encode('utf-16-le')) // 2, len(part.encode('utf-8')))
+
+    def replace(self, a, b, string):
+        begin, end = self.position(a), self.position(b)
+        self.changes.append(TextChange(begin, end, string))
+        self.anchor = (a, begin.row)  # text before a is not changed
+        self.text = self.text[:a] + string + self.text[b:]
+        self.version += 1
+        self.scopes.invalidate(a)
+        for view in self.view_list:
+            view.shift(a, b, len(string))
+
+
+# (pattern, flags): compiled
+REGEXES = {}
+LOOKBEHIND_ALTERNATIVES = re.compile(r'\(\?<([=!])([^()]*\|[^()]*)\)')
+
+
+def python_regex(pattern, flags=0):
+    '''compile Oniguruma pattern, as much of its syntax as syntax definitions and find use;
+    lookbehinds with alternatives of different width are split, ^ and $ are per line'''
+    key = (pattern, flags)
+    if key not in REGEXES:
+        source = LOOKBEHIND_ALTERNATIVES.sub(
+            lambda m: ('(?:%s)' % '|'.join('(?<=%s)' % a for a in m.group(2).split('|')) if m.group(1) == '=' else
+                       ''.join('(?<!%s)' % a for a in m.group(2).split('|'))),
+            pattern)
+        source = source.replace(r'\h', '[0-9a-fA-F]').replace(r'\z', r'\Z')
+        REGEXES[key] = re.compile(source, re.M | re.U | flags)
+    return REGEXES[key]
+
+
+class Rule(object):
+    '''match rule of syntax (end is None) or begin/end one with nested patterns'''
+    def __init__(self, match, scope=None, captures=None, end=None, end_captures=None, meta=None, patterns=None):
+        self.rx = python_regex(match)
+        self.scope = scope
+        self.captures = captures or {}
+        self.end = end
+        self.end_captures = end_captures or {}
+        self.meta = meta
+        self.patterns = patterns  # list of Rule, or callable returning it for recursive includes
+
+    def nested(self):
+        if callable(self.patterns):
+            self.patterns = flatten(self.patterns())
+        return self.patterns or []
+
+    def end_rx(self, begin):
+        '''end pattern with back references to begin match replaced'''
+        return python_regex(re.sub(r'\\(\d)', lambda m: re.escape(begin.group(int(m.group(1))) or ''), self.end))
+
+
+def scope_names(captures):
+    return dict((int(k), v['name'] if isinstance(v, dict) else v) for k, v in (captures or {}).items()
+                if (v.get('name') if isinstance(v, dict) else v))
+
+
+class Syntax(object):
+    '''base scope, file extensions and rules of syntax definition'''
+    def __init__(self, path, scope, extensions, rules):
+        self.path = path
+        self.scope = scope
+        self.extensions = extensions
+        self.rules = rules
+
+    @classmethod
+    def tm_language(cls, path, data):
+        repository = data.get('repository', {})
+        resolved = {}
+
+        def rules(patterns):
+            found = []
+            for p in patterns:
+                if 'include' in p:
+                    name = p['include']
+                    if name == '$self':
+                        found.append(lambda: root)
+                        continue
+                    name = name.lstrip('#')
+                    if name not in resolved:
+                        resolved[name] = None
+                        resolved[name] = rules(repository[name].get('patterns', [repository[name]]))
+                    found.append(lambda name=name: resolved[name])
+                elif 'match' in p:
+                    found.append(Rule(p['match'], p.get('name'), scope_names(p.get('captures'))))
+                elif 'begin' in p:
+                    found.append(Rule(p['begin'], None, scope_names(p.get('beginCaptures', p.get('captures'))),
+                                      p['end'], scope_names(p.get('endCaptures', p.get('captures'))), p.get('name'),
+                                      lambda p=p: rules(p.get('patterns', []))))
+                elif 'patterns' in p:
+                    found.extend(rules(p['patterns']))
+            return found
+
+        root = rules(data.get('patterns', []))
+        return cls(path, data.get('scopeName'), data.get('fileTypes', []), flatten(root))
+
+    @classmethod
+    def sublime_syntax(cls, path, data):
+        '''contexts pushed by match and popped by a single match of theirs are supported,
+        as are includes; set, embed and branches are not'''
+        contexts = data['contexts']
+        resolved = {}
+
+        def context(name):
+            if name not in resolved:
+                resolved[name] = None
+                resolved[name] = rules(contexts[name])
+            return resolved[name]
+
+        def pushed(target):
+            '''meta scope, the only pop match and the other entries of pushed context'''
+            if isinstance(target, list) and target and not isinstance(target[0], dict):
+                raise NotImplementedError('pushing several contexts in ' + path)
+            entries = target if isinstance(target, list) else contexts[target]
+            meta = u' '.join(e['meta_scope'] for e in entries if 'meta_scope' in e)
+            entries = [e for e in entries if not any(k.startswith(('meta_', 'clear_')) for k in e)]
+            pops = [e for e in entries if e.get('pop')]
+            if len(pops) != 1:
+                raise NotImplementedError('context without single pop in ' + path)
+            return meta, pops[0], [e for e in entries if not e.get('pop')]
+
+        def rules(entries):
+            found = []
+            for e in entries:
+                if 'include' in e:
+                    name = e['include']
+                    found.append(lambda name=name: context(name))
+                elif 'match' in e and 'push' in e:
+                    meta, pop, rest = pushed(e['push'])
+                    captures = scope_names(e.get('captures'))
+                    if e.get('scope'):
+                        captures[0] = e['scope']
+                    end_captures = scope_names(pop.get('captures'))
+                    if pop.get('scope'):
+                        end_captures[0] = pop['scope']
+                    found.append(Rule(e['match'], None, captures, pop['match'], end_captures, meta or None,
+                                      lambda rest=rest: rules(rest)))
+                elif 'match' in e:
+                    if any(k in e for k in ('set', 'embed', 'branch', 'pop')):
+                        raise NotImplementedError('set, embed, branch and pop at main level in ' + path)
+                    found.append(Rule(e['match'], e.get('scope'), scope_names(e.get('captures'))))
+            return found
+
+        return cls(path, data.get('scope'), data.get('file_extensions', []), flatten(context('main')))
+
+
+def flatten(rules):
+    '''includes resolved, they are callables returning list of rules'''
+    found = []
+    for rule in rules:
+        if callable(rule):
+            found.extend(flatten(rule() or []))
+        else:
+            found.append(rule)
+    return found
+
+
+# {resource name: Syntax}
+SYNTAXES = {}
+
+
+def load_syntax(name):
+    '''Syntax of resource; sublime-syntax falls back to tmLanguage of the same name
+    if PyYAML is not installed'''
+    if name not in SYNTAXES:
+        if name.endswith('.sublime-syntax'):
+            try:
+                import yaml
+            except ImportError:
+                SYNTAXES[name] = load_syntax(name[:-len('.sublime-syntax')] + '.tmLanguage')
+                return SYNTAXES[name]
+            SYNTAXES[name] = Syntax.sublime_syntax(name, yaml.safe_load(load_resource(name)))
+        else:
+            with open(resource_file(name), 'rb') as f:
+                SYNTAXES[name] = Syntax.tm_language(name, plistlib.load(f))
+    return SYNTAXES[name]
+
+
+def syntax_for(file_name):
+    '''name of syntax whose extensions match file name, sublime-syntax preferred'''
+    base = os.path.basename(file_name)
+    for pattern in ('*.sublime-syntax', '*.tmLanguage'):
+        for name in find_resources(pattern):
+            try:
+                syntax = load_syntax(name)
+            except Exception:
+                continue
+            if any(base == e or base.endswith('.' + e) for e in syntax.extensions):
+                return name
+    return 'Packages/Text/Plain text.tmLanguage'
+
+
+class Frame(object):
+    '''begin/end rule in progress'''
+    __slots__ = ('rule', 'end', 'scopes')
+
+    def __init__(self, rule, end, scopes):
+        self.rule = rule
+        self.end = end
+        self.scopes = scopes
+
+
+class Scopes(object):
+    '''Scopes of buffer lines, tokenized up to requested point and dropped from edited line on;
+    each line is [start, end, run ends, run scopes, frames left open]'''
+    def __init__(self, syntax):
+        self.syntax = syntax
+        self.lines = []
+
+    def invalidate(self, point):
+        while self.lines and self.lines[-1][1] >= point:
+            self.lines.pop()
+
+    def line_at(self, text, point):
+        '''tokenized line containing point'''
+        lines = self.lines
+        while not lines or (lines[-1][1] <= point and lines[-1][1] < len(text)):
+            start = lines[-1][1] if lines else 0
+            end = text.find(u'\n', start) + 1 or len(text)
+            stack = lines[-1][4] if lines else ()
+            ends, scopes, stack = self.tokenize(text[start:end], stack)
+            lines.append([start, end, [start + e for e in ends], scopes, stack])
+            if end == len(text):
+                break
+        index = bisect_right(LineStarts(lines), point) - 1
+        return lines[max(index, 0)]
+
+    def scope_name(self, text, point):
+        base = self.syntax.scope if self.syntax else 'text.plain'
+        if not self.syntax or not text:
+            return base + ' '
+        point = max(0, min(point, len(text)))
+        line = self.line_at(text, point)
+        index = bisect_right(line[2], point)
+        if index >= len(line[3]):
+            return base + ' '
+        return u' '.join((base,) + line[3][index]) + ' '
+
+    def tokenize(self, line, stack):
+        '''Return ends and scopes of runs of line, and frames left open'''
+        size = len(line)
+        paint = [()] * size
+        stack = list(stack)
+        pos = 0
+        seen = set()
+        while pos < size:
+            frame = stack[-1] if stack else None
+            current = frame.scopes if frame else ()
+            best, kind, rule = None, None, None
+            if frame:
+                best, kind = frame.end.search(line, pos), 'end'
+            for r in (frame.rule.nested() if frame else self.syntax.rules):
+                m = r.rx.search(line, pos)
+                if m and (best is None or m.start() < best.start()):
+                    best, kind, rule = m, ('match' if r.end is None else 'begin'), r
+            if best is None:
+                paint[pos:] = [current] * (size - pos)
+                break
+            paint[pos:best.start()] = [current] * (best.start() - pos)
+            state = (best.start(), best.end(), kind, rule)
+            if best.end() == pos and state in seen:
+                paint[pos] = current
+                pos += 1  # nothing would change, as in Sublime Text
+                continue
+            seen.add(state)
+            if kind == 'end':
+                self.paint(paint, best, current, frame.rule.end_captures)
+                stack.pop()
+            elif kind == 'match':
+                self.paint(paint, best, current + ((rule.scope,) if rule.scope else ()), rule.captures)
+            else:
+                scopes = current + tuple(rule.meta.split()) if rule.meta else current
+                self.paint(paint, best, scopes, rule.captures)
+                stack.append(Frame(rule, rule.end_rx(best), scopes))
+            pos = best.end()
+        ends, scopes = [], []
+        for index, scope in enumerate(paint):
+            if scopes and scopes[-1] == scope:
+                ends[-1] = index + 1
+            else:
+                ends.append(index + 1)
+                scopes.append(scope)
+        return ends, scopes, tuple(stack)
+
+    @staticmethod
+    def paint(paint, match, scopes, captures):
+        a, b = match.span()
+        if 0 in captures:
+            scopes = scopes + (captures[0],)
+        paint[a:b] = [scopes] * (b - a)
+        for group, scope in sorted(captures.items()):
+            if group and group <= match.re.groups and match.start(group) >= 0:
+                ga, gb = match.span(group)
+                paint[ga:gb] = [s + (scope,) for s in paint[ga:gb]]
+
+
+class LineStarts(object):
+    '''starts of tokenized lines for bisect without copying them'''
+    def __init__(self, lines):
+        self.lines = lines
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, index):
+        return self.lines[index][0]
+
+
+def selector_score(selector, scopes):
+    '''score of scopes (list of names) against selector with alternatives (,),
+    descendants (space) and exclusions (-)'''
+    best = 0
+    for alternative in re.split(r'[,|]', selector):
+        parts = [p.split() for p in alternative.split(' - ')]
+        if not parts[0]:
+            continue
+        score = path_score(parts[0], scopes)
+        if score and not any(path_score(p, scopes) for p in parts[1:] if p):
+            best = max(best, score)
+    return best
+
+
+def path_score(atoms, scopes):
+    index, score = 0, 0
+    for atom in atoms:
+        while index < len(scopes) and not (scopes[index] == atom or scopes[index].startswith(atom + '.')):
+            index += 1
+        if index == len(scopes):
+            return 0
+        score += 8 ** index * (atom.count('.') + 1)
+        index += 1
+    return score
+
+
+class Phantom(object):
+    def __init__(self, region, content, layout, on_navigate=None):
+        self.region = region
+        self.content = content
+        self.layout = layout
+        self.on_navigate = on_navigate
+        self.id = None
+
+    def __eq__(self, rhs):
+        return (self.region == rhs.region and self.content == rhs.content and
+                self.layout == rhs.layout and self.on_navigate == rhs.on_navigate)
+
+
+class PhantomSet(object):
+    def __init__(self, view, key=''):
+        self.view = view
+        self.key = key
+        self.phantoms = []
+
+    def __del__(self):
+        for p in self.phantoms:
+            self.view.erase_phantom_by_id(p.id)
+
+    def update(self, new_phantoms):
+        for p in new_phantoms:
+            if p in self.phantoms:
+                p.id = self.phantoms[self.phantoms.index(p)].id
+            else:
+                p.id = self.view.add_phantom(self.key, p.region, p.content, p.layout, p.on_navigate)
+        for p in self.phantoms:
+            if p not in new_phantoms:
+                self.view.erase_phantom_by_id(p.id)
+        self.phantoms = new_phantoms
+
+
+def plugin_events():
+    import sublime_plugin
+    return sublime_plugin
+
+
+class View(object):
+    def __init__(self, window=None, buffer=None):
+        self.view_id = next(IDS)
+        self.buffer_ = buffer or Buffer()
+        self.buffer_.view_list.append(self)
+        self.window_ = window
+        self.settings_ = Settings({}, [load_settings('Preferences.sublime-settings')])
+        self.selection = Selection(self.view_id)
+        self.regions = {}  # key: (regions, scope, icon, flags)
+        self.status = {}
+        self.folds = []
+        self.phantoms = {}  # id: (key, region, content, layout, on_navigate)
+        self.popup = None  # (content, flags, location, on_navigate, on_hide)
+        self.listeners = {}  # ViewEventListener class: instance, see sublime_plugin
+        self.name_ = u''
+        self.scratch = False
+        self.read_only = False
+        self.valid = True
+        self.viewport = (0.0, 0.0)
+        self.commands = 0  # depth of commands running, events are sent after outermost one
+
+    def __eq__(self, other):
+        return isinstance(other, View) and other.view_id == self.view_id
+
+    def __hash__(self):
+        return self.view_id
+
+    def __repr__(self):
+        return 'View(%d)' % self.view_id
+
+    def id(self):
+        return self.view_id
+
+    def buffer_id(self):
+        return self.buffer_.buffer_id
+
+    def buffer(self):
+        return self.buffer_
+
+    def is_valid(self):
+        return self.valid
+
+    def is_primary(self):
+        return self.buffer_.primary_view() is self
+
+    def window(self):
+        return self.window_
+
+    def file_name(self):
+        return self.buffer_.path
+
+    def name(self):
+        return self.name_
+
+    def set_name(self, name):
+        self.name_ = name
+
+    def is_scratch(self):
+        return self.scratch
+
+    def set_scratch(self, scratch):
+        self.scratch = scratch
+
+    def is_dirty(self):
+        return not self.scratch and self.buffer_.version != self.buffer_.saved_version
+
+    def is_read_only(self):
+        return self.read_only
+
+    def set_read_only(self, read_only):
+        self.read_only = read_only
+
+    def is_loading(self):
+        return False
+
+    def encoding(self):
+        return 'UTF-8'
+
+    def line_endings(self):
+        return 'Unix'
+
+    def settings(self):
+        return self.settings_
+
+    def set_syntax_file(self, syntax_file):
+        syntax = load_syntax(syntax_file)
+        self.buffer_.scopes = Scopes(syntax)
+        stem = os.path.splitext(syntax_file.rpartition('/')[2])[0]
+        self.settings_.parents = [load_settings(stem + '.sublime-settings'), load_settings('Preferences.sublime-settings')]
+        self.settings_.set('syntax', syntax_file)
+
+    def close(self):
+        if self.window_:
+            self.window_.close_view(self)
+        return True
+
+    def run_command(self, cmd, args=None):
+        plugin_events().run_text_command(self, cmd, args)
+
+    def change_count(self):
+        return self.buffer_.version
+
+    def size(self):
+        return len(self.buffer_.text)
+
+    def substr(self, x):
+        text = self.buffer_.text
+        if isinstance(x, Region):
+            return text[max(x.begin(), 0):x.end()]
+        return text[x] if 0 <= x < len(text) else u'\x00'
+
+    def check(self, edit):
+        if not isinstance(edit, Edit) or not edit.valid or edit.view is not self:
+            raise ValueError('Edit objects may not be used after the TextCommand\'s run method has returned')
+        if self.read_only:
+            raise ValueError('view is read only')
+
+    def insert(self, edit, pt, text):
+        self.check(edit)
+        pt = max(0, min(pt, self.size()))
+        self.buffer_.replace(pt, pt, text)
+        return len(text)
+
+    def erase(self, edit, region):
+        self.check(edit)
+        if not region.empty():
+            self.buffer_.replace(region.begin(), region.end(), u'')
+
+    def replace(self, edit, region, text):
+        self.check(edit)
+        if region.empty() and not text:
+            return
+        self.buffer_.replace(region.begin(), region.end(), text)
+
+    def shift(self, a, b, size):
+        '''move everything anchored to text after text between a and b was replaced'''
+        self.selection.shift(a, b, size)
+        for key, (regions, scope, icon, flags) in self.regions.items():
+            for r in regions:
+                r.a, r.b = shifted(r.a, a, b, size), shifted(r.b, a, b, size)
+        folds = []
+        for fa, fb in self.folds:
+            fa, fb = shifted(fa, a, b, size), shifted(fb, a, b, size)
+            if fa < fb:
+                folds.append((fa, fb))
+        self.folds = folds
+        for p in self.phantoms.values():
+            p[1].a, p[1].b = shifted(p[1].a, a, b, size), shifted(p[1].b, a, b, size)
+
+    def sel(self):
+        return self.selection
+
+    def line(self, x):
+        if isinstance(x, Region):
+            return Region(self.line(x.begin()).a, self.line(x.end()).b)
+        text = self.buffer_.text
+        x = max(0, min(x, len(text)))
+        end = text.find(u'\n', x)
+        return Region(text.rfind(u'\n', 0, x) + 1, len(text) if end < 0 else end)
+
+    def full_line(self, x):
+        line = self.line(x)
+        return Region(line.a, min(line.b + 1, self.size()))
+
+    def lines(self, region):
+        found = []
+        start = self.line(region.begin()).a
+        end = region.end()
+        while True:
+            line = self.line(start)
+            found.append(line)
+            if line.b >= end or line.b >= self.size():
+                return found
+            start = line.b + 1
+
+    def split_by_newlines(self, region):
+        return [l.intersection(region) if not l.empty() else l for l in self.lines(region)]
+
+    def word(self, x):
+        point = x.begin() if isinstance(x, Region) else x
+        line = self.line(point)
+        content = self.substr(line)
+        for m in re.finditer(r'\w+', content):
+            if line.a + m.start() <= point <= line.a + m.end():
+                return Region(line.a + m.start(), line.a + m.end())
+        return Region(point)
+
+    def rowcol(self, tp):
+        text = self.buffer_.text
+        tp = max(0, min(tp, len(text)))
+        return text.count(u'\n', 0, tp), tp - text.rfind(u'\n', 0, tp) - 1
+
+    def text_point(self, row, col):
+        text, start = self.buffer_.text, 0
+        for _ in range(row):
+            end = text.find(u'\n', start)
+            if end < 0:
+                break
+            start = end + 1
+        return min(start + col, self.line(start).b)
+
+    def classify(self, pt):
+        text = self.buffer_.text
+        cls = 0
+        if pt == 0 or text[pt - 1:pt] == u'\n':
+            cls |= CLASS_LINE_START
+        if pt == len(text) or text[pt:pt + 1] == u'\n':
+            cls |= CLASS_LINE_END
+        if cls & CLASS_LINE_START and cls & CLASS_LINE_END:
+            cls |= CLASS_EMPTY_LINE
+        before, after = text[pt - 1:pt] if pt else u'', text[pt:pt + 1]
+        word = re.compile(r'\w', re.U)
+        if word.match(after) and not word.match(before):
+            cls |= CLASS_WORD_START
+        if word.match(before) and not word.match(after):
+            cls |= CLASS_WORD_END
+        return cls
+
+    def find(self, pattern, start_pt, flags=0):
+        m = self.regex(pattern, flags).search(self.buffer_.text, max(0, start_pt))
+        return Region(m.start(), m.end()) if m else Region(-1, -1)
+
+    def find_all(self, pattern, flags=0, fmt=None, extractions=None):
+        found = []
+        for m in self.regex(pattern, flags).finditer(self.buffer_.text):
+            found.append(Region(m.start(), m.end()))
+            if fmt is not None and extractions is not None:
+                extractions.append(m.expand(re.sub(r'\$\{?(\d+)\}?', r'\\g<\1>', fmt)))
+        return found
+
+    @staticmethod
+    def regex(pattern, flags):
+        if flags & LITERAL:
+            pattern = re.escape(pattern)
+        return python_regex(pattern, re.I if flags & IGNORECASE else 0)
+
+    def scope_name(self, pt):
+        return self.buffer_.scopes.scope_name(self.buffer_.text, pt)
+
+    def syntax_scope(self):
+        return self.scope_name(0).split()[0]
+
+    def match_selector(self, pt, selector):
+        return self.score_selector(pt, selector) > 0
+
+    def score_selector(self, pt, selector):
+        return selector_score(selector, self.scope_name(pt).split())
+
+    def find_by_selector(self, selector):
+        found = []
+        scopes = self.buffer_.scopes
+        text = self.buffer_.text
+        point = 0
+        while point < len(text):
+            line = scopes.line_at(text, point)
+            start = line[0]
+            for end, names in zip(line[2], line[3]):
+                if selector_score(selector, [scopes.syntax.scope] + list(names)):
+                    if found and found[-1].b == start:
+                        found[-1] = Region(found[-1].a, end)
+                    else:
+                        found.append(Region(start, end))
+                start = end
+            point = line[1]
+        return found
+
+    def extract_scope(self, pt):
+        scope = self.scope_name(pt)
+        a, b = pt, pt
+        while a > 0 and self.scope_name(a - 1).startswith(scope):
+            a -= 1
+        while b < self.size() and self.scope_name(b).startswith(scope):
+            b += 1
+        return Region(a, b)
+
+    def indentation_level(self, pt):
+        tab_size = self.settings_.get('tab_size', 4)
+        content = self.substr(self.line(pt))
+        columns = 0
+        for c in content:
+            if c == u' ':
+                columns += 1
+            elif c == u'\t':
+                columns += tab_size - columns % tab_size
+            else:
+                break
+        return columns // tab_size
+
+    def indented_region(self, pt):
+        '''lines around pt, indented at least as its line, blank lines within included'''
+        line = self.line(pt)
+        level = self.indentation_level(pt)
+        if level == 0 or not self.substr(line).strip():
+            return Region(line.a, line.a)
+        first = last = line
+        while first.a > 0:
+            above = self.line(first.a - 1)
+            if self.substr(above).strip() and self.indentation_level(above.a) < level:
+                break
+            first = above
+        while last.b < self.size():
+            below = self.line(last.b + 1)
+            if self.substr(below).strip() and self.indentation_level(below.a) < level:
+                break
+            last = below
+        while not self.substr(first).strip():
+            first = self.line(first.b + 1)
+        while not self.substr(last).strip():
+            last = self.line(last.a - 1)
+        return Region(first.a, self.full_line(last).b)
+
+    def add_regions(self, key, regions, scope='', icon='', flags=0, *args, **kwargs):
+        self.regions[key] = (sorted(Region(r.a, r.b) for r in regions), scope, icon, flags)
+
+    def get_regions(self, key):
+        return [Region(r.a, r.b) for r in self.regions.get(key, ([],))[0]]
+
+    def erase_regions(self, key):
+        self.regions.pop(key, None)
+
+    def set_status(self, key, value):
+        self.status[key] = value
+
+    def get_status(self, key):
+        return self.status.get(key, u'')
+
+    def erase_status(self, key):
+        self.status.pop(key, None)
+
+    def fold(self, x):
+        regions = x if isinstance(x, list) else [x]
+        folds = set(self.folds)
+        new = [(r.begin(), r.end()) for r in regions if not r.empty() and (r.begin(), r.end()) not in folds]
+        self.folds = sorted(folds.union(new))
+        return bool(new)
+
+    def unfold(self, x):
+        regions = x if isinstance(x, list) else [x]
+        unfolded = [f for f in self.folds if any(Region(*f).intersects(r) or r.contains(Region(*f)) for r in regions)]
+        self.folds = [f for f in self.folds if f not in unfolded]
+        return [Region(a, b) for a, b in unfolded]
+
+    def folded_regions(self):
+        return [Region(a, b) for a, b in self.folds]
+
+    def is_folded(self, sr):
+        return any(a <= sr.begin() and sr.end() <= b for a, b in self.folds)
+
+    def line_height(self):
+        return 20.0
+
+    def em_width(self):
+        return 8.0
+
+    def viewport_position(self):
+        return self.viewport
+
+    def set_viewport_position(self, xy, animate=True):
+        self.viewport = tuple(xy)
+
+    def viewport_extent(self):
+        return (800.0, 600.0)
+
+    def layout_extent(self):
+        return (800.0, (self.rowcol(self.size())[0] + 1) * self.line_height())
+
+    def text_to_layout(self, tp):
+        row, col = self.rowcol(tp)
+        return (col * self.em_width(), row * self.line_height())
+
+    def layout_to_text(self, vector):
+        return self.text_point(int(vector[1] // self.line_height()), int(vector[0] // self.em_width()))
+
+    def visible_region(self):
+        return Region(self.layout_to_text(self.viewport), self.layout_to_text((self.viewport[0], self.viewport[1] + 600)))
+
+    def show(self, x, show_surrounds=True, *args, **kwargs):
+        pass
+
+    def show_at_center(self, x, *args, **kwargs):
+        point = x.begin() if isinstance(x, Region) else x
+        self.viewport = (0.0, max(0.0, self.text_to_layout(point)[1] - 300))
+
+    def show_popup(self, content, flags=0, location=-1, max_width=320, max_height=240, on_navigate=None, on_hide=None):
+        self.popup = (content, flags, location, on_navigate, on_hide)
+
+    def update_popup(self, content):
+        if self.popup:
+            self.popup = (content,) + self.popup[1:]
+
+    def is_popup_visible(self):
+        return self.popup is not None
+
+    def hide_popup(self):
+        popup, self.popup = self.popup, None
+        if popup and popup[4]:
+            popup[4]()
+
+    def add_phantom(self, key, region, content, layout, on_navigate=None):
+        pid = next(IDS)
+        self.phantoms[pid] = (key, Region(region.a, region.b), content, layout, on_navigate)
+        return pid
+
+    def erase_phantoms(self, key):
+        for pid in [i for i, p in self.phantoms.items() if p[0] == key]:
+            del self.phantoms[pid]
+
+    def erase_phantom_by_id(self, pid):
+        self.phantoms.pop(pid, None)
+
+    def query_phantom(self, pid):
+        return [Region(self.phantoms[pid][1].a, self.phantoms[pid][1].b)] if pid in self.phantoms else []
+
+    def query_phantoms(self, pids):
+        return [self.query_phantom(pid)[0] if pid in self.phantoms else Region(-1) for pid in pids]
+
+    def command_history(self, index, modifying_only=False):
+        return (None, None, 0)
+
+
+class Window(object):
+    def __init__(self):
+        self.window_id = next(IDS)
+        self.view_list = []
+        self.active = None
+        self.project = None
+        self.settings_ = Settings()
+        self.panels = {}  # name: View of output panel
+        self.quick_panel = None  # (items, on_select, flags, selected_index, on_highlight) of shown one
+        self.input_panel = None  # (caption, view, on_done, on_change, on_cancel) of shown one
+        WINDOWS.append(self)
+        ACTIVE_WINDOW[:] = [self]
+
+    def __eq__(self, other):
+        return isinstance(other, Window) and other.window_id == self.window_id
+
+    def __hash__(self):
+        return self.window_id
+
+    def id(self):
+        return self.window_id
+
+    def is_valid(self):
+        return self in WINDOWS
+
+    def settings(self):
+        return self.settings_
+
+    def views(self):
+        return list(self.view_list)
+
+    def views_in_group(self, group):
+        return self.views() if group == 0 else []
+
+    def num_groups(self):
+        return 1
+
+    def active_group(self):
+        return 0
+
+    def active_view(self):
+        return self.active
+
+    def active_view_in_group(self, group):
+        return self.active if group == 0 else None
+
+    def get_view_index(self, view):
+        return (0, self.view_list.index(view)) if view in self.view_list else (-1, -1)
+
+    def focus_view(self, view):
+        if view is self.active or view not in self.view_list:
+            return
+        previous, self.active = self.active, view
+        events = plugin_events()
+        if previous is not None:
+            events.dispatch('on_deactivated', previous)
+        events.dispatch('on_activated', view)
+
+    def new_file(self, flags=0, syntax=''):
+        view = View(self)
+        self.view_list.append(view)
+        if syntax:
+            view.set_syntax_file(syntax)
+        plugin_events().dispatch('on_new', view)
+        self.focus_view(view)
+        return view
+
+    def find_open_file(self, fname):
+        path = os.path.abspath(fname)
+        for view in self.view_list:
+            if view.file_name() and os.path.abspath(view.file_name()) == path:
+                return view
+        return None
+
+    def open_file(self, fname, flags=0, group=-1):
+        row = col = None
+        if flags & ENCODED_POSITION:
+            m = re.match(r'^(.*?)(?::(\d+))?(?::(\d+))?$', fname)
+            fname, row, col = m.group(1), m.group(2), m.group(3)
+        view = self.find_open_file(fname)
+        if view is None:
+            view = View(self)
+            view.buffer_.path = os.path.abspath(fname)
+            if os.path.isfile(fname):
+                with io.open(fname, encoding='utf-8', newline='') as f:
+                    view.buffer_.text = f.read().replace(u'\r\n', u'\n')
+            self.view_list.append(view)
+            view.set_syntax_file(syntax_for(fname))
+            plugin_events().dispatch('on_load', view)
+        if row:
+            point = view.text_point(int(row) - 1, int(col or 1) - 1)
+            view.sel().clear()
+            view.sel().add(Region(point))
+        self.focus_view(view)
+        return view
+
+    def close_view(self, view):
+        events = plugin_events()
+        events.dispatch('on_pre_close', view)
+        self.view_list.remove(view)
+        view.buffer_.view_list.remove(view)
+        view.valid = False
+        if self.active is view:
+            self.active = None
+            if self.view_list:
+                self.focus_view(self.view_list[-1])
+        events.dispatch('on_close', view)
+
+    def run_command(self, cmd, args=None):
+        plugin_events().run_window_command(self, cmd, args)
+
+    def folders(self):
+        return [f['path'] for f in (self.project or {}).get('folders', [])]
+
+    def project_data(self):
+        return copy.deepcopy(self.project)
+
+    def set_project_data(self, data):
+        self.project = copy.deepcopy(data)
+
+    def project_file_name(self):
+        return None
+
+    def extract_variables(self):
+        view = self.active
+        path = view.file_name() if view else None
+        variables = {'platform': PLATFORM_NAMES[platform()], 'packages': packages_path()}
+        if self.folders():
+            variables['folder'] = self.folders()[0]
+        if path:
+            variables.update(file=path, file_path=os.path.dirname(path), file_name=os.path.basename(path),
+                             file_base_name=os.path.splitext(os.path.basename(path))[0],
+                             file_extension=os.path.splitext(path)[1].lstrip('.'))
+        return variables
+
+    def status_message(self, msg):
+        status_message(msg)
+
+    def show_quick_panel(self, items, on_select, flags=0, selected_index=-1, on_highlight=None, placeholder=None):
+        self.quick_panel = (items, on_select, flags, selected_index, on_highlight)
+        if items and on_highlight:
+            on_highlight(max(selected_index, 0))
+
+    def show_input_panel(self, caption, initial_text, on_done, on_change, on_cancel):
+        view = View(self)
+        view.buffer_.text = initial_text
+        self.input_panel = (caption, view, on_done, on_change, on_cancel)
+        return view
+
+    def create_output_panel(self, name, unlisted=False):
+        if name not in self.panels:
+            self.panels[name] = View(self)
+        return self.panels[name]
+
+    def find_output_panel(self, name):
+        return self.panels.get(name)
+
+    def destroy_output_panel(self, name):
+        self.panels.pop(name, None)
+
+    def active_panel(self):
+        return None
+
+
+WINDOWS = []
+ACTIVE_WINDOW = []
+
+
+def windows():
+    return list(WINDOWS)
+
+
+def active_window():
+    return ACTIVE_WINDOW[0] if ACTIVE_WINDOW else Window()
+
+
+def run_command(cmd, args=None):
+    plugin_events().run_application_command(cmd, args)
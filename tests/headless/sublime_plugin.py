@@ -0,0 +1,294 @@
+# coding: utf-8
+'''Headless stand-in for sublime_plugin: base classes of plugins, commands looked up by
+name and events sent to listeners; load_package imports package the way Sublime Text does.'''
+import importlib
+import os
+import sys
+import types
+
+import sublime
+
+application_command_classes = []
+window_command_classes = []
+text_command_classes = []
+view_event_listener_classes = []
+text_change_listener_classes = []
+# EventListener instances
+all_listeners = []
+# {package name: [modules]}
+packages = {}
+
+
+class Command(object):
+    def name(self):
+        '''PlainTasksNewCommand is plain_tasks_new, as in Sublime Text'''
+        return command_name(self.__class__)
+
+    def is_enabled(self):
+        return True
+
+    def is_visible(self):
+        return True
+
+    def is_checked(self):
+        return False
+
+    def description(self):
+        return ''
+
+    def is_enabled_(self, args):
+        try:
+            return self.is_enabled(**args) if args else self.is_enabled()
+        except TypeError:
+            return self.is_enabled()
+
+
+class ApplicationCommand(Command):
+    pass
+
+
+class WindowCommand(Command):
+    def __init__(self, window):
+        self.window = window
+
+
+class TextCommand(Command):
+    def __init__(self, view):
+        self.view = view
+
+
+class EventListener(object):
+    pass
+
+
+class ViewEventListener(object):
+    @classmethod
+    def is_applicable(cls, settings):
+        return True
+
+    @classmethod
+    def applies_to_primary_view_only(cls):
+        return True
+
+    def __init__(self, view):
+        self.view = view
+
+
+class TextChangeListener(object):
+    @classmethod
+    def is_applicable(cls, buffer):
+        return False
+
+    def __init__(self):
+        self.buffer = None
+
+    def attach(self, buffer):
+        if buffer.listeners is None:
+            buffer.listeners = []
+        buffer.listeners.append(self)
+        self.buffer = buffer
+
+    def detach(self):
+        if self.buffer is not None:
+            self.buffer.listeners.remove(self)
+            self.buffer = None
+
+    def is_attached(self):
+        return self.buffer is not None
+
+
+def command_name(cls):
+    clsname = cls.__name__
+    name = clsname[0].lower()
+    last_upper = False
+    for c in clsname[1:]:
+        if c.isupper() and not last_upper:
+            name += '_' + c.lower()
+        else:
+            name += c
+        last_upper = c.isupper()
+    return name[:-8] if name.endswith('_command') else name
+
+
+def find_command(classes, name):
+    for cls in reversed(classes):
+        if command_name(cls) == name:
+            return cls
+    return None
+
+
+def run_command(command, args, *before):
+    if not command.is_enabled_(args):
+        return
+    if args:
+        command.run(*before, **args)
+    else:
+        command.run(*before)
+
+
+def run_text_command(view, name, args=None):
+    '''send events after outermost command, once per command as Sublime Text does'''
+    cls = find_command(text_command_classes, name)
+    builtin = BUILTIN_TEXT_COMMANDS.get(name)
+    if cls is None and builtin is None:
+        return
+    version, selection = view.change_count(), [r.to_tuple() for r in view.sel()]
+    view.commands += 1
+    edit = sublime.Edit(view)
+    try:
+        if cls is not None:
+            run_command(cls(view), args, edit)
+        else:
+            builtin(view, edit, **(args or {}))
+    finally:
+        edit.valid = False
+        view.commands -= 1
+    if view.commands:
+        return
+    if view.change_count() != version:
+        text_changed(view.buffer())
+        for v in view.buffer().views():
+            dispatch('on_modified', v)
+    if [r.to_tuple() for r in view.sel()] != selection:
+        dispatch('on_selection_modified', view)
+
+
+def run_window_command(window, name, args=None):
+    cls = find_command(window_command_classes, name)
+    if cls is not None:
+        run_command(cls(window), args)
+    elif name in BUILTIN_WINDOW_COMMANDS:
+        BUILTIN_WINDOW_COMMANDS[name](window, **(args or {}))
+    elif window.active_view():
+        run_text_command(window.active_view(), name, args)
+
+
+def run_application_command(name, args=None):
+    cls = find_command(application_command_classes, name)
+    if cls is not None:
+        run_command(cls(), args)
+    else:
+        run_window_command(sublime.active_window(), name, args)
+
+
+def append(view, edit, characters='', force=False, scroll_to_end=False):
+    view.insert(edit, view.size(), characters)
+
+
+def insert(view, edit, characters=''):
+    for region in reversed(list(view.sel())):
+        view.replace(edit, region, characters)
+
+
+def select_all(view, edit):
+    view.sel().clear()
+    view.sel().add(sublime.Region(0, view.size()))
+
+
+BUILTIN_TEXT_COMMANDS = {'append': append, 'insert': insert, 'select_all': select_all}
+
+
+def close_file(window):
+    if window.active_view():
+        window.active_view().close()
+
+
+def hide_overlay(window):
+    window.quick_panel = None
+
+
+BUILTIN_WINDOW_COMMANDS = {'close_file': close_file, 'hide_overlay': hide_overlay}
+
+
+def view_listeners(view):
+    '''ViewEventListeners of view, created and dropped as their is_applicable changes'''
+    listeners = view.listeners
+    primary = view.is_primary()
+    for cls in view_event_listener_classes:
+        applicable = cls.is_applicable(view.settings()) and (primary or not cls.applies_to_primary_view_only())
+        if applicable and cls not in listeners:
+            listeners[cls] = cls(view)
+        elif not applicable and cls in listeners:
+            del listeners[cls]
+    return list(listeners.values())
+
+
+def text_changed(buffer):
+    '''pass changes to TextChangeListeners, attached to buffer on its first change'''
+    if buffer.listeners is None:
+        buffer.listeners = []
+        for cls in text_change_listener_classes:
+            if cls.is_applicable(buffer):
+                cls().attach(buffer)
+    changes, buffer.changes = buffer.changes, []
+    for listener in list(buffer.listeners):
+        if hasattr(listener, 'on_text_changed'):
+            listener.on_text_changed(changes)
+        if hasattr(listener, 'on_text_changed_async'):
+            sublime.set_timeout_async(lambda l=listener: l.on_text_changed_async(changes))
+
+
+def dispatch(event, view, *args):
+    '''not in API: call event handlers of listeners with view, and of view listeners without it,
+    their _async variants later from run_timeouts; Return results of handlers, if any'''
+    results = []
+    for listener in list(all_listeners):
+        handler = getattr(listener, event, None)
+        if handler:
+            results.append(handler(view, *args))
+        handler = getattr(listener, event + '_async', None)
+        if handler:
+            sublime.set_timeout_async(lambda h=handler: h(view, *args))
+    if view.is_valid() or event == 'on_close':
+        for listener in view_listeners(view):
+            handler = getattr(listener, event, None)
+            if handler:
+                results.append(handler(*args))
+            handler = getattr(listener, event + '_async', None)
+            if handler:
+                sublime.set_timeout_async(lambda h=handler: h(*args))
+    if event == 'on_close':
+        view.listeners.clear()
+    return [r for r in results if r is not None]
+
+
+def register(module):
+    '''add plugins defined in module, as reload_plugin does'''
+    for value in list(vars(module).values()):
+        if not isinstance(value, type) or value.__module__ != module.__name__:
+            continue
+        if issubclass(value, ApplicationCommand):
+            application_command_classes.append(value)
+        if issubclass(value, WindowCommand):
+            window_command_classes.append(value)
+        if issubclass(value, TextCommand):
+            text_command_classes.append(value)
+        if issubclass(value, EventListener):
+            all_listeners.append(value())
+        if issubclass(value, ViewEventListener):
+            view_event_listener_classes.append(value)
+        if issubclass(value, TextChangeListener):
+            text_change_listener_classes.append(value)
+
+
+def load_package(path, name=None):
+    '''not in API: import top level modules of package at path as submodules of name,
+    alphabetically as Sublime Text does, register their plugins and call plugin_loaded;
+    Return list of modules'''
+    name = name or os.path.basename(os.path.abspath(path))
+    if name in packages:
+        return packages[name]
+    sublime.add_package(name, path)
+    package = types.ModuleType(name)
+    package.__path__ = [os.path.abspath(path)]
+    sys.modules[name] = package
+    modules = packages[name] = []
+    for fn in sorted(os.listdir(path)):
+        if fn.endswith('.py'):
+            module = importlib.import_module(name + '.' + fn[:-3])
+            register(module)
+            modules.append(module)
+    for module in modules:
+        if hasattr(module, 'plugin_loaded'):
+            module.plugin_loaded()
+    return modules
@@ -1,16 +1,40 @@
 # coding: utf8
 
 import sublime
+import os
+import re
 import sys
-from unittest import TestCase
+import tempfile
+import threading
+import time
+from unittest import TestCase, skipUnless
 from datetime import datetime, timedelta
 
 ST3 = int(sublime.version()) >= 3000
+# run_timeouts, quick_panel of window, listeners of buffer exist only in headless stand-in, see conftest.py
+HEADLESS = hasattr(sublime, 'run_timeouts')
+headless_only = skipUnless(HEADLESS, 'inspects headless stand-in of Sublime Text API')
 
 if ST3:
     PlainTasksDates = sys.modules['PlainTasks.PlainTasksDates']
+    todo_parser = sys.modules['PlainTasks.todo_parser']
+    todo_query = sys.modules['PlainTasks.todo_query']
+    PlainTasksPerf = sys.modules['PlainTasks.PlainTasksPerf']
+    APlainTasksCommon = sys.modules['PlainTasks.APlainTasksCommon']
+    PlainTasksToHTML = sys.modules['PlainTasks.PlainTasksToHTML']
+    PlainTasksCaret = sys.modules['PlainTasks.PlainTasksCaret']
+    PlainTasksQuery = sys.modules['PlainTasks.PlainTasksQuery']
+    PlainTasks = sys.modules['PlainTasks.PlainTasks']
 else:
     PlainTasksDates = sys.modules['PlainTasksDates']
+    todo_parser = sys.modules['todo_parser']
+    todo_query = sys.modules['todo_query']
+    PlainTasksPerf = sys.modules['PlainTasksPerf']
+    APlainTasksCommon = sys.modules['APlainTasksCommon']
+    PlainTasksToHTML = sys.modules['PlainTasksToHTML']
+    PlainTasksCaret = sys.modules['PlainTasksCaret']
+    PlainTasksQuery = sys.modules['PlainTasksQuery']
+    PlainTasks = sys.modules['PlainTasks']
 
 
 class TestDatesFunctions(TestCase):
@@ -70,6 +94,29 @@ class TestDatesFunctions(TestCase):
                                                      default=c.get('default', default))
             self.assertEqual(date, c['result'])
 
+    def test_natural_date(self):
+        default = datetime(2016, 12, 31, 23, 0, 0)
+        cases = [
+            # (string, yearfirst, dayfirst, result)
+            ['2003-09-25', True, False, datetime(2003, 9, 25, 23, 0, 0)],
+            ['25.09.03', False, True, datetime(2003, 9, 25, 23, 0, 0)],
+            ['09/25/03 10:36', False, False, datetime(2003, 9, 25, 10, 36, 0)],
+            ['2003-Sep-25', False, True, datetime(2003, 9, 25, 23, 0, 0)],
+            ['sept 3', True, False, datetime(2016, 9, 3, 23, 0, 0)],
+            ['10:36', True, False, datetime(2016, 12, 31, 10, 36, 0)],
+            ['5 10:36', True, False, datetime(2016, 12, 5, 10, 36, 0)],
+            # left for dateutil
+            ['marc 3', True, False, None],
+            ['feb 30', True, False, None],
+            ['12', True, False, None],
+        ]
+        for (string, yearfirst, dayfirst, result) in cases:
+            date = PlainTasksDates.natural_date(string, yearfirst, dayfirst, default)
+            self.assertEqual(date, result)
+        # three-digit year
+        self.assertEqual(PlainTasksDates.natural_date('233', True, False, default, '(%Y-%m-%d %H:%M)'), datetime(233, 12, 31, 23, 0, 0))
+        self.assertRaises(ValueError, PlainTasksDates.natural_date, '233', True, False, default, '(%y-%m-%d %H:%M)')
+
     def test_increase_date(self):
         class View(object):
             def __init__(self, created=None):
@@ -149,3 +196,675 @@ class TestDatesFunctions(TestCase):
         for (date_format, result) in cases:
             df = PlainTasksDates.is_dayfirst(date_format)
             self.assertEqual(df, result)
+
+
+class TestTokenizer(TestCase):
+
+    def test_classify(self):
+        cases = [
+            ['Project:', todo_parser.HEADER],
+            ['  Project: @tag(1)', todo_parser.HEADER],
+            [u'  ☐ task', todo_parser.OPEN],
+            ['  - task @due(3)', todo_parser.OPEN],
+            [u'  ✔ task @done(16-12-31 23:00)', todo_parser.DONE],
+            ['  - task @done', todo_parser.DONE],
+            [u'  ✘ task @cancelled', todo_parser.CANCELLED],
+            ['  - task @cancelled(16-12-31 23:00)', todo_parser.CANCELLED],
+            ['  some note', todo_parser.NOTE],
+            [u'＿＿＿＿', todo_parser.ARCHIVE],
+            [u'--- ✄ -----------------------', todo_parser.SEPARATOR],
+            ['', todo_parser.EMPTY],
+            ['   ', todo_parser.EMPTY],
+        ]
+        for (line, kind) in cases:
+            self.assertEqual(todo_parser.classify(line)[0], kind)
+
+    def test_tokenize(self):
+        cases = [
+            [u'  ☐ a @high @waiting *b* <http://c.d>',
+             [('indent', '  '), ('bullet', u'☐'), ('text', ' a '), ('high', '@high'), ('text', ' '),
+              ('tag', '@waiting '), ('italic', '*b*'), ('text', ' '), ('url', '<http://c.d>')]],
+            [u' ✔ a @done(1)', [('indent', ' '), ('bullet', u'✔'), ('text', ' a '), ('tag', '@done(1)')]],
+            [' a __b__ c', [('text', ' a '), ('bold', '__b__'), ('text', ' c')]],
+        ]
+        for (line, runs) in cases:
+            kind, result = todo_parser.tokenize(line)
+            self.assertEqual(result, runs)
+            self.assertEqual(''.join(f for _, f in result), line)
+
+    def test_priority_tags(self):
+        outline = todo_parser.Outline(u'\n'.join([
+            u'☐ a @high b @high @low',
+            u'✔ c @high @done',
+            u'☐ d ✭high',
+        ]))
+        found = todo_parser.priority_tags(outline)
+        self.assertEqual(found['high'], [(4, 17), (43, 48)])
+        self.assertEqual(found['low'], [(18, 22)])
+        self.assertEqual(found['critical'], [])
+
+    def test_outline_edit(self):
+        outline = todo_parser.Outline(u'A:\n  ☐ a\n  note\nB:\n  ☐ b')
+        outline.kinds
+        cases = [
+            [9, 9, u' @high\n  ✔ c @done'],
+            [0, 3, u''],
+            [11, 20, u'\n\n'],
+            [len(outline.text), len(outline.text), u'\n'],
+        ]
+        for (a, b, string) in cases:
+            edited = outline.edit(a, b, string)
+            fresh = todo_parser.Outline(edited.text)
+            self.assertEqual(list(edited.starts), list(fresh.starts))
+            self.assertEqual(edited.kinds, fresh.kinds)
+        self.assertEqual(outline.rowcol(13), (2, 4))
+
+    def test_tag_trie(self):
+        trie = todo_parser.TagTrie()
+        old = todo_parser.tag_counts(u' ☐ a @waiting @review(bob) @due(17-1-1)\n ☐ b @waiting @review(ann)')
+        trie.update(old)
+        self.assertEqual(trie.complete('re'), [('review', 2), ('review(ann)', 1), ('review(bob)', 1)])
+        self.assertEqual(trie.complete('du'), [('due', 1)])
+        new = todo_parser.tag_counts(u' ☐ a @review(bob) @sprint42')
+        trie.update(todo_parser.count_changes(old, new))
+        self.assertEqual(trie.complete(''), [('review', 1), ('review(bob)', 1), ('sprint42', 1)])
+        self.assertEqual(trie.complete('w'), [])
+        self.assertEqual(sorted(trie.root.children), ['r', 's'])  # nodes of removed tags are dropped
+        trie.update(new, -1)
+        self.assertEqual(trie.root.children, {})
+
+    def test_with_context(self):
+        outline = todo_parser.Outline(u'\n'.join([
+            'A:',                # 0
+            u'  ☐ a1 @high',     # 1
+            '    note of a1',    # 2
+            '  B:',              # 3
+            u'    ☐ b1',         # 4
+            u'    ☐ b2 @high',   # 5
+            '',                  # 6
+            'C:',                # 7
+            u'  ☐ c1',           # 8
+        ]))
+        self.assertEqual(todo_parser.with_context(outline, [5]), [0, 3, 5])
+        self.assertEqual(todo_parser.with_context(outline, [1, 8]), [0, 1, 2, 7, 8])
+
+    def test_fold_ranges(self):
+        self.assertEqual(todo_parser.fold_ranges([(5, 9), (10, 14), (20, 24)], 30), [(0, 4), (15, 19), (25, 30)])
+        self.assertEqual(todo_parser.fold_ranges([(0, 9)], 9), [])
+
+
+class TestQuery(TestCase):
+
+    def test_select(self):
+        outline = todo_parser.Outline(u'\n'.join([
+            'Backend: @tag',                            # 0
+            u'  ☐ a @high @due(16-12-31 10:00)',        # 1
+            u'  ☐ b @high @waiting',                    # 2
+            '  Sub:',                                   # 3
+            u'    ✔ c @high @done(16-12-01 10:00)',     # 4
+            'Frontend:',                                # 5
+            u'  ☐ d @high @due(17-02-01 10:00)',        # 6
+            u'  ☐ e "quoted"',                          # 7
+        ]))
+        index = todo_query.TaskIndex(outline, lambda text, line: datetime.strptime(text, '(%y-%m-%d %H:%M)'))
+        now = datetime(2016, 12, 30)
+        cases = [
+            ['@high and not @waiting and due < 3d and project ~ "back"', [1]],
+            ['@HIGH', [1, 2, 4, 6]],
+            ['open @high', [1, 2, 6]],
+            ['not done', [1, 2, 6, 7]],
+            ['project = sub or due > 1w', [4, 6]],
+            ['(@high or "quoted") and project ~ front', [6, 7]],
+            ['text ~ "^\\s+.\\s[ab]\\b"', [1, 2]],
+            ['"\\"quoted\\""', [7]],
+        ]
+        for (query, lines) in cases:
+            self.assertEqual(index.select(query, now), lines)
+
+    def test_search(self):
+        outline = todo_parser.Outline(u'\n'.join([
+            'Archived (16-01-02 10:00):',                       # 0
+            'Backend:',                                         # 1
+            u'  ✔ deploy legacy server @done(15-12-30 10:00)',  # 2
+            '    note on Deployment',                           # 3
+            u'  ☐ deploy v2.1 @due(16-12-31 10:00)',            # 4
+        ]))
+        kinds = todo_query.TASKS + (todo_parser.NOTE, todo_parser.HEADER)
+        index = todo_query.TaskIndex(outline, lambda text, line: datetime.strptime(text, '(%y-%m-%d %H:%M)'), 4, kinds)
+        now = datetime(2016, 12, 30)
+        cases = [
+            ['deploy', [2, 3, 4]],                      # prefix of word, case insensitive
+            ['deploy done', [2]],
+            ['deploy date < 2016-01-01', [2]],
+            ['date <= 2016-12-31 and not done', [4]],   # the whole day
+            ['date > -1d', [4]],
+            ['v2.1', [4]],
+            ['note or project and backend', [1, 3]],
+        ]
+        for (query, lines) in cases:
+            self.assertEqual(index.select(todo_query.compile_query(query, words=True), now), lines)
+        self.assertRaises(todo_query.QueryError, todo_query.compile_query, 'deploy')
+
+    def test_errors(self):
+        for query in ['', '@high and', 'due = 3d', 'due < soon', '(@high', 'project ~ "("', '@a )', 'word']:
+            self.assertRaises(todo_query.QueryError, todo_query.compile_query, query)
+
+    def test_fuzzy(self):
+        outline = todo_parser.Outline(u'\n'.join([
+            'Release notes:',                           # 0
+            u'  ☐ write tests',                         # 1
+            '  Sub:',                                   # 2
+            u'    ☐ deploy backend',                    # 3
+            u'    ✔ deploy frontend @done',             # 4
+            u'☐ update the notes',                      # 5
+        ]))
+        entries = list(todo_query.fuzzy_entries(outline))
+        self.assertEqual(entries[3], (u'deploy backend', 2, 3, u'Release notes / Sub'))
+        index = todo_query.FuzzyIndex((text, depth, line) for text, depth, line, _ in entries)
+        cases = [
+            ['no', [0, 5]],        # word prefix, shallow and short first
+            ['NOTES', [0, 5]],
+            ['wt', [1]],           # initials
+            ['de back', [3]],      # words at word starts
+            ['dpbk', [3]],         # letters in order
+            ['te', [1, 0, 5]],     # word prefix before substring, despite depth
+            ['frontend', []],
+        ]
+        for (pattern, lines) in cases:
+            self.assertEqual([e[2] for e in index.search(pattern)], lines)
+        self.assertEqual([e[2] for e in index.search(u'', 2)], [0, 5])
+
+
+class TestCommands(TestCase):
+    '''run on scratch view, in Sublime Text or in its headless stand-in (see conftest.py);
+    tests which drive or inspect the stand-in itself run only in it'''
+
+    def setUp(self):
+        self.view = sublime.active_window().new_file()
+        self.view.set_scratch(True)
+        self.view.set_syntax_file('Packages/PlainTasks/PlainTasks.sublime-syntax' if ST3 else
+                                  'Packages/PlainTasks/PlainTasks.tmLanguage')
+        self.view.settings().set('before_date_space', '')
+
+    def tearDown(self):
+        self.view.window().focus_view(self.view)
+        self.view.window().run_command('close_file')
+
+    def prepare(self, text, point):
+        self.view.run_command('append', {'characters': text})
+        self.view.sel().clear()
+        self.view.sel().add(sublime.Region(point))
+
+    def lines(self):
+        return self.view.substr(sublime.Region(0, self.view.size())).split('\n')
+
+    def test_scopes(self):
+        self.prepare(u'A:\n  ☐ a @high\n  ✔ b @done\n  ✘ c @cancelled\n  note', 0)
+        cases = [
+            [0, 'keyword.control.header.todo'],
+            [3, 'meta.item.todo.pending'],
+            [11, 'string.other.tag.todo.high'],
+            [17, 'meta.item.todo.completed'],
+            [29, 'meta.item.todo.cancelled'],
+            [46, 'notes.todo'],
+        ]
+        for (point, scope) in cases:
+            self.assertIn(scope, self.view.scope_name(point))
+
+    def test_new(self):
+        self.prepare(u'A:\n  ☐ a', 8)
+        self.view.run_command('plain_tasks_new')
+        self.assertEqual(self.lines()[2].rstrip(), u'  ☐')
+        self.assertEqual(self.view.sel()[0], sublime.Region(self.view.size()))
+
+    def test_complete_and_cancel(self):
+        self.prepare(u'A:\n  ☐ a\n  ☐ b', 5)
+        self.view.run_command('plain_tasks_complete')
+        self.assertTrue(re.match(u'^  ✔ a @done\\(\\d\\d-\\d\\d-\\d\\d \\d\\d:\\d\\d\\)$', self.lines()[1]))
+        self.view.run_command('plain_tasks_complete')
+        self.assertEqual(self.lines()[1], u'  ☐ a')
+        self.view.sel().clear()
+        self.view.sel().add(sublime.Region(self.view.size()))
+        self.view.run_command('plain_tasks_cancel')
+        self.assertTrue(re.match(u'^  ✘ b @cancelled\\(', self.lines()[2]))
+
+    def test_archive(self):
+        self.prepare(u'A:\n  ✔ a @done(16-12-30 10:00)\n    note\n  ☐ b', 0)
+        self.view.run_command('plain_tasks_archive')
+        lines = self.lines()
+        self.assertEqual(lines[:2], [u'A:', u'  ☐ b'])
+        archive = lines.index('Archive:')
+        self.assertEqual([l.strip() for l in lines[archive + 1:archive + 3]],
+                         [u'✔ a @done(16-12-30 10:00) @project(A)', u'note'])
+
+    def test_sort_by_date(self):
+        self.prepare(u'☐ c\n＿＿＿＿\nArchive:\n ✘ a @cancelled(16-12-29 10:00)\n   note\n ✔ b @done(16-12-30 10:00)\n', 0)
+        self.view.run_command('plain_tasks_sort_by_date')
+        lines = self.lines()
+        archive = lines.index('Archive:')
+        self.assertEqual(lines[archive + 1:], [u' ✔ b @done(16-12-30 10:00)', u' ✘ a @cancelled(16-12-29 10:00)', u'   note', u''])
+
+    def test_sort_by_date_blank_lines(self):
+        self.prepare(u'☐ c\n＿＿＿＿\nArchive:\n ✘ a @cancelled(16-12-29 10:00)\n\n ✔ b @done(16-12-30 10:00)\n   note of b\n', 0)
+        self.view.run_command('plain_tasks_sort_by_date')
+        lines = self.lines()
+        archive = lines.index('Archive:')
+        self.assertEqual(lines[archive + 1:], [u' ✔ b @done(16-12-30 10:00)', u'   note of b', u' ✘ a @cancelled(16-12-29 10:00)', u'', u''])
+
+    def test_recalculate_time(self):
+        self.prepare(u'✔ a @started(16-12-30 10:00) @toggle(16-12-30 11:00) @toggle(16-12-30 12:00) @done(16-12-30 13:00) @lasted(5:00)', 0)
+        self.view.run_command('select_all')
+        self.view.run_command('plain_tasks_re_calculate_time_for_tasks')
+        self.assertEqual(self.lines(), [u'✔ a @started(16-12-30 10:00) @toggle(16-12-30 11:00) @toggle(16-12-30 12:00) @done(16-12-30 13:00) @lasted(2:00)'])
+
+    @headless_only
+    def test_goto_tag_panel(self):
+        self.prepare(u'A:\n' + u''.join(u'  ☐ task %d @tag%d @x\n' % (i, i % 50) for i in range(5000)) + u'  ✔ done @z\n', 0)
+        window = self.view.window()
+        self.view.run_command('plain_tasks_goto_tag')
+        items = window.quick_panel[0]
+        self.assertEqual(len(items), 51)  # names of tags of pending tasks
+        self.assertEqual(items[:2], [[u'@tag0', u'100 occurrences'], [u'@x', u'5000 occurrences']])
+        self.view.run_command('plain_tasks_goto_tag')
+        self.assertIs(window.quick_panel[0], items)  # reused while buffer is unchanged
+        window.quick_panel[1](1)
+        sublime.run_timeouts()
+        occurrences = window.quick_panel[0]
+        self.assertEqual(len(occurrences), 5000)
+        self.assertEqual(occurrences[:2], [[u'@x', u'1: ☐ task 0 @tag0 @x'], [u'@x', u'2: ☐ task 1 @tag1 @x']])
+        window.quick_panel[1](1)
+        self.assertEqual(self.view.substr(self.view.line(self.view.sel()[0].a)), u'  ☐ task 1 @tag1 @x')
+
+    def test_gutter_icons_only_if_set(self):
+        self.prepare(u'☐ a @high\n', 0)
+        listener, started, analyse_async = PlainTasks.PlainTasksAddGutterIconsForTags(), [], PlainTasks.analyse_async
+        PlainTasks.analyse_async = lambda view, kind, analyse, apply: started.append(kind)
+        try:
+            listener.on_activated(self.view)
+            self.assertEqual(started, [])  # no worker without icons
+            self.view.settings().set('icon_high', u'Packages/PlainTasks/icons/high.png')
+            listener.on_activated(self.view)
+            self.assertEqual(started, ['priority_tags'])
+        finally:
+            PlainTasks.analyse_async = analyse_async
+            self.view.settings().erase('icon_high')
+
+    @headless_only
+    def test_import_times(self):
+        times = APlainTasksCommon.IMPORT_TIMES
+        self.assertIn('PlainTasksToHTML', times)  # loaded after APlainTasksCommon
+        self.assertNotIn('PlainTasksDates', times)  # in time of PlainTasks, which imports it first
+        self.assertNotIn(APlainTasksCommon.IMPORT_TIMER, sys.meta_path)  # removed at plugin_loaded
+
+    def test_perf_instrumentation(self):
+        self.assertEqual(PlainTasksPerf.percentiles(range(100, 0, -1), (.5, .95, .99, 1)), [50, 95, 99, 100])
+        self.prepare(u'A:\n  ☐ a', 8)
+        was_on = bool(PlainTasksPerf.INSTRUMENTED)
+        PlainTasksPerf.instrument()
+        try:
+            self.view.run_command('plain_tasks_new')
+        finally:
+            PlainTasksPerf.instrument(was_on)
+        histogram = PlainTasksPerf.HISTOGRAMS['PlainTasksNewCommand.runCommand']
+        self.assertTrue(histogram.calls >= 1)
+        self.assertIn('PlainTasksNewCommand.runCommand', PlainTasksPerf.report())
+        if not was_on:
+            self.assertEqual(PlainTasksPerf.INSTRUMENTED, {})
+
+    def test_api_calls(self):
+        '''upper bounds of calls to Sublime Text: for edit of task they do not depend on size of document'''
+        self.prepare(u'A:\n' + u'  ✔ a @done(16-12-30 10:00)\n    note\n  ☐ b\n' * 100, 5)
+        calls = PlainTasksPerf.api_calls(self.view.run_command, 'plain_tasks_complete')
+        self.assertTrue(sum(calls.values()) <= 16, calls)
+        self.assertTrue(calls.get('scope_name', 0) <= 1, calls)
+        calls = PlainTasksPerf.api_calls(self.view.run_command, 'plain_tasks_archive')
+        lines = self.lines()
+        archived = len([l for l in lines[lines.index('Archive:') + 1:] if l.strip()])
+        self.assertEqual(archived, 198)  # the first task is pending again
+        # each line is inserted to archive and erased, then sort_by_date erases it and inserts it with its task
+        inserts, erases = archived + archived // 2 + 1, 2 * archived
+        self.assertTrue(calls.get('insert', 0) <= inserts, calls)
+        self.assertTrue(calls.get('erase', 0) <= erases, calls)
+        self.assertTrue(calls.get('full_line', 0) <= erases, calls)  # region of each erase
+        self.assertTrue(sum(calls.values()) <= inserts + 2 * erases + 15, calls)
+        for name in ('line', 'lines', 'find_all', 'find_by_selector', 'indented_region', 'scope_name', 'substr', 'rowcol', 'text_point'):
+            self.assertTrue(calls.get(name, 0) <= 1, calls)  # none of them per task or per project
+        for name in ('find', 'score_selector', 'sel', 'size'):
+            self.assertTrue(calls.get(name, 0) <= 4, calls)
+
+    @headless_only
+    def test_jobs(self):
+        start_job, history = APlainTasksCommon.start_job, APlainTasksCommon.JOB_HISTORY
+        gate, finished = threading.Event(), []
+
+        def held(job):
+            gate.wait(5)
+            job.progress()  # raises Cancelled once superseded
+            return 'held'
+
+        first = start_job(self.view, 'test', held, finished.append)
+        second = start_job(self.view, 'test', lambda job: 'second', finished.append)
+        self.assertTrue(first.cancelled)
+        self.assertIs(APlainTasksCommon.JOBS[(self.view.id(), 'test')], second)
+        gate.set()
+        first.wait()
+        second.wait()
+        sublime.run_timeouts()
+        self.assertEqual(finished, ['second'])
+        self.assertEqual(sorted(outcome for kind, _, _, outcome in history[-2:] if kind == 'test'), ['cancelled', 'done'])
+        self.assertNotIn((self.view.id(), 'test'), APlainTasksCommon.JOBS)
+
+        gate.clear()
+        third = start_job(self.view, 'test', lambda job: gate.wait(5) and 'ignored check', finished.append)
+        APlainTasksCommon.cancel_jobs(self.view)
+        gate.set()
+        third.wait()
+        sublime.run_timeouts()
+        self.assertEqual(finished, ['second'])  # result of cancelled job is dropped even if it did not check
+        self.assertEqual(history[-1][3], 'cancelled')
+        self.assertNotIn((self.view.id(), 'test'), APlainTasksCommon.JOBS)
+
+        late = start_job(self.view, 'test', lambda job: 'late', finished.append)
+        late.wait()  # work returned, callback is not called yet
+        newer = start_job(self.view, 'test', lambda job: 'newer', finished.append)
+        newer.wait()
+        sublime.run_timeouts()
+        self.assertEqual(finished, ['second', 'newer'])
+        late = start_job(self.view, 'test', lambda job: 'late', finished.append)
+        late.wait()
+        APlainTasksCommon.cancel_jobs(self.view)
+        sublime.run_timeouts()
+        self.assertEqual(finished, ['second', 'newer'])
+        self.assertNotIn((self.view.id(), 'test'), APlainTasksCommon.JOBS)
+
+    @headless_only
+    def test_state_eviction(self):
+        self.prepare(u'A:\n  ☐ a @high\n', 0)
+        APlainTasksCommon.buffer_outline(self.view)
+        window = self.view.window()
+        other = window.new_file()
+        other.set_scratch(True)
+        other.run_command('append', {'characters': u'B:\n  ☐ b\n'})
+        buffer_id, other_id = self.view.buffer_id(), other.buffer_id()
+        try:
+            window.focus_view(other)
+            APlainTasksCommon.buffer_outline(other)
+            self.assertIn(buffer_id, APlainTasksCommon.enforce_budget(0))
+            self.assertNotIn(buffer_id, APlainTasksCommon.BUFFER_CACHE)
+            self.assertIn(other_id, APlainTasksCommon.BUFFER_CACHE)  # in foreground
+            self.assertIn(u'B:', APlainTasksCommon.buffer_outline(other).text)
+        finally:
+            window.focus_view(other)
+            window.run_command('close_file')
+        self.assertFalse(any(other_id in states for _, states, per, _, _ in APlainTasksCommon.STATES if per == 'buffer'))
+        self.assertIn(u'PlainTasks state', PlainTasksPerf.memory_report())
+
+    def test_state_sizes_per_version(self):
+        self.prepare(u'A:\n  ☐ a\n', 0)
+        APlainTasksCommon.buffer_outline(self.view)
+        buffer_id = self.view.buffer_id()
+        versions = lambda: set(k[3] for k in APlainTasksCommon.STATE_SIZES if k[:2] == ('derived data', buffer_id))
+        APlainTasksCommon.state_sizes()
+        self.assertEqual(versions(), set([self.view.change_count()]))
+        self.view.run_command('append', {'characters': u'  ☐ b\n'})
+        APlainTasksCommon.buffer_outline(self.view)
+        APlainTasksCommon.state_sizes()
+        self.assertEqual(versions(), set([self.view.change_count()]))
+
+    @headless_only
+    def test_budget_on_deactivation(self):
+        self.prepare(u'A:\n  ☐ a\n', 0)
+        other = self.view.window().new_file()
+        other.set_scratch(True)
+        enforced, enforce_budget, delay = [], APlainTasksCommon.enforce_budget, APlainTasksCommon.BUDGET_DELAY
+        APlainTasksCommon.enforce_budget = lambda: enforced.append(True)
+        APlainTasksCommon.BUDGET_DELAY = 0
+        try:
+            APlainTasksCommon.buffer_outline(self.view)
+            APlainTasksCommon.buffer_outline(other)
+            listener = APlainTasksCommon.PlainTasksViewStates()
+            for view in (self.view, other, self.view):
+                listener.on_deactivated(view)
+            self.assertEqual(enforced, [])
+            sublime.run_timeouts()
+            self.assertEqual(enforced, [True])  # once for quick switches
+        finally:
+            APlainTasksCommon.enforce_budget, APlainTasksCommon.BUDGET_DELAY = enforce_budget, delay
+            other.close()
+
+    def test_export_html(self):
+        command = PlainTasksToHTML.PlainTasksConvertToHtml(self.view)
+        parts = PlainTasksToHTML.split_template(u'<title>$title</title><style>$css</style><pre>$content</pre>')
+        text = u'A:\n  ☐ a <b> @high\n' + u'  ✔ b @done\n' * PlainTasksToHTML.EXPORT_CHUNK_LINES
+        name = command.export(APlainTasksCommon.Job(self.view, 'export', 'export', quiet=True), parts, u'T', u'css', text)
+        try:
+            with open(name, 'rb') as f:
+                html = f.read().decode('utf-8')
+        finally:
+            os.remove(name)
+        self.assertTrue(html.startswith(u'<title>T</title><style>css</style><pre><span class="header">A:</span>\n'))
+        self.assertIn(u'<span class="bullet-pending">☐</span> a &lt;b&gt; <span class="tag-high">@high</span>', html)
+        self.assertEqual(html.count(u'<span class="bullet-done">'), PlainTasksToHTML.EXPORT_CHUNK_LINES)
+        self.assertTrue(html.endswith(u'<span class="empty-line"></span></pre>'))
+
+    def test_export_html_removes_file_on_error(self):
+        command = PlainTasksToHTML.PlainTasksConvertToHtml(self.view)
+        job = APlainTasksCommon.Job(self.view, 'export', 'export', quiet=True)
+        job.cancel()  # progress after the first chunk raises Cancelled
+        directory, tempdir = tempfile.mkdtemp(), tempfile.tempdir
+        tempfile.tempdir = directory
+        try:
+            with self.assertRaises(APlainTasksCommon.Cancelled):
+                command.export(job, [u'', u'content', u''], u'T', u'', u'☐ a\n' * (PlainTasksToHTML.EXPORT_CHUNK_LINES + 1))
+            self.assertEqual(os.listdir(directory), [])
+        finally:
+            tempfile.tempdir = tempdir
+            os.rmdir(directory)
+
+    def test_theme_css_cache(self):
+        theme = tempfile.NamedTemporaryFile(suffix='.hidden-tmTheme', delete=False)
+        theme.close()
+        converted = []
+        convert, version = PlainTasksToHTML.convert_tmtheme_to_css, PlainTasksToHTML.CSS_CONVERTER_VERSION
+        PlainTasksToHTML.convert_tmtheme_to_css = lambda path: converted.append(path) or [u'css %d' % len(converted)]
+        try:
+            self.assertEqual(PlainTasksToHTML.cached_tmtheme_to_css(theme.name), [u'css 1'])
+            self.assertEqual(PlainTasksToHTML.cached_tmtheme_to_css(theme.name), [u'css 1'])
+            mtime = os.path.getmtime(theme.name) + 10
+            os.utime(theme.name, (mtime, mtime))
+            self.assertEqual(PlainTasksToHTML.cached_tmtheme_to_css(theme.name), [u'css 2'])
+            PlainTasksToHTML.CSS_CONVERTER_VERSION = version + 1
+            self.assertEqual(PlainTasksToHTML.cached_tmtheme_to_css(theme.name), [u'css 3'])
+            self.assertEqual(PlainTasksToHTML.cached_tmtheme_to_css(theme.name), [u'css 3'])
+        finally:
+            PlainTasksToHTML.convert_tmtheme_to_css, PlainTasksToHTML.CSS_CONVERTER_VERSION = convert, version
+            PlainTasksToHTML.THEME_CSS_CACHE.pop(theme.name, None)
+            PlainTasksToHTML.save_theme_css_cache()
+            os.remove(theme.name)
+        self.assertEqual(len(converted), 3)
+
+    @headless_only
+    def test_invalid_created_reported_in_main_thread(self):
+        self.prepare(u'☐ a\n☐ b @created(16.13.45) @due(++1d)\n', 0)
+        threads = []
+        status_message = sublime.status_message
+        sublime.status_message = lambda msg: threads.append((threading.current_thread(), msg))
+        try:
+            self.view.run_command('plain_tasks_toggle_highlight_past_due')
+            sublime.run_timeouts(wait=1)
+        finally:
+            sublime.status_message = status_message
+        self.assertEqual(threads, [(threading.current_thread(), u'@created date is invalid at line 2, see console for details')])
+
+    def test_todo_files_listing_cache(self):
+        folder = tempfile.mkdtemp()
+        sub = os.path.join(folder, u'sub')
+        os.mkdir(sub)
+        os.mkdir(os.path.join(folder, u'.hidden'))
+        for path in (os.path.join(folder, u'a.todo'), os.path.join(sub, u'b_archive.txt'), os.path.join(sub, u'c.txt')):
+            open(path, 'w').close()
+        listed, listdir = [], os.listdir
+        os.listdir = lambda path: listed.append(path) or listdir(path)
+        try:
+            files = lambda: sorted(os.path.relpath(p, folder) for p in PlainTasksQuery.todo_files([folder], archives=True))
+            self.assertEqual(files(), [u'a.todo', os.path.join(u'sub', u'b_archive.txt')])
+            self.assertEqual(sorted(listed), [folder, sub])
+            del listed[:]
+            self.assertEqual(len(files()), 2)
+            self.assertEqual(listed, [])  # nothing was modified
+            open(os.path.join(sub, u'd.tasks'), 'w').close()
+            mtime = os.path.getmtime(sub) + 10
+            os.utime(sub, (mtime, mtime))
+            self.assertEqual(files(), [u'a.todo', os.path.join(u'sub', u'b_archive.txt'), os.path.join(u'sub', u'd.tasks')])
+            self.assertEqual(listed, [sub])
+        finally:
+            os.listdir = listdir
+            for root, subdirs, names in os.walk(folder, topdown=False):
+                for name in names:
+                    os.remove(os.path.join(root, name))
+                for name in subdirs:
+                    os.rmdir(os.path.join(root, name))
+            os.rmdir(folder)
+            for path in list(PlainTasksQuery.DIRECTORY_LISTINGS):
+                if path.startswith(folder):
+                    del PlainTasksQuery.DIRECTORY_LISTINGS[path]
+
+    def test_calendar_cache(self):
+        self.prepare(u'☐ a @due(16-12-05 10:00)\n☐ b @due(16-12-05)\n✔ c @due(16-12-06) @done\n', 0)
+        self.assertEqual(PlainTasksDates.due_counts(self.view), {(2016, 12, 5): 2})
+        command = PlainTasksDates.PlainTasksCalendar(self.view)
+        render, rendered = command.render_calendar, []
+        command.render_calendar = lambda date, heat: rendered.append(heat) or render(date, heat)
+        PlainTasksDates.CALENDAR_CACHE.clear()
+        first = command.generate_calendar(datetime(2016, 12, 1, 9, 5))
+        second = command.generate_calendar(datetime(2016, 12, 1, 10, 30))
+        self.assertEqual(len(rendered), 1)
+        self.assertEqual(rendered[0][4], 2)
+        self.assertIn(u'"day:2016-12-5-9-5" class="due2">5</a>', first)
+        self.assertIn(u'>09:05</a>', first)
+        self.assertIn(u'"day:2016-12-5-10-30" class="due2">5</a>', second)
+        self.assertNotIn(u'HH', second)
+        size, PlainTasksDates.CALENDAR_CACHE_SIZE = PlainTasksDates.CALENDAR_CACHE_SIZE, 2
+        try:
+            command.generate_calendar(datetime(2017, 1, 1))
+            command.generate_calendar(datetime(2016, 12, 1))  # the least recently used is 2017-01 now
+            command.generate_calendar(datetime(2017, 2, 1))
+            self.assertEqual([key[:2] for key in PlainTasksDates.CALENDAR_CACHE], [(2016, 12), (2017, 2)])
+        finally:
+            PlainTasksDates.CALENDAR_CACHE_SIZE = size
+
+    def test_due_counts_of_highlighting(self):
+        self.prepare(u'☐ a @due(16-12-05 10:00)\n☐ b @due(16-12-05)\n✔ c @due(16-12-06) @done\nnote @due(16-12-07)\n', 0)
+        outline, settings, counts = APlainTasksCommon.buffer_outline(self.view), APlainTasksCommon.settings_snapshot(self.view), {}
+        past_due, _, _, _ = PlainTasksDates.group_due_tags(outline, settings, [], counts)
+        self.assertEqual(len(past_due), 3)
+        self.assertEqual(counts, PlainTasksDates.count_due_days(outline, settings))  # pending tasks only
+
+    def test_calendar_locale(self):
+        self.prepare(u'☐ a @due(16-12-05)\n', 0)
+        command = PlainTasksDates.PlainTasksCalendar(self.view)
+        calls, setlocale, was_set = [], PlainTasksDates.locale.setlocale, PlainTasksDates.LOCALE_SET[:]
+        PlainTasksDates.locale.setlocale = lambda *args: calls.append(args)
+        PlainTasksDates.LOCALE_SET[:] = []
+        try:
+            command.generate_calendar(datetime(2016, 12, 1))
+            command.generate_calendar(datetime(2017, 1, 1))
+        finally:
+            PlainTasksDates.locale.setlocale = setlocale
+            PlainTasksDates.LOCALE_SET[:] = was_set
+        self.assertEqual(len(calls), 1)  # on first calendar, not on load of plugin
+
+    @headless_only
+    def test_outline_edits_listener(self):
+        self.prepare(u'☐ a\n', 0)
+        other = self.view.window().new_file()
+        try:
+            other.set_scratch(True)
+            other.run_command('append', {'characters': u'☐ a\n'})
+            listeners = lambda view: [type(l).__name__ for l in view.buffer().listeners or ()]
+            self.assertIn('PlainTasksOutlineEdits', listeners(self.view))
+            self.assertIn('PlainTasksOutlineEdits', listeners(other))  # whatever syntax it gets later
+            APlainTasksCommon.buffer_outline(self.view)
+            for view in (self.view, other):
+                view.run_command('append', {'characters': u'☐ b\n'})
+            self.assertEqual(APlainTasksCommon.OUTLINE_EDITS[self.view.buffer_id()][1], [(4, 4, u'☐ b\n')])
+            self.assertNotIn(other.buffer_id(), APlainTasksCommon.OUTLINE_EDITS)  # it has no outline
+        finally:
+            other.close()
+
+    def test_settings_snapshot(self):
+        settings_snapshot = APlainTasksCommon.settings_snapshot
+        snapshot = settings_snapshot(self.view)
+        self.assertIs(settings_snapshot(self.view), snapshot)
+        self.view.settings().set('plain_tasks_remain_time_phantoms', [[0, u'1 day']])  # written by plugin itself
+        self.view.settings().set('before_date_space', u'')  # the same value
+        self.assertIs(settings_snapshot(self.view), snapshot)
+        self.view.settings().erase('plain_tasks_remain_time_phantoms')
+        self.view.settings().set('date_format', u'(%d.%m.%y)')
+        try:
+            changed = settings_snapshot(self.view)
+            self.assertIsNot(changed, snapshot)
+            self.assertEqual(changed.date_format, u'(%d.%m.%y)')
+            self.assertTrue(changed.dayfirst)
+        finally:
+            self.view.settings().erase('date_format')
+        snapshot = settings_snapshot(self.view)
+        self.assertEqual(snapshot.date_format, u'(%y-%m-%d %H:%M)')
+        for name in APlainTasksCommon.GLOBAL_SETTINGS:
+            settings = sublime.load_settings(name)
+            settings.set('plain_tasks_test', True)
+            try:
+                self.assertIsNot(settings_snapshot(self.view), snapshot)
+            finally:
+                settings.erase('plain_tasks_test')
+            snapshot = settings_snapshot(self.view)
+
+    def caret_contexts(self, dispatcher, points):
+        '''Return contexts passed to handlers of dispatcher while caret visits points'''
+        contexts = []
+
+        class Handler(object):
+            def update(self, context):
+                contexts.append(context)
+
+        dispatcher.handlers = [Handler()]
+        for point in points:
+            self.view.sel().clear()
+            self.view.sel().add(sublime.Region(point))
+            dispatcher.on_selection_modified_async()
+        return contexts
+
+    def test_caret_dispatcher(self):
+        self.prepare(u'☐ a @due(16-12-05) @tag\n✔ b @tag\n', 0)
+        dispatcher = PlainTasksCaret.PlainTasksCaretDispatcher(self.view)
+        contexts = self.caret_contexts(dispatcher, [2, 3, 6, 8, 20, 22, 30])
+        self.assertEqual([c.point for c in contexts], [2, 6, 20, 30])
+        self.assertEqual((contexts[0].tag, contexts[0].due), (None, None))
+        self.assertEqual(contexts[1].due[2], u'16-12-05')
+        self.assertEqual(self.view.substr(contexts[1].due[1]), u'(16-12-05)')
+        self.assertEqual(self.view.substr(contexts[2].tag), u'@tag')
+        self.assertEqual(contexts[2].due, None)
+        self.assertEqual(contexts[3].tag, None)  # tags of completed tasks are not for date picker
+
+    def test_caret_context_is_line_local(self):
+        self.prepare(u'☐ a @due(16-12-05)\n', 0)
+        dispatcher = PlainTasksCaret.PlainTasksCaretDispatcher(self.view)
+        self.assertEqual(len(self.caret_contexts(dispatcher, [6])), 1)
+        self.view.run_command('append', {'characters': u'☐ b @due(16-12-06)\n'})
+        self.assertEqual(self.caret_contexts(dispatcher, [6]), [])  # edits elsewhere are irrelevant
+        self.view.sel().clear()
+        self.view.sel().add(sublime.Region(16, 17))
+        self.view.run_command('insert', {'characters': u'6'})
+        contexts = self.caret_contexts(dispatcher, [6])  # same span of tag, but other date
+        self.assertEqual([c.due[2] for c in contexts], [u'16-12-06'])
+
+    def test_hover(self):
+        self.prepare(u'☐ a\n', 0)
+        dispatcher = PlainTasksCaret.PlainTasksCaretDispatcher(self.view)
+        dispatcher.on_hover(2, sublime.HOVER_TEXT)
+        self.assertFalse(self.view.is_popup_visible())
+        dispatcher.on_hover(0, sublime.HOVER_TEXT)
+        self.assertTrue(self.view.is_popup_visible())
+        dispatcher.hover.exec_action(u'complete\v0')
+        self.assertFalse(self.view.is_popup_visible())
+        self.assertTrue(self.lines()[0].startswith(u'✔ a @done'))
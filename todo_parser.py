@@ -0,0 +1,425 @@
+# coding: utf-8
+"""Headless tokenizer for PlainTasks documents.
+
+Mirrors the rules of ``PlainTasks.sublime-syntax`` with plain ``re`` so the
+document can be classified and split into runs without asking the editor
+for a scope at every character. Module must not import ``sublime``.
+"""
+
+import re
+import threading
+from array import array
+from bisect import bisect_right
+
+HEADER    = 'header'
+EMPTY     = 'empty'
+NOTE      = 'note'
+OPEN      = 'open'
+DONE      = 'done'
+CANCELLED = 'cancelled'
+SEPARATOR = 'separator'
+ARCHIVE   = 'archive'
+
+# order matters, it is the very order of rules in main context of syntax
+HEADER_RX = re.compile(r'(?u)^\s*(\#?\s?\w+.*?:\s*?(\@[^\s]+(\(.*?\))?\s*?)*$)')
+DONE_RX = re.compile(
+    u'(?u)^(\\s*)(?:(\\+|✓|✔|☑|√|\\[x\\])(\\s+(?:[^\\@\\n]|(?<!\\s)\\@|\\@(?=\\s))*)([^\\n]*))'
+    u'|^(\\s*)(?:(-)(\\s+(?:[^\\@]|(?<!\\s)\\@|\\@(?=\\s))*)(.*\\@done(?=\\s|\\(|$)[^\\n]*))')
+CANCELLED_RX = re.compile(
+    u'(?u)^(\\s*)(?:(✘|x|\\[-\\])(\\s+(?:[^\\@\\n]|(?<!\\s)\\@|\\@(?=\\s))*)(.*))'
+    u'|^(\\s*)(?:(-)(\\s+(?:[^\\@]|(?<!\\s)\\@|\\@(?=\\s))*)(.*\\@cancelled(?=\\s|\\(|$)[^\\n]*))')
+NOTE_RX = re.compile(u'(?u)^\\s*(?!-|\\+|✓|✔|√|❍|❑|■|□|☐|▪|▫|–|—|≡|→|›|\\[[\\sx-]\\]|＿|✘|(x\\s+))(?=\\S)')
+OPEN_RX = re.compile(
+    u'(?u)^(\\s*)(-|❍|❑|■|□|☐|▪|▫|–|—|≡|→|›|\\[\\s\\])'
+    u'(?=(\\s+(?:[^\\@\\n]|(?<![ \\t])\\@)*)(?!([^\\n]*)?(\\@done|\\@cancelled)[\\s\\(]))')
+ARCHIVE_RX = re.compile(u'^＿+$')
+SEPARATOR_RX = re.compile(r'^\s*---.{3,5}---+$')
+
+# inline rules, named groups are tokens; order is the order of includes in syntax
+ITALIC = r'(?P<italic>(?<!\S)(?P<im>[*_])(?!(?P=im)|\s).*?(?<=\S)(?P=im)(?!(?P=im)|\w))'
+BOLD = r'(?P<bold>(?<!\S)(?P<bm>\*\*|__)(?=\S).*?(?<=\S)(?P=bm)(?!\w))'
+URL = r'(?P<url>(?<!\S)<\w+?(?!\s)[.:](?!\s)[^\n]+?>)'
+TAG_PATTERN = r'(?<=\s)\@(?!(?:high|today|critical|low|completed|done)(?:[\s(]|$))[\w.()\-!? :+]+[ \t]*'
+TAG = r'(?P<tag>%s)' % TAG_PATTERN
+TODAY = u'(?P<today>(?<=\\s)\\@today|✭ᴛᴏᴅᴀʏ)'
+LOW = u'(?P<low>(?<=\\s)\\@low|✭low)'
+HIGH = u'(?P<high>(?<=\\s)\\@high|✭high)'
+CRITICAL = u'(?P<critical>(?<=\\s)\\@critical|✭critical)'
+
+# leading lookahead lets re skip plain characters without trying every alternative
+NOTE_INLINE_RX = re.compile(u'(?u)(?=[*_<])(?:' + u'|'.join((ITALIC, BOLD, URL)) + u')')
+OPEN_INLINE_RX = re.compile(u'(?u)(?=[*_<@✭])(?:' + u'|'.join((ITALIC, BOLD, URL, TAG, TODAY, LOW, HIGH, CRITICAL)) + u')')
+INLINE_TOKENS = ('italic', 'bold', 'url', 'tag', 'today', 'low', 'high', 'critical')
+
+
+def classify(line):
+    '''Return kind of line (without line break) and match object of its rule, if any'''
+    for kind, rx in ((HEADER, HEADER_RX), (DONE, DONE_RX), (CANCELLED, CANCELLED_RX),
+                     (NOTE, NOTE_RX), (OPEN, OPEN_RX),
+                     (ARCHIVE, ARCHIVE_RX), (SEPARATOR, SEPARATOR_RX)):
+        match = rx.match(line)
+        if match:
+            return kind, match
+    return EMPTY, None
+
+
+def bullet_span(line):
+    '''Return (start, end) of bullet if line is task, otherwise None'''
+    kind, match = classify(line)
+    if kind == OPEN:
+        return match.span(2)
+    if kind in (DONE, CANCELLED):
+        return match.span(2 if match.group(2) is not None else 6)
+    return None
+
+
+def split_inline(text, rx, runs):
+    '''append ('text'|inline token, fragment) tuples to runs, one regex pass'''
+    pos = 0
+    for match in rx.finditer(text):
+        if match.start() > pos:
+            runs.append(('text', text[pos:match.start()]))
+        # outer group of token closes last
+        runs.append((match.lastgroup, match.group(0)))
+        pos = match.end()
+    if pos < len(text):
+        runs.append(('text', text[pos:]))
+    return runs
+
+
+def tokenize(line):
+    '''Return tuple of two elements
+    Unicode
+        kind of line, one of module constants
+    list
+        of (token, fragment) tuples, fragments joined together are the line;
+        token is 'indent', 'bullet', 'text', 'tag' or one of INLINE_TOKENS
+    '''
+    kind, match = classify(line)
+    if kind in (DONE, CANCELLED):
+        groups = match.groups()
+        indent, bullet, text, tags = groups[:4] if groups[1] is not None else groups[4:]
+        runs = [('indent', indent), ('bullet', bullet), ('text', text), ('tag', tags)]
+        return kind, [r for r in runs if r[1]]
+    if kind == OPEN:
+        runs = [('indent', match.group(1)), ('bullet', match.group(2))]
+        return kind, split_inline(line[match.end():], OPEN_INLINE_RX, [r for r in runs if r[1]])
+    if kind == NOTE:
+        return kind, split_inline(line, NOTE_INLINE_RX, [])
+    return kind, [('text', line)] if line else []
+
+
+def iter_lines(text):
+    '''generator of lines of text (w/o line breaks), does not build list of all lines'''
+    start = 0
+    end = text.find('\n')
+    while end >= 0:
+        yield text[start:end]
+        start = end + 1
+        end = text.find('\n', start)
+    yield text[start:]
+
+
+def tokenize_lines(text):
+    '''generator of (kind, runs) for every line of text'''
+    for line in iter_lines(text):
+        yield tokenize(line)
+
+
+def indentation(line, tab_size=4):
+    '''width of leading whitespace, tabs are expanded'''
+    width = 0
+    for c in line:
+        if c == ' ':
+            width += 1
+        elif c == '\t':
+            width += tab_size - width % tab_size
+        else:
+            break
+    return width
+
+
+LINE_BREAK_RX = re.compile('\n')
+
+
+def line_starts(text, start=0, end=None):
+    '''array of offsets right after each line break in text[start:end]'''
+    return array('l', [m.end() for m in LINE_BREAK_RX.finditer(text, start, len(text) if end is None else end)])
+
+
+class Outline(object):
+    '''Text of buffer with table of line start offsets and kind of every line;
+    both are built on first use, i.e. in whatever thread asks first,
+    so row and line lookups are bisections without asking the editor;
+    the lock makes threads analysing the same outline build each of them once'''
+    def __init__(self, text, starts=None, kinds=None):
+        self.text = text
+        self._starts = starts
+        self._kinds = kinds
+        self._parents = {}
+        self._tags = None
+        self._lock = threading.RLock()
+
+    @property
+    def starts(self):
+        if self._starts is None:
+            with self._lock:
+                if self._starts is None:
+                    starts = array('l', [0])
+                    starts.extend(line_starts(self.text))
+                    self._starts = starts
+        return self._starts
+
+    @property
+    def kinds(self):
+        if self._kinds is None:
+            with self._lock:
+                if self._kinds is None:
+                    self._kinds = [classify(line)[0] for line in iter_lines(self.text)]
+        return self._kinds
+
+    @property
+    def tags(self):
+        '''list of (token, start, end, line index) of tags of pending tasks, see pending_tags'''
+        if self._tags is None:
+            with self._lock:
+                if self._tags is None:
+                    self._tags = list(pending_tags(self))
+        return self._tags
+
+    def edit(self, a, b, string):
+        '''Return Outline of text with text[a:b] replaced by string;
+        line table is shifted and only lines touched by edit are classified again'''
+        text = self.text[:a] + string + self.text[b:]
+        if self._starts is None and self._kinds is None:
+            return Outline(text)
+        first, last = self.line_index(a), self.line_index(b)
+        delta = len(string) - (b - a)
+        starts = self.starts[:first + 1]
+        starts.extend(line_starts(text, starts[-1], a + len(string)))
+        added = len(starts) - first
+        tail = self.starts[last + 1:]
+        starts.extend(array('l', [s + delta for s in tail]) if delta else tail)
+        kinds = None
+        if self._kinds is not None:
+            ends = list(starts[first + 1:first + added]) + [len(text) + 1 if last + 1 >= len(self.starts) else starts[first + added]]
+            touched = [classify(text[s:e - 1])[0] for s, e in zip(starts[first:first + added], ends)]
+            kinds = self._kinds[:first] + touched + self._kinds[last + 1:]
+        return Outline(text, starts, kinds)
+
+    def lines(self):
+        '''generator of (offset, line, kind)'''
+        return zip(self.starts, iter_lines(self.text), self.kinds)
+
+    def line_start(self, point):
+        return self.starts[bisect_right(self.starts, point) - 1]
+
+    def rowcol(self, point):
+        row = bisect_right(self.starts, point) - 1
+        return row, point - self.starts[row]
+
+    def kind_at(self, point):
+        return self.kinds[bisect_right(self.starts, point) - 1]
+
+    def line_index(self, point):
+        return bisect_right(self.starts, point) - 1
+
+    def line(self, index):
+        return self.text[self.starts[index]:self.line_end(index)]
+
+    def line_end(self, index):
+        '''point of line break (or end of text) of line'''
+        return self.starts[index + 1] - 1 if index + 1 < len(self.starts) else len(self.text)
+
+    def notes(self, index):
+        '''indexes of notes right below line'''
+        kinds, found = self.kinds, []
+        index += 1
+        while index < len(kinds) and kinds[index] == NOTE:
+            found.append(index)
+            index += 1
+        return found
+
+    def parents(self, tab_size=4):
+        '''Return list, for each line index of the closest line above with smaller indentation;
+        None for blank lines and lines without such parent'''
+        if tab_size not in self._parents:
+            with self._lock:
+                if tab_size not in self._parents:
+                    parents, stack = [], []  # stack of (indentation, index)
+                    for index, line in enumerate(iter_lines(self.text)):
+                        if not line.strip():
+                            parents.append(None)
+                            continue
+                        width = indentation(line, tab_size)
+                        while stack and stack[-1][0] >= width:
+                            stack.pop()
+                        parents.append(stack[-1][1] if stack else None)
+                        stack.append((width, index))
+                    self._parents[tab_size] = parents
+        return self._parents[tab_size]
+
+    def count(self, kind, limit=None):
+        '''amount of lines of kind, which begin before limit if any'''
+        kinds = self.kinds if limit is None else self.kinds[:bisect_right(self.starts, limit - 1)]
+        return kinds.count(kind)
+
+
+DUE_RX = re.compile(r'@due(\([^@\n]*\))')
+# due tag with its trailing blanks, like tag scope; 1: parentheses, 2: within parentheses
+DUE_TAG_PATTERN = r'(?<=\s)@due(\(([^@\n()]*)\))[ \t]*'
+DUE_TAG_RX = re.compile(DUE_TAG_PATTERN)
+
+
+def due_tags(outline, kinds=(OPEN,)):
+    '''generator of (start, end, line, string in parentheses) for @due in lines of kinds'''
+    for offset, line, kind in outline.lines():
+        if kind in kinds and '@due(' in line:
+            for match in DUE_RX.finditer(line):
+                yield offset + match.start(), offset + match.end(), line, match.group(1)
+
+
+PRIORITY_TOKENS = ('critical', 'high', 'low', 'today')
+
+
+TAG_TOKENS = ('tag',) + PRIORITY_TOKENS
+
+
+def pending_tags(outline):
+    '''generator of (token, start, end, line index) for tags of pending tasks, in order of text'''
+    for index, (offset, line, kind) in enumerate(outline.lines()):
+        if kind != OPEN or not ('@' in line or u'✭' in line):
+            continue
+        for token, fragment in tokenize(line)[1]:
+            if token in TAG_TOKENS:
+                yield token, offset, offset + len(fragment), index
+            offset += len(fragment)
+
+
+def priority_tags(outline):
+    '''Return {token: [(start, end)]} for @critical, @high, @low and @today of pending tasks,
+    tags of the same token within a line are coalesced into one range, as gutter has one icon per line'''
+    found = dict((token, []) for token in PRIORITY_TOKENS)
+    lines = dict((token, None) for token in PRIORITY_TOKENS)  # line of last range of token
+    for token, start, end, index in outline.tags:
+        if token == 'tag':
+            continue
+        ranges = found[token]
+        if lines[token] == index:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+            lines[token] = index
+    return found
+
+
+def with_context(outline, lines, tab_size=4):
+    '''Return sorted indexes of given lines, notes right below each of them
+    and projects (or separators) they are nested in'''
+    kinds, parents = outline.kinds, outline.parents(tab_size)
+    visible = set()
+
+    def add(index):
+        visible.add(index)
+        visible.update(outline.notes(index))
+
+    walked = set()  # lines whose parents are already added
+    for index in lines:
+        add(index)
+        while index is not None and index not in walked:
+            walked.add(index)
+            index = parents[index]
+            if index is not None and kinds[index] in (HEADER, SEPARATOR):
+                add(index)
+    return sorted(visible)
+
+
+def fold_ranges(visible, size):
+    '''Return (start, end) ranges to fold, so that only visible ranges remain;
+    visible is sorted list of (start, end) of lines, line breaks around them are kept'''
+    folds = []
+    start = 0
+    for a, b in visible:
+        if start < a - 1:
+            folds.append((start, a - 1))
+        start = max(start, b + 1)
+    if start < size:
+        folds.append((start, size))
+    return folds
+
+
+# tags whose values are dates or times, only their names are worth completing
+DATED_TAGS = ('done', 'cancelled', 'created', 'due', 'started', 'toggle', 'lasted', 'wasted', 'total')
+# 1: name, 2: parentheses if any
+TAG_NAME_RX = re.compile(r'(?u)\s@([\w.\-!?+]+)(\([^@\n()]*\))?')
+
+
+def tag_counts(text):
+    '''Return {tag w/o @: amount} for every tag in text, tags with value are counted
+    both as name and name(value) unless value is date'''
+    counts = {}
+    for name, value in TAG_NAME_RX.findall(text):
+        counts[name] = counts.get(name, 0) + 1
+        if value and name not in DATED_TAGS:
+            tag = name + value
+            counts[tag] = counts.get(tag, 0) + 1
+    return counts
+
+
+class TrieNode(object):
+    __slots__ = ('children', 'count', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.count = 0
+        self.top = None  # ranked (tag, count) of subtree, reset on update below node
+
+
+class TagTrie(object):
+    '''Tags with usage counts; complete(prefix) costs a walk along prefix
+    while ranking of a node is cached until some tag below it changes'''
+    TOP = 50
+
+    def __init__(self):
+        self.root = TrieNode()
+
+    def update(self, counts, sign=1):
+        '''add counts ({tag: amount}) or subtract them if sign is -1;
+        nodes left without count and children are removed, e.g. of half-typed tags'''
+        for tag, amount in counts.items():
+            node, path = self.root, []
+            node.top = None
+            for char in tag:
+                path.append((node, char))
+                node = node.children.setdefault(char, TrieNode())
+                node.top = None
+            node.count += sign * amount
+            while path and node.count <= 0 and not node.children:
+                node, char = path.pop()
+                del node.children[char]
+
+    def complete(self, prefix, limit=20):
+        '''Return list of (tag, count) starting with prefix, most used first'''
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        if node.top is None:
+            found = []
+            stack = [(prefix, node)]
+            while stack:
+                tag, current = stack.pop()
+                if current.count > 0:
+                    found.append((tag, current.count))
+                stack.extend((tag + char, child) for char, child in current.children.items())
+            found.sort(key=lambda t: (-t[1], t[0]))
+            node.top = found[:self.TOP]
+        return node.top[:limit]
+
+
+def count_changes(old, new):
+    '''Return {tag: delta} to turn counts old into new'''
+    changes = dict((tag, amount - old.get(tag, 0)) for tag, amount in new.items() if amount != old.get(tag, 0))
+    changes.update((tag, -amount) for tag, amount in old.items() if tag not in new)
+    return changes
@@ -0,0 +1,510 @@
+# coding: utf-8
+"""Queries over tasks of PlainTasks document, e.g.
+
+    @high and not @waiting and due < 3d and project ~ "Backend"
+
+Query is compiled once into a function evaluated against ``TaskIndex``:
+tags, dates and projects are looked up in indexes built in one pass
+over the outline, so most terms cost a set operation rather than a scan.
+Compiled with ``words=True`` (search), bare words are looked up in
+inverted index of words of lines.
+Module must not import ``sublime``.
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from functools import reduce
+
+try:
+    from .todo_parser import indentation, HEADER, NOTE, OPEN, DONE, CANCELLED, OPEN_RX, line_starts
+except (ValueError, ImportError):  # ST2 or imported as top level module
+    from todo_parser import indentation, HEADER, NOTE, OPEN, DONE, CANCELLED, OPEN_RX, line_starts
+
+TASKS = (OPEN, DONE, CANCELLED)
+STATES = {'open': OPEN, 'pending': OPEN, 'done': DONE, 'cancelled': CANCELLED,
+          'note': NOTE, 'project': HEADER}
+# tags whose dates are compared by date term, due ones are compared by due term as well
+DATE_TAGS = ('due', 'done', 'cancelled', 'created', 'started')
+WORD_RX = re.compile(r'(?u)\w+')
+# 1: name, 2: parentheses if any
+TAG_RX = re.compile(r'(?u)\s@([\w.\-!?+]+)(\([^@\n]*\))?')
+PROJECT_NAME_RX = re.compile(r'(?u)^\s*(.*?):\s*?(@[^\s]+(\(.*?\))?\s*?)*$')
+
+
+class QueryError(ValueError):
+    '''query can not be compiled, position is offset in query string'''
+    def __init__(self, message, position):
+        ValueError.__init__(self, u'%s at %d' % (message, position))
+        self.position = position
+
+
+class TaskIndex(object):
+    '''Lines of kinds (tasks by default) of outline, a line is referred to by its position in lines
+    lines
+        line index of every indexed line, ascending
+    tags
+        {lowercase name of tag w/o @: set of positions}
+    due_dates, due_positions
+        parsed dates of @due, ascending, and positions of their lines
+    dates, date_positions
+        the same for all DATE_TAGS
+    projects
+        list of (name, first position, end position) of lines nested in each project
+    words, vocabulary
+        {lowercase word: list of positions} and its sorted keys, built on first use
+    parse_date(text in parentheses, line) must return datetime or None
+    '''
+    def __init__(self, outline, parse_date=None, tab_size=4, kinds=TASKS):
+        self.outline = outline
+        self.lines, self.tags, self.projects = [], {}, []
+        self.states = dict((kind, set()) for kind in kinds)
+        self._words = self._vocabulary = None
+        dates, parsed = [], {}
+        open_projects = []  # stack of (indentation, name, first position)
+        for index, (offset, line, kind) in enumerate(outline.lines()):
+            if not line.strip():
+                continue
+            width = indentation(line, tab_size)
+            while open_projects and open_projects[-1][0] >= width:
+                _, name, first = open_projects.pop()
+                self.projects.append((name, first, len(self.lines)))
+            if kind == HEADER:
+                open_projects.append((width, PROJECT_NAME_RX.match(line).group(1), len(self.lines)))
+            if kind not in kinds:
+                continue
+            position = len(self.lines)
+            self.lines.append(index)
+            self.states[kind].add(position)
+            if '@' not in line:
+                continue
+            for name, text in TAG_RX.findall(line):
+                name = name.lower()
+                self.tags.setdefault(name, set()).add(position)
+                if name in DATE_TAGS and text and parse_date:
+                    # relative dates depend on the line, others are often repeated
+                    date = parsed[text] if text in parsed else parse_date(text, line)
+                    if '+' not in text:
+                        parsed[text] = date
+                    if date:
+                        dates.append((date, position, name == 'due'))
+        for _, name, first in open_projects:
+            self.projects.append((name, first, len(self.lines)))
+        dates.sort()
+        self.dates = [d for d, _, _ in dates]
+        self.date_positions = [p for _, p, _ in dates]
+        self.due_dates = [d for d, _, due in dates if due]
+        self.due_positions = [p for _, p, due in dates if due]
+        self.all = set(range(len(self.lines)))
+
+    @property
+    def words(self):
+        if self._words is None:
+            words, outline = {}, self.outline
+            for position, index in enumerate(self.lines):
+                for word in set(WORD_RX.findall(outline.line(index).lower())):
+                    positions = words.get(word)
+                    if positions is None:
+                        words[word] = [position]
+                    else:
+                        positions.append(position)
+            self._vocabulary = sorted(words)
+            self._words = words
+        return self._words
+
+    @property
+    def vocabulary(self):
+        self.words
+        return self._vocabulary
+
+    def select(self, query, now=None):
+        '''Return sorted line indexes of tasks matching query (string or compiled)'''
+        if not callable(query):
+            query = compile_query(query)
+        return [self.lines[p] for p in sorted(query(self, now or datetime.now()))]
+
+
+# compiled terms are functions (index, now) -> set of positions
+
+def tag_term(name):
+    return lambda index, now: index.tags.get(name, set())
+
+
+def state_term(kind):
+    return lambda index, now: index.states.get(kind, set())
+
+
+def date_term(field, op, value):
+    '''value is timedelta from now or datetime; field is "due" or "date"'''
+    def term(index, now):
+        limit = now + value if isinstance(value, timedelta) else value
+        dates, positions = ((index.due_dates, index.due_positions) if field == 'due' else
+                            (index.dates, index.date_positions))
+        if op in ('<', '<='):
+            return set(positions[:(bisect_left if op == '<' else bisect_right)(dates, limit)])
+        return set(positions[(bisect_right if op == '>' else bisect_left)(dates, limit):])
+    return term
+
+
+def word_term(prefix):
+    '''lines with a word starting with lowercase prefix'''
+    def term(index, now):
+        words, vocabulary, found = index.words, index.vocabulary, set()
+        for i in range(bisect_left(vocabulary, prefix), len(vocabulary)):
+            if not vocabulary[i].startswith(prefix):
+                break
+            found.update(words[vocabulary[i]])
+        return found
+    return term
+
+
+def project_term(rx):
+    def term(index, now):
+        found = set()
+        for name, first, end in index.projects:
+            if rx.search(name):
+                found.update(range(first, end))
+        return found
+    return term
+
+
+def text_term(rx):
+    '''rx is searched in whole text, after each match search continues from next line'''
+    def term(index, now):
+        outline, lines, found = index.outline, index.lines, set()
+        match = rx.search(outline.text)
+        while match:
+            line = outline.line_index(match.start())
+            position = bisect_left(lines, line)
+            if position < len(lines) and lines[position] == line:
+                found.add(position)
+            match = rx.search(outline.text, outline.line_end(line) + 1)
+        return found
+    return term
+
+
+def and_term(left, right):
+    return lambda index, now: left(index, now) & right(index, now)
+
+
+def or_term(left, right):
+    return lambda index, now: left(index, now) | right(index, now)
+
+
+def not_term(term):
+    return lambda index, now: index.all - term(index, now)
+
+
+TOKEN_RX = re.compile(r'''(?u)\s*(?:
+    (?P<tag>@[\w.\-!?+]+)
+   |(?P<string>"(?:[^"\\]|\\.)*"|'[^']*')
+   |(?P<op><=|>=|[<>=~()])
+   |(?P<date>\d{4}-\d\d?-\d\d?\b)
+   |(?P<word>[-+]?[\w.]+)
+   )''', re.X)
+DURATION_RX = re.compile(r'^([-+]?\d+(?:\.\d+)?)([hdw]?)$')
+UNITS = {'h': 'hours', 'd': 'days', '': 'days', 'w': 'weeks'}
+FIELDS = ('due', 'date', 'project', 'text')
+
+
+def tokenize_query(query):
+    '''Return list of (kind, value, position), kind is tag, string, op, date, word or end'''
+    tokens = []
+    pos = 0
+    query = query.rstrip()
+    while pos < len(query):
+        match = TOKEN_RX.match(query, pos)
+        if not match:
+            raise QueryError(u'Unexpected "%s"' % query[pos:].strip()[:1], pos)
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = re.sub(r'\\(["\\])', r'\1', value[1:-1]) if value[0] == '"' else value[1:-1]
+        tokens.append((kind, value, match.start(kind)))
+        pos = match.end()
+    tokens.append(('end', None, len(query)))
+    return tokens
+
+
+class Parser(object):
+    '''Recursive descent, precedence is not > and > or;
+    terms placed side by side are joined with and; if words, bare words are word terms'''
+    def __init__(self, query, words=False):
+        self.tokens = tokenize_query(query)
+        self.pos = 0
+        self.words = words
+
+    def peek(self):
+        return self.tokens[self.pos]
+
+    def take(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def is_word(self, *words):
+        kind, value, _ = self.peek()
+        return kind == 'word' and value.lower() in words
+
+    def parse(self):
+        term = self.parse_or()
+        kind, value, position = self.peek()
+        if kind != 'end':
+            raise QueryError(u'Unexpected "%s"' % value, position)
+        return term
+
+    def parse_or(self):
+        term = self.parse_and()
+        while self.is_word('or'):
+            self.take()
+            term = or_term(term, self.parse_and())
+        return term
+
+    def parse_and(self):
+        term = self.parse_not()
+        while True:
+            if self.is_word('and'):
+                self.take()
+            elif self.peek()[0] == 'end' or self.peek()[1] == ')' or self.is_word('or'):
+                return term
+            term = and_term(term, self.parse_not())
+
+    def parse_not(self):
+        if self.is_word('not'):
+            self.take()
+            return not_term(self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        kind, value, position = self.take()
+        if kind == 'tag':
+            return tag_term(value[1:].lower())
+        if kind == 'string':
+            return text_term(self.pattern('~', re.escape(value)))
+        if kind == 'op' and value == '(':
+            term = self.parse_or()
+            kind, value, position = self.take()
+            if value != ')':
+                raise QueryError(u'Expected ")"', position)
+            return term
+        if kind == 'word':
+            word = value.lower()
+            followed_by_op = self.peek()[0] == 'op' and self.peek()[1] not in '()'
+            if word in STATES and not (word in FIELDS and followed_by_op):
+                return state_term(STATES[word])
+            if word in FIELDS:
+                return self.parse_comparison(word)
+        if kind in ('word', 'date') and self.words and WORD_RX.search(value):
+            return reduce(and_term, [word_term(w) for w in WORD_RX.findall(value.lower())])
+        raise QueryError(u'Unexpected "%s"' % (value or 'end of query'), position)
+
+    def parse_comparison(self, field):
+        kind, op, position = self.take()
+        if kind != 'op' or op in '()':
+            raise QueryError(u'Expected operator after "%s"' % field, position)
+        kind, value, position = self.take()
+        if kind not in ('word', 'string', 'date'):
+            raise QueryError(u'Expected value after "%s %s"' % (field, op), position)
+        if field in ('due', 'date'):
+            match = DURATION_RX.match(value)
+            if op not in ('<', '<=', '>', '>=') or not (match or kind == 'date'):
+                raise QueryError(u'%s expects <, <=, >, >= and period like 3d, 12h, 2w or date like 2016-12-31' % field, position)
+            if match:
+                return date_term(field, op, timedelta(**{UNITS[match.group(2)]: float(match.group(1))}))
+            try:
+                day = datetime.strptime(value, '%Y-%m-%d')
+            except ValueError as e:
+                raise QueryError(u'Invalid date "%s": %s' % (value, e), position)
+            if op in ('<=', '>'):  # the whole day
+                op, day = ('<' if op == '<=' else '>='), day + timedelta(days=1)
+            return date_term(field, op, day)
+        if op not in ('=', '~'):
+            raise QueryError(u'%s expects = or ~' % field, position)
+        rx = self.pattern(op, value, position)
+        return project_term(rx) if field == 'project' else text_term(rx)
+
+    def pattern(self, op, value, position=0):
+        '''= is case insensitive equality (but of surrounding blanks), ~ is case insensitive regex search'''
+        if op == '=':
+            value = r'^[ \t]*%s[ \t]*$' % re.escape(value)
+        try:
+            return re.compile(value, re.I | re.M | re.U)
+        except re.error as e:
+            raise QueryError(u'Invalid pattern "%s": %s' % (value, e), position)
+
+
+COMPILED = {}
+COMPILED_SIZE = 64
+
+
+def compile_query(query, words=False):
+    '''Return function (index, now) -> set of positions of matching lines,
+    raises QueryError'''
+    key = (query, words)
+    if key not in COMPILED:
+        if len(COMPILED) >= COMPILED_SIZE:
+            COMPILED.clear()
+        COMPILED[key] = Parser(query, words).parse()
+    return COMPILED[key]
+
+
+# fuzzy go to: characters of pattern must appear in text in order, case insensitive
+
+def char_mask(text):
+    '''bit per character (modulo 64) of text; text may contain pattern
+    only if its mask has all bits of mask of pattern'''
+    mask = 0
+    for c in set(text):
+        mask |= 1 << (ord(c) & 63)
+    return mask
+
+
+def pair_mask(text):
+    '''bit per pair of adjacent characters (modulo 4096) of text, like char_mask'''
+    mask = 0
+    for a, b in set(zip(text, text[1:])):
+        mask |= 1 << ((ord(a) * 67 + ord(b)) & 4095)
+    return mask
+
+
+# initials of words and line breaks
+INITIALS_RX = re.compile(r'(?u)(?<!\w)\w|\n')
+
+
+# lookbehind follows the literal, which lets re search for the literal quickly
+def literal_after(before, text):
+    '''pattern of text not preceded by before'''
+    return u'%s(?<!%s%s)' % (re.escape(text), before, re.escape(text))
+
+
+def in_order(parts):
+    return u'[^\n]*?'.join(parts)
+
+
+class FuzzyIndex(object):
+    '''Texts to go to, entries are (text, depth, payload), depth is amount of enclosing projects.
+    Lowercase texts are ordered by depth and length, and joined into blocks, each with masks
+    of its characters and pairs of characters: search skips blocks which can not match and
+    scans the rest with regular expressions'''
+    BLOCK = 128
+    PHRASE_MATCHES = 1000  # up to so many texts containing pattern are sorted into tiers in one scan
+
+    def __init__(self, entries=()):
+        self.entries = []
+        self._blocks = None
+        self.extend(entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def extend(self, entries):
+        self.entries.extend(entries)
+        self._blocks = None
+
+    @property
+    def blocks(self):
+        '''list of (char mask, pair mask, (text, starts), (initials, starts), position of first),
+        text is lowercase texts joined with line breaks, starts are offsets of texts in it'''
+        if self._blocks is None:
+            self.entries.sort(key=lambda e: (e[1], len(e[0])))
+            blocks = []
+            for first in range(0, len(self.entries), self.BLOCK):
+                text = u'\n'.join(e[0] for e in self.entries[first:first + self.BLOCK]).lower()
+                initials = u''.join(INITIALS_RX.findall(text))
+                blocks.append((char_mask(text), pair_mask(text),
+                               (text, [0] + line_starts(text).tolist()),
+                               (initials, [0] + line_starts(initials).tolist()), first))
+            self._blocks = blocks
+        return self._blocks
+
+    def scan(self, rx, blocks, initials=False):
+        '''generator of (position, first match) of texts matching rx'''
+        for block in blocks:
+            text, starts = block[3] if initials else block[2]
+            match = rx.search(text)
+            while match:
+                line = bisect_right(starts, match.start()) - 1
+                yield block[4] + line, match
+                if line + 1 == len(starts):
+                    break
+                match = rx.search(text, starts[line + 1])
+
+    def search(self, pattern, limit=100):
+        '''Return up to limit best entries matching pattern, best first'''
+        return [entry for _, entry in self.ranked(pattern, limit)]
+
+    def ranked(self, pattern, limit=100):
+        '''Return list of up to limit (tier, entry) matching pattern (case insensitive, blanks
+        are ignored but between words), best first; tiers are texts starting with pattern (0),
+        with a word starting with it, containing it, with words (or letters) of pattern at
+        word starts, with letters of pattern in order (4); then ranked by depth and length'''
+        words = pattern.lower().split()
+        blocks = self.blocks
+        if not words:
+            return [(0, entry) for entry in self.entries[:limit]]
+        phrase = u' '.join(words)
+        mask, pairs = char_mask(u''.join(words)), pair_mask(phrase)
+        blocks = [b for b in blocks if b[0] & mask == mask]
+        phrase_blocks = [b for b in blocks if b[1] & pairs == pairs]
+        compile = lambda rx: re.compile(rx, re.U)
+        at_start, at_word = compile(literal_after(u'[^\n]', phrase)), compile(literal_after(u'\\w', phrase))
+
+        # usually few texts contain pattern, then one scan sorts them out
+        matches, contains = [], compile(re.escape(phrase))
+        for position, match in self.scan(contains, phrase_blocks):
+            matches.append((position, match))
+            if len(matches) > self.PHRASE_MATCHES:
+                break
+        if len(matches) <= self.PHRASE_MATCHES:
+            tiers = ([], [], [])
+            for position, match in matches:
+                text, start = match.string, match.start()
+                end = text.find(u'\n', start)
+                if at_start.match(text, start):
+                    tiers[0].append(position)
+                elif at_word.search(text, start, len(text) if end < 0 else end):
+                    tiers[1].append(position)
+                else:
+                    tiers[2].append(position)
+            sources = list(tiers)
+        else:
+            sources = [(p for p, _ in self.scan(rx, phrase_blocks)) for rx in (at_start, at_word, contains)]
+        if len(words) == 1 or all(len(w) == 1 for w in words):
+            initials = compile(in_order(re.escape(c) for c in u''.join(words)))
+            sources.append(p for p, _ in self.scan(initials, blocks, initials=True))
+        else:
+            initials = compile(in_order(literal_after(u'\\w', w) for w in words))
+            sources.append(p for p, _ in self.scan(initials, blocks))
+        letters = compile(in_order(re.escape(c) for c in u''.join(words)))
+        sources.append(p for p, _ in self.scan(letters, blocks))
+
+        found, seen = [], set()
+        for tier, source in enumerate(sources):
+            for position in source:
+                if position not in seen:
+                    seen.add(position)
+                    found.append((tier, self.entries[position]))
+                    if len(found) >= limit:
+                        return found
+        return found
+
+
+def fuzzy_entries(outline, tab_size=4):
+    '''generator of (text, depth, line index, names of enclosing projects joined with " / ")
+    for projects and pending tasks (w/o bullet); depth is amount of enclosing projects'''
+    kinds, parents = outline.kinds, outline.parents(tab_size)
+    projects = {}  # {line index of project: (its depth, path including it)}
+    for index, kind in enumerate(kinds):
+        if kind != HEADER and kind != OPEN:
+            continue
+        parent = parents[index]
+        while parent is not None and kinds[parent] != HEADER:
+            parent = parents[parent]
+        depth, path = projects[parent] if parent is not None else (-1, u'')
+        line = outline.line(index)
+        if kind == HEADER:
+            name = PROJECT_NAME_RX.match(line).group(1)
+            projects[index] = (depth + 1, u'%s / %s' % (path, name) if path else name)
+            yield line.strip(), depth + 1, index, path
+        else:
+            yield line[OPEN_RX.match(line).end():].strip(), depth + 1, index, path